@@ -1,19 +1,27 @@
 # --- START OF FILE: app/agents/tools.py (เวอร์ชัน Google Tools) ---
-from langchain.tools import Tool
+from functools import lru_cache
+
 from app.services import gemini_service, video_service, image_generation_service, tts_service
 
+# langchain โหลดเมื่อมีคนขอ tool ครั้งแรกเท่านั้น (import app.agents.tools ไม่ต้องจ่ายเวลา import langchain)
+# ใช้งานเหมือนเดิม: from app.agents.tools import agent_tools
+
+
 # --- นิยามเครื่องมือแต่ละชิ้น ---
+@lru_cache(maxsize=None)
+def _story_creator_tool():
+    from langchain.tools import Tool
 
-# Tool ที่ 1: สร้างสคริปต์และ Prompt รูปภาพ
-story_creator_tool = Tool(
-    name="story_and_image_prompt_creator",
-    func=lambda user_prompt: gemini_service.generate_full_script(user_prompt=user_prompt, image_style="Pixar"),
-    description="""
-    Useful for when you need to write a children's story and generate image prompts based on a user's idea.
-    The input should be a single string describing the user's idea for the story.
-    Returns a dictionary containing 'story_script' and 'image_prompts'.
-    """
-)
+    # Tool ที่ 1: สร้างสคริปต์และ Prompt รูปภาพ
+    return Tool(
+        name="story_and_image_prompt_creator",
+        func=lambda user_prompt: gemini_service.generate_full_script(user_prompt=user_prompt, image_style="Pixar"),
+        description="""
+        Useful for when you need to write a children's story and generate image prompts based on a user's idea.
+        The input should be a single string describing the user's idea for the story.
+        Returns a dictionary containing 'story_script' and 'image_prompts'.
+        """
+    )
 
 # Tool ที่ 2 (เตรียมสำหรับอนาคต): สร้างรูปภาพจาก Prompt
 # หมายเหตุ: เราต้องปรับ image_generation_service เล็กน้อยให้รับ input เป็น list ได้
@@ -34,6 +42,16 @@ story_creator_tool = Tool(
 
 # รวบรวมเครื่องมือทั้งหมดที่ Agent สามารถใช้ได้
 # ตอนนี้เราจะเปิดใช้งานแค่ story_creator_tool ก่อน
-agent_tools = [story_creator_tool]
+def get_agent_tools() -> list:
+    return [_story_creator_tool()]
+
+
+def __getattr__(name: str):
+    # ชื่อเดิมของ module (story_creator_tool / agent_tools) สร้างเมื่อถูกเข้าถึงครั้งแรก
+    if name == "story_creator_tool":
+        return _story_creator_tool()
+    if name == "agent_tools":
+        return get_agent_tools()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # --- END OF FILE ---
\ No newline at end of file
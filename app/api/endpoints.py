@@ -1,51 +1,166 @@
 # --- START OF FILE: app/api/endpoints.py (เวอร์ชันแก้ไข read of closed file) ---
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Form, File, UploadFile
+from fastapi import APIRouter, HTTPException, Form, File, UploadFile, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import List
-import shelve
-from filelock import FileLock
+from typing import List, Optional
 import uuid
 import json
+import asyncio
 from pathlib import Path # [ใหม่] Import Pathlib
 import shutil # [ใหม่] Import shutil
 
-from app.services import agent_service, gemini_service
+from app import config
+from app.services import agent_service, gemini_service, job_repository, job_queue, job_events, upload_service, worker_pool, music_service, video_service, metrics, model_loop, rate_limiter
 
 router = APIRouter()
-DB_PATH = "job_statuses.db"
-LOCK_PATH = "job_statuses.db.lock"
 
 # === Endpoint หลักสำหรับ Workflow อัตโนมัติ (Magic Button) ===
 class AgentCreateRequest(BaseModel):
     prompt: str
     age_group: str = "5-7"
     voice_name: str = "en-US-Wavenet-C"
-    music_filename: str = "calm.mp3"
+    music_filename: str = "none"
     aspect_ratio: str = "9:16"
     music_volume: float = 0.3
     transition_style: str = "fade"
+    encoder_profile: Optional[str] = None  # draft / social / archive / adaptive (ไม่ส่ง = ค่าจาก config)
+
+def _validate_encoder_profile(encoder_profile: Optional[str]):
+    if encoder_profile and encoder_profile not in video_service.ENCODER_PROFILE_NAMES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown encoder profile '{encoder_profile}'. Available: {', '.join(video_service.ENCODER_PROFILE_NAMES)}"
+        )
 
 @router.post("/agent/create-video", status_code=202)
-async def agent_create_video_endpoint(request: AgentCreateRequest, background_tasks: BackgroundTasks):
+async def agent_create_video_endpoint(request: AgentCreateRequest):
+    try:
+        music_service.validate_music_filename(request.music_filename)
+    except music_service.UnknownMusicError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    _validate_encoder_profile(request.encoder_profile)
     try:
         job_id = agent_service.start_video_creation_job(
-            background_tasks=background_tasks, prompt=request.prompt, age_group=request.age_group,
+            prompt=request.prompt, age_group=request.age_group,
             voice_name=request.voice_name, music_filename=request.music_filename,
             aspect_ratio=request.aspect_ratio, music_volume=request.music_volume,
-            transition_style=request.transition_style
+            transition_style=request.transition_style, encoder_profile=request.encoder_profile
         )
         return {"message": "Video creation process started.", "job_id": job_id}
+    except job_queue.QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to start agent job: {str(e)}")
 
+# === Endpoint สำหรับสร้างหลายวิดีโอจาก request เดียว (ตั้งค่าเสียง/เพลง/ภาพร่วมกันทั้ง batch) ===
+class AgentBatchCreateRequest(BaseModel):
+    prompts: List[str]
+    age_group: str = "5-7"
+    voice_name: str = "en-US-Wavenet-C"
+    music_filename: str = "none"
+    aspect_ratio: str = "9:16"
+    music_volume: float = 0.3
+    transition_style: str = "fade"
+    encoder_profile: Optional[str] = None
+
+@router.post("/agent/create-batch", status_code=202)
+async def agent_create_batch_endpoint(request: AgentBatchCreateRequest):
+    prompts = [prompt.strip() for prompt in request.prompts if prompt.strip()]
+    if not prompts: raise HTTPException(status_code=400, detail="At least one prompt is required.")
+    if len(prompts) > config.BATCH_MAX_IDEAS:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {config.BATCH_MAX_IDEAS} prompts.")
+    try:
+        music_service.validate_music_filename(request.music_filename)
+    except music_service.UnknownMusicError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    _validate_encoder_profile(request.encoder_profile)
+    try:
+        batch = agent_service.start_batch_job(
+            prompts=prompts, age_group=request.age_group,
+            voice_name=request.voice_name, music_filename=request.music_filename,
+            aspect_ratio=request.aspect_ratio, music_volume=request.music_volume,
+            transition_style=request.transition_style, encoder_profile=request.encoder_profile
+        )
+        return {"message": "Batch video creation started.", **batch}
+    except job_queue.QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to start batch job: {str(e)}")
+
+@router.get("/batches/{batch_id}/status")
+async def get_batch_status(batch_id: str):
+    # สถานะรวมของ batch + สถานะของทุก job ใน batch (แต่ละ job ยังดูแยกได้ที่ /jobs/{job_id}/status)
+    batch = job_repository.get_batch(batch_id)
+    if not batch: raise HTTPException(status_code=404, detail="Batch ID not found.")
+    return batch
+
 # === Endpoint กลางสำหรับตรวจสอบสถานะ ===
 @router.get("/jobs/{job_id}/status")
 async def get_job_status(job_id: str):
-    with FileLock(LOCK_PATH, timeout=10):
-        with shelve.open(DB_PATH, flag='r') as job_statuses:
-            status = job_statuses.get(job_id)
-            if not status: raise HTTPException(status_code=404, detail="Job ID not found.")
-            return status
+    # อ่านจาก job_repository ได้เลยโดยไม่ต้องล็อก (SQLite WAL)
+    status = job_repository.get_job(job_id)
+    if not status: raise HTTPException(status_code=404, detail="Job ID not found.")
+    return status
+
+@router.post("/jobs/{job_id}/retry", status_code=202)
+async def retry_job(job_id: str):
+    # ทำต่อจากขั้นตอนแรกที่ยังไม่เสร็จ (plan/ภาพ/วิดีโอที่สร้างไว้แล้วจะถูกใช้ซ้ำ)
+    if not job_repository.get_job(job_id): raise HTTPException(status_code=404, detail="Job ID not found.")
+    try:
+        retried = agent_service.retry_job(job_id)
+    except job_queue.QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    if not retried: raise HTTPException(status_code=409, detail="Only failed jobs can be retried.")
+    return {"message": "Job queued for retry.", "job_id": job_id}
+
+# === Metrics สำหรับ Prometheus (ค่าของ process นี้ ดู app/services/metrics.py) ===
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # ความยาวคิวและขนาด cache อ่านจาก disk จึงไม่ทำใน event loop
+    body = await worker_pool.run_io_async(metrics.render)
+    return PlainTextResponse(body, media_type=metrics.CONTENT_TYPE)
+
+# === Endpoint แบบ push (Server-Sent Events) แทนการ poll /status ===
+FINAL_JOB_STATUSES = ("completed", "failed")
+
+def _sse(data: dict) -> str:
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    """
+    ส่งสถานะ Job ทุกครั้งที่มีการเปลี่ยนแปลง (stage, ภาพที่ i/N, % ของ ffmpeg, byte ที่อัปโหลด)
+    งานที่รันใน worker process อื่นจะไม่ publish มาที่นี่ จึงตรวจ updated_at ใน job_repository ทุก JOB_EVENTS_CHECK_SECONDS ด้วย
+    """
+    status = job_repository.get_job(job_id)
+    if not status: raise HTTPException(status_code=404, detail="Job ID not found.")
+
+    async def event_stream():
+        queue = job_events.subscribe(job_id)
+        try:
+            last_version = job_repository.get_job_version(job_id)
+            current = job_repository.get_job(job_id)
+            yield _sse(current)
+            while current.get("status") not in FINAL_JOB_STATUSES:
+                if await request.is_disconnected(): break
+                try:
+                    current = await asyncio.wait_for(queue.get(), timeout=config.JOB_EVENTS_CHECK_SECONDS)
+                    last_version = job_repository.get_job_version(job_id)
+                except asyncio.TimeoutError:
+                    version = job_repository.get_job_version(job_id)
+                    if version == last_version:
+                        yield ": keep-alive\n\n"
+                        continue
+                    last_version = version
+                    current = job_repository.get_job(job_id)
+                yield _sse(current)
+        finally:
+            job_events.unsubscribe(job_id, queue)
+
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # === Endpoint สำหรับ Workflow แบบ Manual ===
 class ManualScriptRequest(BaseModel):
@@ -55,55 +170,62 @@ class ManualScriptRequest(BaseModel):
 @router.post("/manual/generate-script", status_code=200)
 async def manual_generate_script_endpoint(request: ManualScriptRequest):
     try:
-        return gemini_service.generate_full_script(request.prompt, request.image_style)
+        # เรียก Gemini แบบ async บน loop กลางของ model (ไม่กิน thread ระหว่างรอ) ใช้กลุ่มอายุเริ่มต้นของโหมด manual
+        # ผู้ใช้รอผลอยู่ จึงได้คิวของ rate limiter ก่อนงานเบื้องหลัง
+        with rate_limiter.priority(rate_limiter.INTERACTIVE):
+            return await model_loop.run_async(gemini_service.create_story_plan_with_persona_async(
+                idea=request.prompt, age_group="5-7", image_style=request.image_style
+            ))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/manual/compile-video", status_code=202)
 async def manual_compile_video_endpoint(
-    background_tasks: BackgroundTasks, 
     story_script_json: str = Form(...), 
     voice_name: str = Form(...),
     music_filename: str = Form(...), 
     aspect_ratio: str = Form(...), 
     music_volume: float = Form(...),
     transition_style: str = Form(...),
-    images: List[UploadFile] = File(...)
+    images: List[UploadFile] = File(...),
+    encoder_profile: Optional[str] = Form(None)
 ):
     """
     Endpoint สำหรับการ Compile วิดีโอ (โหมด Manual) ที่แก้ไขแล้ว
     """
+    try:
+        music_service.validate_music_filename(music_filename)
+    except music_service.UnknownMusicError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    _validate_encoder_profile(encoder_profile)
     job_id = str(uuid.uuid4())
     
-    # --- [แก้ไข] บันทึกไฟล์ที่อัปโหลดลง Disk ทันที ---
-    upload_dir = Path("generated_content") / "uploads" / job_id
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    
-    temp_image_paths = []
-    for image in images:
-        file_path = upload_dir / image.filename
-        try:
-            # อ่านข้อมูลจากไฟล์ที่ยังเปิดอยู่ แล้วเขียนลงไฟล์ใหม่ของเรา
-            with open(file_path, "wb") as buffer:
-                content = await image.read() 
-                buffer.write(content)
-            temp_image_paths.append(str(file_path))
-        finally:
-            await image.close()
+    # --- บันทึกไฟล์ที่อัปโหลดลง Disk แบบ stream ทีละ chunk (ไม่ block event loop) ---
+    upload_dir = config.UPLOADS_DIR / job_id
+    try:
+        saved_uploads = await upload_service.save_uploads(images, upload_dir)
+    except upload_service.UploadTooLargeError as e:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        raise HTTPException(status_code=413, detail=str(e))
+    temp_image_paths = [saved["path"] for saved in saved_uploads]
     # -----------------------------------------------
 
     # [แก้ไข] เรียกใช้ service โดยส่ง "List ของ Path" แทน "List ของ UploadFile"
-    job_id_from_service = agent_service.start_manual_compilation_job(
-        background_tasks=background_tasks,
-        job_id=job_id,
-        story_script_json=story_script_json,
-        image_paths=temp_image_paths, # <-- ส่งเป็น Path
-        voice_name=voice_name,
-        music_filename=music_filename,
-        aspect_ratio=aspect_ratio,
-        music_volume=music_volume,
-        transition_style=transition_style
-    )
+    try:
+        job_id_from_service = agent_service.start_manual_compilation_job(
+            job_id=job_id,
+            story_script_json=story_script_json,
+            image_paths=temp_image_paths, # <-- ส่งเป็น Path
+            voice_name=voice_name,
+            music_filename=music_filename,
+            aspect_ratio=aspect_ratio,
+            music_volume=music_volume,
+            transition_style=transition_style,
+            encoder_profile=encoder_profile
+        )
+    except job_queue.QueueFullError as e:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
     return {"message": "Manual video compilation started.", "job_id": job_id_from_service}
 
 # --- END OF FILE ---
\ No newline at end of file
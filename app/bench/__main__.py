@@ -0,0 +1,8 @@
+# --- START OF FILE: app/bench/__main__.py ---
+# python -m app.bench = benchmark ทั้ง pipeline ด้วย backend ปลอม (ดู app/bench/pipeline.py)
+# benchmark เฉพาะส่วน: python -m app.bench.image_generation, python -m app.bench.motion
+from app.bench.pipeline import main
+
+main()
+
+# --- END OF FILE ---
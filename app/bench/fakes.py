@@ -0,0 +1,226 @@
+# --- START OF FILE: app/bench/fakes.py ---
+import asyncio
+import json
+import os
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from typing import List, Dict, Optional
+
+import ffmpeg
+
+# Backend ปลอมที่ทำงานใน process เดียวกัน ใช้วัดประสิทธิภาพโดยไม่ต้องจ่ายค่า Vertex AI
+# ฉีดเข้า service ผ่าน hook เดิม เช่น image_generation_service.set_image_model(FakeImageModel())
+
+
+def make_png_bytes(width: int = 64, height: int = 64, color=(90, 140, 200)) -> bytes:
+    """สร้างไฟล์ PNG สีพื้นขนาดเล็ก (ไม่ต้องพึ่ง Pillow)"""
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    row = b"\x00" + bytes(color) * width
+    raw = row * height
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+class FakeGeneratedImage:
+    def __init__(self, image_bytes: bytes):
+        self._image_bytes = image_bytes
+
+
+class QuotaExceeded(Exception):
+    code = 429
+
+
+class SimulatedQuota:
+    """
+    โควต้าแบบ sliding window เหมือนฝั่ง server ของ Vertex AI: รับได้ไม่เกิน limit ครั้งในทุกช่วง window วินาที
+    เกินแล้วตอบ 429 ทันที (ไม่หน่วงเวลา) การเรียกที่ถูกปฏิเสธไม่นับเข้าโควต้า
+    """
+
+    def __init__(self, limit: int, window: float = 60.0):
+        self.limit = limit
+        self.window = window
+        self.accepted = 0
+        self.rejected = 0
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    def check(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and self._recent[0] <= now - self.window:
+                self._recent.popleft()
+            if len(self._recent) >= self.limit:
+                self.rejected += 1
+                raise QuotaExceeded(f"429 Quota exceeded (simulated: {self.limit} requests per {self.window:g}s)")
+            self._recent.append(now)
+            self.accepted += 1
+
+
+class _FakeBackend:
+    """
+    ส่วนที่ backend ปลอมทุกตัวใช้ร่วมกัน: นับจำนวนครั้งที่ถูกเรียก หน่วงเวลา และสุ่ม error
+    ถ้ากำหนด quota (SimulatedQuota) การเรียกที่เกินโควต้าจะได้ 429 แทน
+    """
+
+    def __init__(self, latency: float = 0.5, failure_rate: float = 0.0, seed: int = 0, quota: Optional[SimulatedQuota] = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.quota = quota
+        self.calls = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _begin_call(self) -> bool:
+        with self._lock:
+            self.calls += 1
+            should_fail = self._random.random() < self.failure_rate
+            if should_fail: self.failures += 1
+        if self.quota is not None: self.quota.check()
+        return should_fail
+
+    def _call(self):
+        should_fail = self._begin_call()
+        time.sleep(self.latency)
+        if should_fail:
+            raise Exception("429 Quota exceeded (fake)")
+
+    async def _call_async(self):
+        # เหมือน _call แต่รอด้วย asyncio.sleep (ใช้กับ API แบบ async ที่รันบน model_loop)
+        should_fail = self._begin_call()
+        await asyncio.sleep(self.latency)
+        if should_fail:
+            raise Exception("429 Quota exceeded (fake)")
+
+
+class FakeImageModel(_FakeBackend):
+    """
+    แทน ImageGenerationModel: หน่วงเวลาตาม latency และสุ่ม error ตาม failure_rate
+    สีของภาพขึ้นกับ prompt (ภาพของแต่ละฉากต่างกัน เหมือนของจริง ไม่ใช้ frame cache ซ้ำกันเอง)
+    """
+
+    def __init__(self, latency: float = 0.5, failure_rate: float = 0.0, seed: int = 0, width: int = 64, height: int = 64):
+        super().__init__(latency, failure_rate, seed)
+        self.width = width
+        self.height = height
+
+    def generate_images(self, prompt: str, number_of_images: int = 1, aspect_ratio: str = "1:1") -> List[FakeGeneratedImage]:
+        self._call()
+        color = tuple(zlib.crc32(prompt.encode("utf-8")).to_bytes(4, "big")[:3])
+        png = make_png_bytes(self.width, self.height, color)
+        return [FakeGeneratedImage(png) for _ in range(number_of_images)]
+
+
+def make_story_plan(idea: str, scenes: int = 6) -> Dict:
+    """story plan ตามรูปแบบของ persona (ข้อความขึ้นกับ idea เพื่อไม่ให้ชน cache ของ TTS/render ระหว่าง job)"""
+    emotions = ["happy", "excited", "mysterious", "default", "sad", "sleepy"]
+    return {
+        "story_script": [
+            {"scene": i + 1, "text": f"Scene {i + 1} of {idea}: a friendly robot learns something new today.", "emotion": emotions[i % len(emotions)]}
+            for i in range(scenes)
+        ],
+        "image_prompts": [f"{idea}, scene {i + 1}, a friendly robot in a bright workshop" for i in range(scenes)],
+    }
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGeminiModel(_FakeBackend):
+    """แทน GenerativeModel: ตอบ story plan สำเร็จรูปเป็น JSON (รองรับทั้ง prompt แบบเรื่องเดียวและแบบ batch)"""
+
+    _model_name = "fake-gemini"
+
+    def __init__(self, latency: float = 2.0, failure_rate: float = 0.0, seed: int = 0, scenes: int = 6):
+        super().__init__(latency, failure_rate, seed)
+        self.scenes = scenes
+
+    def generate_content(self, contents, generation_config=None) -> FakeResponse:
+        self._call()
+        return self._respond(contents)
+
+    async def generate_content_async(self, contents, generation_config=None) -> FakeResponse:
+        await self._call_async()
+        return self._respond(contents)
+
+    def _respond(self, contents) -> FakeResponse:
+        prompt = "\n".join(str(getattr(part, "text", part)) for part in contents)
+        batch_ideas = re.findall(r'^\d+\. "(.*)"$', prompt, flags=re.MULTILINE)
+        if batch_ideas:
+            return FakeResponse(json.dumps({"plans": [make_story_plan(idea, self.scenes) for idea in batch_ideas]}))
+        match = re.search(r'story idea: "(.*)"', prompt)
+        return FakeResponse(json.dumps(make_story_plan(match.group(1) if match else "a story", self.scenes)))
+
+
+class FakeSynthesisResponse:
+    def __init__(self, audio_content: bytes):
+        self.audio_content = audio_content
+
+
+class FakeTTSClient(_FakeBackend):
+    """
+    แทน TextToSpeechClient: คืน MP3 เงียบที่ยาวตามจำนวนคำใน SSML (words_per_second คำต่อวินาที)
+    MP3 ของแต่ละความยาว (ปัดเป็น 0.1 วินาที) สร้างด้วย ffmpeg ครั้งเดียวแล้วใช้ซ้ำ
+    """
+
+    def __init__(self, latency: float = 0.3, failure_rate: float = 0.0, seed: int = 0, words_per_second: float = 2.5):
+        super().__init__(latency, failure_rate, seed)
+        self.words_per_second = words_per_second
+        self._mp3s: Dict[float, bytes] = {}
+
+    def _silent_mp3(self, seconds: float) -> bytes:
+        with self._lock:
+            data = self._mp3s.get(seconds)
+        if data is None:
+            data, _ = (
+                ffmpeg.input('anullsrc=r=24000:cl=mono', format='lavfi', t=seconds)
+                .output('pipe:', format='mp3', acodec='libmp3lame', audio_bitrate='32k')
+                .run(capture_stdout=True, capture_stderr=True)
+            )
+            with self._lock:
+                self._mp3s[seconds] = data
+        return data
+
+    def synthesize_speech(self, input=None, voice=None, audio_config=None) -> FakeSynthesisResponse:
+        self._call()
+        return FakeSynthesisResponse(self._silent_mp3(self._seconds_for(input)))
+
+    def _seconds_for(self, input) -> float:
+        text = re.sub(r"<[^>]+>", " ", getattr(input, "ssml", "") or getattr(input, "text", ""))
+        return max(1.0, round(len(text.split()) / self.words_per_second, 1))
+
+
+class FakeTTSAsyncClient(FakeTTSClient):
+    """แทน TextToSpeechAsyncClient (synthesize_speech เป็น coroutine)"""
+
+    async def synthesize_speech(self, input=None, voice=None, audio_config=None) -> FakeSynthesisResponse:
+        await self._call_async()
+        seconds = self._seconds_for(input)
+        with self._lock:
+            data = self._mp3s.get(seconds)
+        if data is None:
+            # สร้าง MP3 ด้วย ffmpeg ครั้งแรกของแต่ละความยาว ไม่ให้ block loop กลาง
+            data = await asyncio.to_thread(self._silent_mp3, seconds)
+        return FakeSynthesisResponse(data)
+
+
+class FakeDriveUploader(_FakeBackend):
+    """แทน google_drive_service.upload_video_to_drive (Drive ไม่มี hook แบบ set_* จึงต้องแทนฟังก์ชันตรงๆ)"""
+
+    def upload_video_to_drive(self, local_video_path: str, remote_folder_id: str, on_progress=None) -> str:
+        total_bytes = os.path.getsize(local_video_path)
+        if on_progress: on_progress(0, total_bytes)
+        self._call()
+        if on_progress: on_progress(total_bytes, total_bytes)
+        return f"https://drive.example/{os.path.basename(local_video_path)}"
+
+# --- END OF FILE ---
@@ -0,0 +1,47 @@
+# --- START OF FILE: app/bench/image_generation.py ---
+# เปรียบเทียบเวลาสร้างภาพแบบทีละภาพ กับแบบพร้อมกัน โดยใช้ FakeImageModel
+# วิธีใช้: python -m app.bench.image_generation --scenes 6 --latency 1.0 --failure-rate 0.1
+import argparse
+import shutil
+import time
+import uuid
+
+from app import config
+from app.bench.fakes import FakeImageModel
+from app.services import image_generation_service
+
+
+def run(scenes: int, concurrency: int) -> float:
+    story_id = f"bench_{uuid.uuid4()}"
+    prompts = [f"Scene {i + 1}: a friendly robot bakes a cake" for i in range(scenes)]
+    started = time.monotonic()
+    try:
+        image_paths = image_generation_service.generate_images_from_prompts(
+            prompts=prompts, story_id=story_id, aspect_ratio="9:16", concurrency=concurrency
+        )
+        assert image_paths == [str(config.UPLOADS_DIR / story_id / f"image_{i}.png") for i in range(scenes)]
+        return time.monotonic() - started
+    finally:
+        shutil.rmtree(config.UPLOADS_DIR / story_id, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image generation with a fake Imagen model.")
+    parser.add_argument("--scenes", type=int, default=6)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=config.IMAGE_GENERATION_CONCURRENCY)
+    parser.add_argument("--retry-base-delay", type=float, default=0.5)
+    args = parser.parse_args()
+
+    image_generation_service.RETRY_BASE_DELAY = args.retry_base_delay
+    for label, concurrency in (("sequential", 1), ("concurrent", args.concurrency)):
+        image_generation_service.set_image_model(FakeImageModel(latency=args.latency, failure_rate=args.failure_rate))
+        elapsed = run(args.scenes, concurrency)
+        print(f"{label:>10} (concurrency={concurrency}): {elapsed:.2f}s for {args.scenes} images")
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE ---
@@ -0,0 +1,76 @@
+# --- START OF FILE: app/bench/motion.py ---
+# เปรียบเทียบเวลา render ระหว่าง zoompan ของ ffmpeg (single_pass) กับ motion engine แบบ numpy
+# ใช้ภาพสังเคราะห์ขนาดใกล้เคียงกับที่ Imagen ส่งกลับมา และเสียงเงียบ (ไม่ต้องเรียก TTS)
+# วิธีใช้: python -m app.bench.motion --scenes 4 --seconds 6 --aspect 9:16 --transition fade
+import argparse
+import shutil
+import time
+import uuid
+
+import ffmpeg
+import numpy as np
+from PIL import Image
+
+from app import config
+from app.services import video_service
+
+
+def make_images(directory, scenes: int, width: int, height: int):
+    """ภาพ gradient + noise (มีรายละเอียดพอให้ resize ทำงานจริง)"""
+    rng = np.random.default_rng(0)
+    paths = []
+    yy, xx = np.mgrid[:height, :width]
+    for i in range(scenes):
+        base = np.stack([(xx * 255 // width + i * 40) % 256, (yy * 255 // height) % 256, np.full_like(xx, 90 + i * 30)], axis=-1)
+        noise = rng.integers(0, 40, size=base.shape)
+        path = directory / f"image_{i}.png"
+        Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def run(render_mode: str, frame_paths, durations, width: int, height: int, transition: str, output_path) -> float:
+    effects = video_service.pick_zoom_pan_effects(len(frame_paths), seed=0)
+    audio_stream = ffmpeg.input('anullsrc', format='lavfi', t=video_service.get_video_length(durations)).audio
+    started = time.monotonic()
+    if render_mode == video_service.RENDER_MODE_NUMPY:
+        video_service._render_numpy(frame_paths, durations, width, height, transition, None, audio_stream, output_path, effects)
+    else:
+        video_stream = video_service.build_visual_stream(frame_paths, durations, width, height, transition, effects=effects)
+        video_service._render_single_pass(video_stream, audio_stream, output_path)
+    return time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ffmpeg zoompan against the numpy Ken Burns engine.")
+    parser.add_argument("--scenes", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=6.0, help="ความยาวของแต่ละฉาก")
+    parser.add_argument("--aspect", default="9:16")
+    parser.add_argument("--transition", default="fade")
+    parser.add_argument("--source-width", type=int, default=1536)
+    parser.add_argument("--source-height", type=int, default=2816)
+    args = parser.parse_args()
+
+    work_dir = config.CONTENT_DIR / f"bench_motion_{uuid.uuid4().hex[:8]}"
+    work_dir.mkdir(parents=True)
+    try:
+        image_paths = make_images(work_dir, args.scenes, args.source_width, args.source_height)
+        frame_paths = video_service.normalize_images(image_paths, args.aspect)
+        width, height = video_service.get_video_size(args.aspect)
+        durations = [args.seconds] * args.scenes
+        video_length = video_service.get_video_length(durations)
+        for render_mode in (video_service.RENDER_MODE_SINGLE_PASS, video_service.RENDER_MODE_NUMPY):
+            output_path = work_dir / f"{render_mode}.mp4"
+            elapsed = run(render_mode, frame_paths, durations, width, height, args.transition, output_path)
+            print(
+                f"{render_mode:>12}: {elapsed:.2f}s for {video_length:.1f}s of video "
+                f"({video_length * config.VIDEO_FPS / elapsed:.1f} fps, {output_path.stat().st_size} bytes)"
+            )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE ---
@@ -0,0 +1,258 @@
+# --- START OF FILE: app/bench/pipeline.py ---
+# วัดประสิทธิภาพทั้ง pipeline (Gemini -> Imagen -> TTS -> ffmpeg -> Drive) โดยไม่เรียก Vertex AI / Drive จริง
+# - ฉีด backend ปลอมจาก app/bench/fakes.py ผ่าน set_gemini_model / set_image_model / set_tts_async_client
+#   (Gemini และ TTS ปลอมมี API แบบ async จึงรันบน loop กลางของ model_loop เหมือนของจริง)
+# - รัน agent_orchestrator_workflow และ/หรือ manual_compilation_workflow N งาน พร้อมกันทีละ C งาน (ผ่าน job pool จริง)
+# - รายงาน latency ของแต่ละ stage (p50/p90/p99), throughput, peak RSS และจำนวน byte ที่เขียนลง disk
+# ทุกอย่าง (ฐานข้อมูล, cache, ไฟล์วิดีโอ) อยู่ใน directory ชั่วคราว ไม่ปนกับข้อมูลจริงและไม่ได้ cache hit จากรอบก่อน
+# วิธีใช้: python -m app.bench --jobs 8 --concurrency 4 --mode both --image-latency 1.5
+import argparse
+import json
+import math
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import List, Dict, Optional
+
+from app import config
+from app.bench import fakes
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """percentile แบบ nearest-rank"""
+    if not values: return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(values: List[float]) -> Dict:
+    return dict(
+        count=len(values), p50=percentile(values, 50), p90=percentile(values, 90),
+        p99=percentile(values, 99), max=max(values) if values else 0.0,
+    )
+
+
+def _io_write_bytes() -> Optional[int]:
+    # byte ที่ process นี้เขียนลง storage จริง (Linux เท่านั้น)
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _children_write_bytes() -> int:
+    # ffmpeg ทำงานเป็น process ลูก: นับจาก block output (หน่วย 512 byte)
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_oublock * 512
+
+
+def _directory_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def use_isolated_workspace(work_dir: Path):
+    """
+    ชี้ path ทั้งหมดใน config ไปที่ work_dir ต้องเรียกก่อน import app.services
+    (DiskCache และ job_repository อ่าน path จาก config ตอน import)
+    """
+    config.CONTENT_DIR = work_dir / "generated_content"
+    config.UPLOADS_DIR = config.CONTENT_DIR / "uploads"
+    config.CACHE_DIR = config.CONTENT_DIR / "cache"
+    config.JOB_DB_PATH = work_dir / "bench_jobs.sqlite3"
+    for directory in (config.CONTENT_DIR, config.UPLOADS_DIR, config.CACHE_DIR):
+        directory.mkdir(parents=True, exist_ok=True)
+
+
+class StageRecorder:
+    """เก็บเวลาของแต่ละ stage จาก Pipeline listener"""
+
+    def __init__(self):
+        self.durations: Dict[str, List[float]] = {}
+        self.failures: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, pipeline_name: str, task_name: str, seconds: float, error):
+        with self._lock:
+            self.durations.setdefault(task_name, []).append(seconds)
+            if error is not None:
+                self.failures[task_name] = self.failures.get(task_name, 0) + 1
+
+
+def run_jobs(label: str, count: int, submit_one) -> Dict:
+    """ส่ง count งานเข้า job pool แล้วรอทุกงาน คืน latency ของแต่ละงานและ wall time รวม"""
+    from app.services import worker_pool, job_repository
+
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+
+    def timed(index: int):
+        started = time.monotonic()
+        job_id = submit_one(index)
+        elapsed = time.monotonic() - started
+        status = (job_repository.get_job(job_id) or {}).get("status", "unknown")
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.monotonic()
+    futures = [worker_pool.submit_job(timed, i) for i in range(count)]
+    for future in futures:
+        future.result()
+    wall = time.monotonic() - started
+    return dict(
+        label=label, jobs=count, statuses=statuses, wall_seconds=wall,
+        jobs_per_minute=count / wall * 60 if wall else 0.0, latency=summarize(latencies),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the full story pipeline with fake model backends.")
+    parser.add_argument("--jobs", type=int, default=4, help="จำนวนงานต่อโหมด")
+    parser.add_argument("--concurrency", type=int, default=config.JOB_WORKERS, help="จำนวนงานที่รันพร้อมกัน")
+    parser.add_argument("--mode", choices=("magic", "manual", "both"), default="both")
+    parser.add_argument("--scenes", type=int, default=6)
+    parser.add_argument("--aspect", default="9:16")
+    parser.add_argument("--transition", default="fade")
+    parser.add_argument("--music", default="none")
+    parser.add_argument("--render-mode", default=config.VIDEO_RENDER_MODE)
+    parser.add_argument("--encoder-profile", default=None)
+    parser.add_argument("--image-size", default="1024x1792", help="ขนาดภาพที่ Imagen ปลอมส่งกลับ (กว้างxสูง)")
+    parser.add_argument("--gemini-latency", type=float, default=2.0)
+    parser.add_argument("--image-latency", type=float, default=1.0)
+    parser.add_argument("--tts-latency", type=float, default=0.3)
+    parser.add_argument("--upload-latency", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="โอกาส error ของทุก backend ปลอมต่อการเรียก")
+    parser.add_argument("--image-quota-per-minute", type=int, default=0, help="โควต้าของ Imagen ปลอม (0 = ไม่จำกัด) ดู app/bench/quota.py")
+    parser.add_argument("--retry-base-delay", type=float, default=0.2)
+    parser.add_argument("--json", action="store_true", help="พิมพ์ผลเป็น JSON")
+    parser.add_argument("--keep", action="store_true", help="ไม่ลบ directory ชั่วคราวหลังจบ")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="story_bench_"))
+    use_isolated_workspace(work_dir)
+    config.JOB_WORKERS = args.concurrency
+    config.MAX_QUEUED_JOBS = max(config.MAX_QUEUED_JOBS, args.jobs * 2)
+    config.VIDEO_RENDER_MODE = args.render_mode
+
+    # import หลังจากย้าย path ใน config แล้วเท่านั้น
+    from app.services import (
+        agent_service, gemini_service, image_generation_service, tts_service, google_drive_service, pipeline, worker_pool
+    )
+
+    width, height = (int(v) for v in args.image_size.lower().split("x"))
+    gemini = fakes.FakeGeminiModel(latency=args.gemini_latency, failure_rate=args.failure_rate, scenes=args.scenes)
+    imagen = fakes.FakeImageModel(latency=args.image_latency, failure_rate=args.failure_rate, width=width, height=height)
+    tts = fakes.FakeTTSAsyncClient(latency=args.tts_latency, failure_rate=args.failure_rate)
+    drive = fakes.FakeDriveUploader(latency=args.upload_latency, failure_rate=args.failure_rate)
+    if args.image_quota_per_minute:
+        imagen.quota = fakes.SimulatedQuota(args.image_quota_per_minute, 60.0)
+    gemini_service.set_gemini_model(gemini)
+    image_generation_service.set_image_model(imagen)
+    tts_service.set_tts_async_client(tts)
+    google_drive_service.upload_video_to_drive = drive.upload_video_to_drive
+    image_generation_service.RETRY_BASE_DELAY = args.retry_base_delay
+
+    recorder = StageRecorder()
+    pipeline.add_listener(recorder)
+    settings = dict(
+        voice_name="en-US-Wavenet-C", music_filename=args.music, aspect_ratio=args.aspect,
+        music_volume=0.3, transition_style=args.transition, encoder_profile=args.encoder_profile,
+    )
+    run_id = uuid.uuid4().hex[:6]
+
+    def submit_magic(index: int) -> str:
+        job_id = str(uuid.uuid4())
+        agent_service.update_job_status(job_id, "pending", "0/5: Job queued...")
+        agent_service.agent_orchestrator_workflow(
+            job_id=job_id, prompt=f"bench {run_id} story {index}", age_group="5-7", **settings
+        )
+        return job_id
+
+    def submit_manual(index: int) -> str:
+        job_id = str(uuid.uuid4())
+        plan = fakes.make_story_plan(f"bench {run_id} manual {index}", args.scenes)
+        upload_dir = config.UPLOADS_DIR / job_id
+        upload_dir.mkdir(parents=True, exist_ok=True)
+        image_paths = []
+        # ภาพของโหมด manual คือไฟล์ที่ผู้ใช้อัปโหลดมา จึงเขียนลง disk ตรงๆ ไม่ผ่าน Imagen ปลอม
+        for i in range(args.scenes):
+            path = upload_dir / f"image_{i}.png"
+            path.write_bytes(fakes.make_png_bytes(width, height, ((index * 37) % 256, (i * 40) % 256, 120)))
+            image_paths.append(str(path))
+        agent_service.update_job_status(job_id, "pending", "0/2: Job queued...")
+        agent_service.manual_compilation_workflow(
+            job_id=job_id, story_script=plan["story_script"], image_paths=image_paths, **settings
+        )
+        return job_id
+
+    io_before = _io_write_bytes()
+    children_before = _children_write_bytes()
+    results = []
+    try:
+        if args.mode in ("magic", "both"):
+            results.append(run_jobs("magic", args.jobs, submit_magic))
+        if args.mode in ("manual", "both"):
+            results.append(run_jobs("manual", args.jobs, submit_manual))
+    finally:
+        pipeline.remove_listener(recorder)
+        worker_pool.shutdown(wait=True)
+
+    io_after = _io_write_bytes()
+    report = dict(
+        settings=dict(vars(args), render_mode=config.VIDEO_RENDER_MODE),
+        runs=results,
+        stages={name: summarize(values) for name, values in sorted(recorder.durations.items())},
+        stage_failures=recorder.failures,
+        backend_calls=dict(
+            gemini=gemini.calls, imagen=imagen.calls, tts=tts.calls, drive=drive.calls,
+            failures=gemini.failures + imagen.failures + tts.failures + drive.failures,
+            imagen_quota_rejected=imagen.quota.rejected if imagen.quota else 0,
+        ),
+        peak_rss_mib=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        peak_child_rss_mib=resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        disk_bytes_written=dict(
+            process=(io_after - io_before) if io_before is not None and io_after is not None else None,
+            children=_children_write_bytes() - children_before,
+            left_on_disk=_directory_bytes(work_dir),
+        ),
+    )
+    if args.keep:
+        print(f"Benchmark files kept in {work_dir}")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+        return
+    print(f"\n=== Pipeline benchmark ({args.jobs} jobs/mode, concurrency {args.concurrency}, render {config.VIDEO_RENDER_MODE}) ===")
+    for run in results:
+        latency = run["latency"]
+        print(
+            f"{run['label']:>8}: {run['wall_seconds']:.2f}s wall, {run['jobs_per_minute']:.1f} jobs/min, "
+            f"latency p50 {latency['p50']:.2f}s p90 {latency['p90']:.2f}s p99 {latency['p99']:.2f}s, statuses {run['statuses']}"
+        )
+    print("stages:")
+    for name, stats in report["stages"].items():
+        failed = report["stage_failures"].get(name, 0)
+        print(
+            f"  {name:>10}: n={stats['count']:<4} p50 {stats['p50']:.2f}s p90 {stats['p90']:.2f}s "
+            f"p99 {stats['p99']:.2f}s max {stats['max']:.2f}s" + (f" ({failed} failed)" if failed else "")
+        )
+    disk = report["disk_bytes_written"]
+    print(f"backend calls: {report['backend_calls']}")
+    print(f"peak RSS: {report['peak_rss_mib']:.1f} MiB (largest child {report['peak_child_rss_mib']:.1f} MiB)")
+    print(f"disk written: process {disk['process']} bytes, children {disk['children']} bytes, left on disk {disk['left_on_disk']} bytes")
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE ---
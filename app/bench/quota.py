@@ -0,0 +1,114 @@
+# --- START OF FILE: app/bench/quota.py ---
+# จำลองโควต้าของ Imagen (SimulatedQuota ใน app/bench/fakes.py) แล้ววัดว่า rate limiter (app/services/rate_limiter.py)
+# รับมือกับงานจำนวนมากที่แย่งโควต้ากันได้ดีแค่ไหน
+# - ปล่อยงาน batch เข้าไปก่อนจนเกินโควต้า แล้วตามด้วยงาน interactive (โหมด manual) ที่ควรได้คิวก่อน
+# - รายงาน latency ของแต่ละกลุ่ม, จำนวน 429 ที่ server ตอบ, งานที่ล้มเหลว และ rate ที่ limiter ปรับไปอยู่
+# - --no-limiter คือพฤติกรรมเดิม (แต่ละ job ถอยเองด้วย exponential backoff) ไว้เปรียบเทียบ
+# วิธีใช้: python -m app.bench.quota --quota-per-minute 120 --batch-jobs 12 --interactive-jobs 3
+import argparse
+import json
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+from app import config
+from app.bench import fakes
+from app.bench.pipeline import summarize, use_isolated_workspace
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the adaptive model rate limiter against a simulated quota.")
+    parser.add_argument("--quota-per-minute", type=float, default=120, help="โควต้าของ server ปลอม (ครั้งต่อนาที)")
+    parser.add_argument("--window", type=float, default=10.0, help="ช่วงเวลาของ sliding window ของโควต้า (วินาที)")
+    parser.add_argument("--limiter-rate-per-minute", type=float, default=None, help="เพดานของ limiter (ค่าเริ่มต้น 2 เท่าของโควต้า)")
+    parser.add_argument("--no-limiter", action="store_true", help="ปิด rate limiter (พฤติกรรมเดิม)")
+    parser.add_argument("--batch-jobs", type=int, default=12)
+    parser.add_argument("--interactive-jobs", type=int, default=3)
+    parser.add_argument("--interactive-delay", type=float, default=3.0, help="วินาทีหลังเริ่มงาน batch ที่งาน interactive เข้ามา")
+    parser.add_argument("--images", type=int, default=6, help="จำนวนภาพต่องาน")
+    parser.add_argument("--image-latency", type=float, default=0.5)
+    parser.add_argument("--cooldown", type=float, default=2.0, help="QUOTA_COOLDOWN_SECONDS")
+    parser.add_argument("--retry-base-delay", type=float, default=2.0, help="RETRY_BASE_DELAY ของ backoff แบบเดิม")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="story_quota_bench_"))
+    use_isolated_workspace(work_dir)
+    ceiling = args.limiter_rate_per_minute or args.quota_per_minute * 2
+    config.MODEL_RATE_PER_MINUTE = dict(config.MODEL_RATE_PER_MINUTE, imagen=0 if args.no_limiter else ceiling)
+    config.QUOTA_COOLDOWN_SECONDS = args.cooldown
+
+    # import หลังจากย้าย path ใน config แล้วเท่านั้น
+    from app.services import image_generation_service, model_loop, rate_limiter
+
+    quota = fakes.SimulatedQuota(max(1, int(args.quota_per_minute * args.window / 60)), args.window)
+    imagen = fakes.FakeImageModel(latency=args.image_latency)
+    imagen.quota = quota
+    image_generation_service.set_image_model(imagen)
+    image_generation_service.RETRY_BASE_DELAY = args.retry_base_delay
+
+    latencies: Dict[str, List[float]] = {"batch": [], "interactive": []}
+    failed: Dict[str, int] = {"batch": 0, "interactive": 0}
+    lock = threading.Lock()
+
+    def run_job(label: str, level: int, index: int):
+        prompts = [f"{label} {index} scene {i}" for i in range(args.images)]
+        started = time.monotonic()
+        ok = True
+        try:
+            with rate_limiter.priority(level):
+                image_generation_service.generate_images_from_prompts(prompts, f"{label}_{index}_{uuid.uuid4().hex[:6]}")
+        except Exception:
+            ok = False
+        with lock:
+            latencies[label].append(time.monotonic() - started)
+            if not ok: failed[label] += 1
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.batch_jobs + args.interactive_jobs) as pool:
+        futures = [pool.submit(run_job, "batch", rate_limiter.BATCH, i) for i in range(args.batch_jobs)]
+        time.sleep(args.interactive_delay)
+        futures += [pool.submit(run_job, "interactive", rate_limiter.INTERACTIVE, i) for i in range(args.interactive_jobs)]
+        for future in futures:
+            future.result()
+    wall = time.monotonic() - started
+
+    async def limiter_state():
+        return rate_limiter.snapshot()
+
+    report = dict(
+        settings=vars(args),
+        wall_seconds=wall,
+        images_per_minute=quota.accepted / wall * 60 if wall else 0.0,
+        latency={label: summarize(values) for label, values in latencies.items()},
+        failed_jobs=failed,
+        server=dict(accepted=quota.accepted, rejected_429=quota.rejected),
+        limiter=model_loop.run(limiter_state()).get(model_loop.IMAGEN),
+    )
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+        return
+    mode = "no limiter" if args.no_limiter else f"limiter ceiling {ceiling:g}/min"
+    print(f"\n=== Quota benchmark (quota {args.quota_per_minute:g}/min, {mode}) ===")
+    print(f"wall {wall:.1f}s, {report['images_per_minute']:.1f} images/min accepted by the server")
+    for label, stats in report["latency"].items():
+        print(
+            f"{label:>12}: n={stats['count']:<3} p50 {stats['p50']:.1f}s p90 {stats['p90']:.1f}s "
+            f"max {stats['max']:.1f}s, failed {failed[label]}"
+        )
+    print(f"server: {quota.accepted} accepted, {quota.rejected} rejected with 429")
+    if report["limiter"]:
+        print(f"limiter: {report['limiter']}")
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE ---
@@ -0,0 +1,123 @@
+# --- START OF FILE: app/bench/startup.py ---
+# วัดเวลา startup ของ API: เวลา import app.main และเวลาตั้งแต่เริ่ม process จนตอบ request แรกได้ (time-to-first-request)
+# เทียบแต่ละค่า MODEL_CLIENT_INIT (eager = สร้าง client ให้เสร็จก่อนรับ request แบบเดิม, background, lazy)
+# ทุกครั้งรันใน process ใหม่ (cold start จริง ไม่มี module ค้างจากรอบก่อน)
+# วิธีใช้: python -m app.bench.startup --runs 3 --importtime
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List
+
+from app import config
+
+MODES = ("eager", "background", "lazy")
+
+
+def _env(mode: str) -> Dict[str, str]:
+    # worker ที่ฝังอยู่ไม่เกี่ยวกับการวัดนี้ (และไม่ให้ไปแตะคิวงานจริง)
+    return dict(os.environ, MODEL_CLIENT_INIT=mode, RUN_EMBEDDED_WORKER="0")
+
+
+def measure_import(module: str) -> float:
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=config.PROJECT_ROOT, env=_env("lazy"),
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_first_request(mode: str, timeout: float = 120.0) -> float:
+    """วินาทีตั้งแต่เริ่ม uvicorn จน GET /metrics ตอบ 200"""
+    port = _free_port()
+    started = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=config.PROJECT_ROOT, env=_env(mode), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.monotonic() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {process.returncode} (mode {mode})")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=1) as response:
+                    if response.status == 200:
+                        return time.monotonic() - started
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.02)
+        raise TimeoutError(f"No response within {timeout}s (mode {mode})")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def import_breakdown(module: str, top: int) -> List[Dict]:
+    """package ระดับบนสุดที่ใช้เวลา import มากที่สุด (จาก python -X importtime)"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=config.PROJECT_ROOT, env=_env("lazy"),
+        capture_output=True, text=True, check=True,
+    ).stderr
+    packages = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line: continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # ชื่อที่เยื้องน้อยที่สุด (1 ช่องว่างหลัง |) คือ module ที่ถูก import ตรงๆ ไม่ใช่ผ่าน module อื่น
+        name = name[1:]
+        if not name.startswith(" "):
+            packages.append(dict(package=name.strip(), seconds=int(cumulative) / 1e6))
+    return sorted(packages, key=lambda p: p["seconds"], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API cold-start time for each MODEL_CLIENT_INIT mode.")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--importtime", action="store_true", help="แสดง package ที่ import ช้าที่สุด")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    # การ import ไม่ขึ้นกับ MODEL_CLIENT_INIT (client ถูกสร้างใน lifespan) จึงวัดครั้งเดียว
+    import_seconds = statistics.median(measure_import(args.module) for _ in range(args.runs))
+    results = {}
+    for mode in args.modes:
+        first_requests = [measure_first_request(mode) for _ in range(args.runs)]
+        results[mode] = dict(first_request_seconds=statistics.median(first_requests), first_request_runs=first_requests)
+    report = dict(runs=args.runs, import_seconds=import_seconds, modes=results)
+    if args.importtime:
+        report["slowest_imports"] = import_breakdown(args.module, args.top)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"\n=== Startup benchmark ({args.runs} cold starts per mode, median) ===")
+    print(f"import {args.module}: {import_seconds:.2f}s")
+    for mode, stats in results.items():
+        print(f"{mode:>10}: first request {stats['first_request_seconds']:.2f}s")
+    if args.importtime:
+        print(f"slowest top-level imports of {args.module}:")
+        for entry in report["slowest_imports"]:
+            print(f"  {entry['package']:<30} {entry['seconds']:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE ---
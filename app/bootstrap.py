@@ -0,0 +1,56 @@
+# --- START OF FILE: app/bootstrap.py ---
+# การเตรียม Service ภายนอกที่ใช้ร่วมกันระหว่าง API (app/main.py) และ worker (app/worker.py)
+import logging
+import threading
+import time
+
+from app import config
+from app.services import clients, google_drive_service, music_service
+
+
+def configure_logging():
+    # ตั้งค่า Logging (Environment Variables จาก .env ถูกโหลดไว้แล้วใน app/config.py)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(module)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+
+def _at_startup(name: str, fn):
+    """
+    รันงานเตรียมตัวตอน startup ตาม MODEL_CLIENT_INIT: eager = รอให้เสร็จก่อน, background = thread เบื้องหลัง
+    lazy = ไม่ทำ (ทุกอย่างที่นี่สร้าง/โหลดเองเมื่อถูกใช้ครั้งแรกอยู่แล้ว)
+    """
+    def run():
+        started = time.monotonic()
+        fn()
+        logging.info(f"--- [STARTUP] {name} finished in {time.monotonic() - started:.2f}s ---")
+
+    if config.MODEL_CLIENT_INIT == "eager":
+        run()
+    elif config.MODEL_CLIENT_INIT == "background":
+        threading.Thread(target=run, name=f"warmup-{name}", daemon=True).start()
+
+
+def _warm_up_google_services():
+    clients.warm_up()
+    if config.DRIVE_AUTH_AT_STARTUP:
+        google_drive_service.init_drive_client()
+
+
+def init_google_services():
+    """
+    เตรียม client ของ Vertex AI / TTS / Drive (สร้างจริงใน app/services/clients.py เมื่อถูกใช้ครั้งแรก)
+    ค่าเริ่มต้นเริ่มสร้างใน thread เบื้องหลัง API รับ request ได้ทันทีโดยไม่ต้องรอ
+    """
+    logging.info(f"--- Application Startup: Google Cloud clients will be created {config.MODEL_CLIENT_INIT}. ---")
+    _at_startup("client warm-up", _warm_up_google_services)
+
+
+def preload_assets():
+    """decode เพลงประกอบทั้งหมดไว้ก่อน (ครั้งแรกเก็บเป็น .npy ใน cache, ครั้งต่อไปแค่ mmap)"""
+    if config.MUSIC_PRELOAD_AT_STARTUP:
+        _at_startup("music preload", music_service.preload_tracks)
+
+# --- END OF FILE ---
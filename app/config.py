@@ -1,6 +1,12 @@
 # --- START OF FILE: app/config.py ---
+import os
 from pathlib import Path
 
+from dotenv import load_dotenv
+
+# โหลด .env ก่อนอ่านค่าตั้งค่าด้านล่าง
+load_dotenv()
+
 # นี่คือ "ศูนย์กลาง" ของเรา
 # Path(__file__) คือไฟล์ config.py นี้เอง
 # .parent คือโฟลเดอร์ app/
@@ -12,10 +18,122 @@ CONTENT_DIR = PROJECT_ROOT / "generated_content"
 ASSETS_DIR = PROJECT_ROOT / "assets"
 MUSIC_DIR = ASSETS_DIR / "music"
 UPLOADS_DIR = CONTENT_DIR / "uploads"
+CACHE_DIR = CONTENT_DIR / "cache"
 VIDEO_FPS = 24
 
+# โหมดการ render วิดีโอ: "single_pass" (ffmpeg ครั้งเดียว), "three_stage" (แบบเดิม 3 ครั้ง),
+# "segmented" (encode แต่ละฉากพร้อมกันหลาย core แล้วต่อด้วย xfade)
+# หรือ "numpy" (สร้างเฟรม Ken Burns ด้วย numpy แล้วส่ง raw video เข้า ffmpeg encoder ตัวเดียว)
+VIDEO_RENDER_MODE = os.environ.get("VIDEO_RENDER_MODE", "single_pass")
+# จำนวน segment ที่ encode พร้อมกันในโหมด segmented และคุณภาพของไฟล์ segment ระหว่างทาง
+RENDER_SEGMENT_WORKERS = int(os.environ.get("RENDER_SEGMENT_WORKERS", os.cpu_count() or 1))
+SEGMENT_CRF = 18
+# โปรไฟล์ encoder เริ่มต้น (draft / social / archive / adaptive ดู ENCODER_PROFILES ใน video_service)
+# draft คือค่าเดิม (ultrafast, CRF 23) ค่าอื่นเปลี่ยนขนาดและคุณภาพของวิดีโอที่ได้
+# adaptive: ใช้ ENCODER_ADAPTIVE_PROFILE ตามปกติ แต่ถ้างานรอคิวตั้งแต่ ENCODER_ADAPTIVE_DRAFT_DEPTH ขึ้นไปจะใช้ draft
+ENCODER_PROFILE = os.environ.get("ENCODER_PROFILE", "draft")
+ENCODER_ADAPTIVE_PROFILE = os.environ.get("ENCODER_ADAPTIVE_PROFILE", "social")
+ENCODER_ADAPTIVE_DRAFT_DEPTH = int(os.environ.get("ENCODER_ADAPTIVE_DRAFT_DEPTH", 5))
+# จำนวน thread ที่สร้างเฟรม Ken Burns พร้อมกันในโหมด numpy
+MOTION_WORKERS = int(os.environ.get("MOTION_WORKERS", os.cpu_count() or 1))
+
+# จำนวนภาพที่ขอ Imagen พร้อมกันต่อ 1 job (1 = ทีละภาพแบบเดิม)
+IMAGE_GENERATION_CONCURRENCY = int(os.environ.get("IMAGE_GENERATION_CONCURRENCY", 4))
+
+# ขนาดสูงสุดของ cache เสียงพากย์ (ไฟล์ที่ใช้ล่าสุดนานที่สุดจะถูกลบก่อน)
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+# โหมด TTS: "full_script" (ส่งทั้งเรื่องเป็น SSML เดียว) หรือ "per_line" (สังเคราะห์ทีละบรรทัดแบบขนาน
+# แล้วให้แต่ละภาพอยู่บนจอนานเท่ากับเสียงบรรยายของฉากนั้น)
+TTS_MODE = os.environ.get("TTS_MODE", "full_script")
+TTS_LINE_CONCURRENCY = int(os.environ.get("TTS_LINE_CONCURRENCY", 6))
+
+# ภาพที่ย่อ/crop เป็นขนาดทำงานแล้ว (ดู normalize_images ใน video_service): จำนวน thread และขนาด cache
+IMAGE_NORMALIZE_WORKERS = int(os.environ.get("IMAGE_NORMALIZE_WORKERS", os.cpu_count() or 1))
+FRAME_CACHE_MAX_BYTES = int(os.environ.get("FRAME_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+
+# Cache วิดีโอที่ render แล้ว (key จาก input ทั้งหมดของการ compile) ขนาดรวมสูงสุด
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_BYTES", 5 * 1024 * 1024 * 1024))
+
+# เพลงประกอบ: decode ทุกเพลงไว้ล่วงหน้าตอน startup และปรับความดัง (RMS) ของทุกเพลงให้เท่ากันที่ค่านี้
+MUSIC_PRELOAD_AT_STARTUP = os.environ.get("MUSIC_PRELOAD_AT_STARTUP", "1") == "1"
+MUSIC_TARGET_RMS_DBFS = float(os.environ.get("MUSIC_TARGET_RMS_DBFS", -20.0))
+
+# Cache ของ story plan จาก Gemini (เก็บใน SQLite เดียวกับ job ใช้ร่วมกันทุก worker process)
+# บันทึกทุกครั้ง แต่จะอ่านจาก cache สำหรับงานใหม่ก็ต่อเมื่อเปิด STORY_PLAN_CACHE_ENABLED=1
+# (งานที่ถูก retry หลังขั้นตอนถัดไปล้มเหลวจะใช้ plan เดิมจาก cache เสมอ)
+STORY_PLAN_CACHE_ENABLED = os.environ.get("STORY_PLAN_CACHE_ENABLED", "0") == "1"
+STORY_PLAN_CACHE_TTL_SECONDS = float(os.environ.get("STORY_PLAN_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+STORY_PLAN_CACHE_MAX_ENTRIES = int(os.environ.get("STORY_PLAN_CACHE_MAX_ENTRIES", 1000))
+
+# ขนาดสูงสุดของไฟล์อัปโหลด (ต่อไฟล์ และรวมทั้ง request) สำหรับ /manual/compile-video
+MAX_UPLOAD_FILE_BYTES = int(os.environ.get("MAX_UPLOAD_FILE_BYTES", 25 * 1024 * 1024))
+MAX_UPLOAD_REQUEST_BYTES = int(os.environ.get("MAX_UPLOAD_REQUEST_BYTES", 150 * 1024 * 1024))
+
+# Worker pool (app/services/worker_pool.py)
+# JOB_WORKERS: workflow ที่รันพร้อมกันต่อ worker, MAX_QUEUED_JOBS: job ที่รอคิวได้ก่อนตอบ 429
+# CPU_WORKERS: render ffmpeg พร้อมกัน, IO_WORKERS: การเรียก model/network พร้อมกัน
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", 50))
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", 2))
+IO_WORKERS = int(os.environ.get("IO_WORKERS", 16))
+# จำนวนการเรียก model ที่ค้างอยู่พร้อมกันได้ต่อ backend ทั้ง process (ดู app/services/model_loop.py)
+MODEL_MAX_IN_FLIGHT = {
+    "gemini": int(os.environ.get("GEMINI_MAX_IN_FLIGHT", 8)),
+    "imagen": int(os.environ.get("IMAGEN_MAX_IN_FLIGHT", 16)),
+    "tts": int(os.environ.get("TTS_MAX_IN_FLIGHT", 32)),
+}
+# เพดานจำนวนการเรียกต่อนาทีของแต่ละ model (ควรตั้งตามโควต้าของ project, 0 = ไม่จำกัด) ดู app/services/rate_limiter.py
+# rate จริงจะลดลงเองเมื่อเจอ 429 / quota error (ไม่ต่ำกว่า RATE_LIMIT_MIN_FRACTION ของเพดาน) แล้วค่อยๆ เพิ่มกลับ
+MODEL_RATE_PER_MINUTE = {
+    "gemini": float(os.environ.get("GEMINI_RATE_PER_MINUTE", 60)),
+    "imagen": float(os.environ.get("IMAGEN_RATE_PER_MINUTE", 60)),
+    "tts": float(os.environ.get("TTS_RATE_PER_MINUTE", 600)),
+}
+RATE_LIMIT_MIN_FRACTION = float(os.environ.get("RATE_LIMIT_MIN_FRACTION", 0.05))
+# ช่วงพักการเรียก backend หลังเจอ quota error (เพิ่มเป็นเท่าตัวถ้าเจอติดกัน ไม่เกิน MAX) และจำนวนครั้งที่ลองใหม่
+QUOTA_COOLDOWN_SECONDS = float(os.environ.get("QUOTA_COOLDOWN_SECONDS", 5))
+QUOTA_COOLDOWN_MAX_SECONDS = float(os.environ.get("QUOTA_COOLDOWN_MAX_SECONDS", 60))
+QUOTA_MAX_RETRIES = int(os.environ.get("QUOTA_MAX_RETRIES", 4))
+
+# Client ของ Vertex AI / TTS (app/services/clients.py) สร้างแบบ lazy เมื่อถูกใช้ครั้งแรก
+# MODEL_CLIENT_INIT: "background" (เริ่มสร้างใน thread เบื้องหลังหลัง startup, ไม่รอ), "lazy" (สร้างเมื่อใช้จริงเท่านั้น)
+# หรือ "eager" (สร้างให้เสร็จก่อนเริ่มรับ request แบบเดิม) ค่าเดียวกันนี้ใช้กับการ authenticate Drive และ decode เพลงตอน startup
+MODEL_CLIENT_INIT = os.environ.get("MODEL_CLIENT_INIT", "background")
+GEMINI_MODEL_NAME = os.environ.get("GEMINI_MODEL_NAME", "gemini-2.5-pro")
+IMAGEN_MODEL_NAME = os.environ.get("IMAGEN_MODEL_NAME", "imagen-3.0-generate-002")
+
+# คิวงานถาวร (app/services/job_queue.py) และ worker (app/worker.py)
+# RUN_EMBEDDED_WORKER=0 เมื่อต้องการให้ API รับงานอย่างเดียว แล้วแยกรัน python -m app.worker
+RUN_EMBEDDED_WORKER = os.environ.get("RUN_EMBEDDED_WORKER", "1") == "1"
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", 60))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+WORKER_POLL_SECONDS = float(os.environ.get("WORKER_POLL_SECONDS", 1.0))
+WORKER_RECLAIM_EVERY_POLLS = 30
+# งาน failed ที่ไม่ถูก retry ภายในเวลานี้ จะถูกลบ checkpoint และไฟล์ภาพ/เสียงที่เก็บไว้ (0 = เก็บไว้ตลอด)
+FAILED_JOB_RETENTION_SECONDS = float(os.environ.get("FAILED_JOB_RETENTION_SECONDS", 7 * 24 * 3600))
+
+# Batch (POST /agent/create-batch): จำนวนไอเดียสูงสุดต่อ batch, จำนวนไอเดียที่ขอ Gemini ในการเรียกครั้งเดียว
+# และจำนวนภาพที่ทุก job ใน batch เดียวกันขอ Imagen พร้อมกันได้รวมกัน (ต่อ worker process)
+BATCH_MAX_IDEAS = int(os.environ.get("BATCH_MAX_IDEAS", 20))
+BATCH_PLAN_GROUP_SIZE = int(os.environ.get("BATCH_PLAN_GROUP_SIZE", 4))
+BATCH_IMAGE_CONCURRENCY = int(os.environ.get("BATCH_IMAGE_CONCURRENCY", IMAGE_GENERATION_CONCURRENCY * 2))
+
+# /jobs/{job_id}/events: ความถี่ในการตรวจฐานข้อมูลเผื่อ job รันอยู่ใน worker process อื่น
+JOB_EVENTS_CHECK_SECONDS = float(os.environ.get("JOB_EVENTS_CHECK_SECONDS", 2.0))
+
+# Google Drive: authenticate ตอน startup ครั้งเดียว และขนาด chunk ของการ upload แบบ resumable (ต้องเป็นทวีคูณของ 256 KiB)
+DRIVE_AUTH_AT_STARTUP = os.environ.get("DRIVE_AUTH_AT_STARTUP", "1") == "1"
+DRIVE_UPLOAD_CHUNK_BYTES = int(os.environ.get("DRIVE_UPLOAD_CHUNK_BYTES", 8 * 1024 * 1024))
+# ไฟล์ credentials ที่บันทึกไว้ (มี refresh token) ว่าง = ใช้ save_credentials_file ใน settings.yaml
+# ไม่มีการเปิดเบราว์เซอร์เพื่อ login บน server หรือใช้ service account แทนได้ (client_config_backend: service)
+DRIVE_CREDENTIALS_FILE = os.environ.get("DRIVE_CREDENTIALS_FILE", "")
+
+# ฐานข้อมูลสถานะของ Job (SQLite โหมด WAL) ดู app/services/job_repository.py
+JOB_DB_PATH = PROJECT_ROOT / "job_statuses.sqlite3"
+
 # สร้าง Directory ที่จำเป็นทั้งหมดตอนที่โปรแกรมเริ่มทำงาน
 CONTENT_DIR.mkdir(parents=True, exist_ok=True)
 UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
 # --- END OF FILE: app/config.py ---
\ No newline at end of file
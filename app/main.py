@@ -6,37 +6,23 @@ import logging
 from pathlib import Path
 from contextlib import asynccontextmanager
 
-# .env file loader
-from dotenv import load_dotenv
-
 # FastAPI and Middleware
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
-# Google Cloud & Vertex AI
-import vertexai
-from google.cloud import texttospeech
-from vertexai.preview.vision_models import ImageGenerationModel
-from vertexai.generative_models import GenerativeModel
-
 # Application-specific imports
-from app.services import tts_service, image_generation_service, gemini_service
+from app.services import worker_pool
 from app.api import endpoints
 from app import config # สมมติว่ามีการใช้ไฟล์ config
+from app import bootstrap
+from app import worker
 
 # =========================================================
 #  2. Initial Setup
 # =========================================================
-# โหลด Environment Variables จากไฟล์ .env
-load_dotenv()
-
-# ตั้งค่า Logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(module)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
+# ตั้งค่า Logging (.env ถูกโหลดตั้งแต่ import app.config)
+bootstrap.configure_logging()
 
 # =========================================================
 #  3. Lifespan Manager (สำหรับ Startup/Shutdown Events)
@@ -45,37 +31,20 @@ logging.basicConfig(
 async def lifespan(app: FastAPI):
     """
     จัดการการเชื่อมต่อกับ Service ภายนอกตอนเปิดและปิดแอปพลิเคชัน
+    client ของ Vertex AI / TTS / Drive และเพลงประกอบถูกเตรียมตาม MODEL_CLIENT_INIT (ค่าเริ่มต้นใน thread เบื้องหลัง)
+    จึงไม่ต้องรอก่อนเริ่มรับ request (วัดได้ด้วย python -m app.bench.startup)
     """
-    logging.info("--- Application Startup: Initializing Google Cloud services... ---")
-    try:
-        project_id = os.environ["GCP_PROJECT_ID"]
-        location = os.environ.get("GCP_LOCATION", "us-central1")
-
-        if "GOOGLE_APPLICATION_CREDENTIALS" not in os.environ:
-            raise ValueError("CRITICAL: GOOGLE_APPLICATION_CREDENTIALS environment variable is not set.")
-
-        logging.info(f"--- [STARTUP] Project: {project_id}, Location: {location} ---")
-        logging.info("--- [STARTUP] Initializing Vertex AI... ---")
-        vertexai.init(project=project_id, location=location)
-
-        logging.info("--- [STARTUP] Creating API clients and models... ---")
-        google_tts_client = texttospeech.TextToSpeechClient()
-        imagen_model = ImageGenerationModel.from_pretrained("imagen-3.0-generate-002")
-        gemini_model = GenerativeModel("gemini-2.5-pro") # อัปเดตเป็นโมเดลที่แนะนำ
-
-        logging.info("--- [STARTUP] Injecting dependencies into services... ---")
-        tts_service.set_tts_client(google_tts_client)
-        image_generation_service.set_image_model(imagen_model)
-        gemini_service.set_gemini_model(gemini_model)
-
-        logging.info("--- [SUCCESS] All services initialized and injected. ---")
+    bootstrap.init_google_services()
+    bootstrap.preload_assets()
 
-    except (KeyError, ValueError) as e:
-        logging.exception(f"CRITICAL STARTUP ERROR: {e}")
+    # worker ที่ฝังอยู่ใน process ของ API (ตั้ง RUN_EMBEDDED_WORKER=0 ถ้าแยกรัน python -m app.worker)
+    embedded_worker = worker.start_embedded_worker() if config.RUN_EMBEDDED_WORKER else None
 
     yield
     
     logging.info("--- Application Shutdown ---")
+    if embedded_worker: embedded_worker.stop()
+    worker_pool.shutdown()
 
 # =========================================================
 #  4. FastAPI App Instantiation and Middleware
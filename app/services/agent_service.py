@@ -5,33 +5,50 @@ import uuid
 import os
 import json
 import shutil
-import shelve
-from filelock import FileLock
+import time
 from pathlib import Path
-from typing import List
-from fastapi import BackgroundTasks
+from typing import List, Dict, Optional
 
 from app import config
 from . import gemini_service
 from . import image_generation_service
 from . import video_service
 from . import google_drive_service
+from . import music_service
+from . import job_repository
+from . import worker_pool
+from . import job_queue
+from . import job_events
+from . import job_checkpoints
+from . import metrics
+from . import rate_limiter
+from .pipeline import Pipeline
 
 # --- สวิตช์สำหรับเปิด/ปิดโหมดดีบัก ---
 DEBUG_BYPASS_VIDEO_CREATION = False
 
-DB_PATH = "job_statuses.db"
-LOCK_PATH = "job_statuses.db.lock"
+# ชนิดของงานในคิวถาวร (ดู run_queued_job ด้านล่าง)
+JOB_KIND_MAGIC = "magic"
+JOB_KIND_MANUAL = "manual"
+JOB_KIND_BATCH_PLAN = "batch_plan"
 
-def update_job_status(job_id: str, status: str, stage: str = "", error: str = "", video_url: str = "", story_text: str = ""):
-    with FileLock(LOCK_PATH, timeout=10):
-        with shelve.open(DB_PATH, writeback=True) as db:
-            if job_id not in db: db[job_id] = {}
-            db[job_id]['status'] = status
-            if stage: db[job_id]['stage'] = stage
-            if error: db[job_id]['error'] = error
-            if video_url: db[job_id]['video_url'] = video_url
-            if story_text: db[job_id]['story_text'] = story_text
+def _publish_job(job_id: str):
+    # ส่งสถานะล่าสุดให้ client ที่เปิด /jobs/{job_id}/events อยู่ใน process นี้
+    if job_events.has_subscribers(job_id):
+        job_events.publish(job_id, job_repository.get_job(job_id))
+
+def update_job_status(
+    job_id: str, status: str, stage: str = "", error: str = "", video_url: str = "", story_text: str = "", batch_id: str = ""
+):
+    job_repository.upsert_job(
+        job_id, status, stage=stage, error=error, video_url=video_url, story_text=story_text, batch_id=batch_id
+    )
+    _publish_job(job_id)
+
+def report_progress(job_id: str, **progress):
+    """บันทึกความคืบหน้าละเอียดของ stage ปัจจุบัน (ภาพที่ i/N, % ของ ffmpeg, byte ที่อัปโหลด)"""
+    job_repository.update_progress(job_id, **progress)
+    _publish_job(job_id)
 
 def bypass_video_creation(output_filename: str) -> str:
     logging.warning("!!! BYPASSING VIDEO CREATION (DEBUG MODE IS ON) !!!")
@@ -39,88 +56,346 @@ def bypass_video_creation(output_filename: str) -> str:
     if not placeholder_video_path.is_file():
         raise FileNotFoundError("Bypass failed: assets/placeholder.mp4 not found.")
     final_video_path = config.CONTENT_DIR / output_filename
+    # ชื่อนี้อาจเป็น hardlink ไปยังไฟล์ใน RENDER_CACHE: ลบ link ก่อน copy จะได้ไม่เขียนทับไฟล์ใน cache
+    final_video_path.unlink(missing_ok=True)
     shutil.copy(placeholder_video_path, final_video_path)
     return str(final_video_path)
 
+def render_video_cached(
+    job_id: str, script: list, image_paths: List[str], voice_name: str, music_filename: str,
+    aspect_ratio: str, music_volume: float, transition_style: str, prepared: Optional[Dict] = None,
+    encoder_profile: Optional[str] = None
+) -> str:
+    """
+    render วิดีโอผ่าน cache: ถ้าเคย compile ด้วย input ชุดเดียวกันมาแล้ว คืนไฟล์เดิมทันที
+    ไม่เช่นนั้น render ใหม่ (ด้วย seed ที่ได้จาก input เพื่อให้ผลลัพธ์เหมือนเดิมทุกครั้ง) แล้วเก็บเข้า cache
+    prepared คือ input ที่ pipeline เตรียมไว้แล้ว (frames, voice, subtitles, audio) ถ้าไม่มีจะทำทุกขั้นตอนใน video_service เอง
+    encoder_profile "adaptive" จะเลือกโปรไฟล์จากความยาวคิว ณ ตอนที่เริ่ม render
+    """
+    output_path = config.CONTENT_DIR / f"{job_id}.mp4"
+    profile_name = video_service.choose_encoder_profile(encoder_profile, job_queue.queue_depth())
+    content_key = video_service.render_cache_key(
+        script, image_paths, voice_name, music_filename, music_volume, aspect_ratio, transition_style
+    )
+    cache_key = video_service.render_output_key(content_key, profile_name)
+    if video_service.RENDER_CACHE.get_copy(cache_key, str(output_path)):
+        logging.info(f"[{job_id}] Render cache hit ({cache_key[:12]}, {profile_name}), reusing existing video.")
+        report_progress(job_id, render_percent=100)
+        return str(output_path)
+
+    logging.info(f"[{job_id}] Rendering with encoder profile '{profile_name}' (requested: {encoder_profile or config.ENCODER_PROFILE}).")
+    on_progress = lambda percent: report_progress(job_id, render_percent=percent)
+    seed = video_service.seed_from_key(content_key)
+    if prepared:
+        temp_dir = config.CONTENT_DIR / f"temp_{job_id}"
+        temp_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            final_video_path_str = worker_pool.run_cpu(
+                video_service.render_prepared_video,
+                image_paths=image_paths, voice_track=prepared["voice"], srt_path=prepared["subtitles"],
+                audio_path=prepared["audio"], aspect_ratio=aspect_ratio,
+                transition_style=transition_style, output_filename=output_path.name, temp_dir=temp_dir,
+                seed=seed, on_progress=on_progress, frame_paths=prepared.get("frames"),
+                encoder_profile=profile_name
+            )
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    else:
+        final_video_path_str = worker_pool.run_cpu(
+            video_service.create_video_with_music,
+            script=script, image_paths=image_paths, voice_name=voice_name,
+            music_filename=music_filename, aspect_ratio=aspect_ratio,
+            music_volume=music_volume, transition_style=transition_style,
+            output_filename=output_path.name, on_progress=on_progress,
+            seed=seed, encoder_profile=profile_name
+        )
+    if final_video_path_str and Path(final_video_path_str).is_file():
+        video_service.RENDER_CACHE.put_file(cache_key, final_video_path_str)
+    return final_video_path_str
+
+def _existing_files(paths) -> bool:
+    return bool(paths) and all(Path(path).is_file() for path in paths)
+
+def _resumable_checkpoints(job_id: str) -> Dict:
+    """checkpoint ที่ยังใช้ต่อได้ (ไฟล์ที่อ้างถึงยังอยู่ครบ) ของ Job นี้"""
+    checkpoints = job_checkpoints.load(job_id)
+    usable = {}
+    if checkpoints.get(job_checkpoints.STAGE_PLAN):
+        usable[job_checkpoints.STAGE_PLAN] = checkpoints[job_checkpoints.STAGE_PLAN]
+    if _existing_files(checkpoints.get(job_checkpoints.STAGE_IMAGES)):
+        usable[job_checkpoints.STAGE_IMAGES] = checkpoints[job_checkpoints.STAGE_IMAGES]
+    voice_track = checkpoints.get(job_checkpoints.STAGE_VOICE)
+    if voice_track and Path(voice_track["path"]).is_file():
+        usable[job_checkpoints.STAGE_VOICE] = voice_track
+    video_path = checkpoints.get(job_checkpoints.STAGE_VIDEO)
+    if video_path and Path(video_path).is_file():
+        usable[job_checkpoints.STAGE_VIDEO] = video_path
+    return usable
+
 # === Workflow สำหรับโหมดอัตโนมัติ (Magic Mode) ===
 def agent_orchestrator_workflow(
     job_id: str, prompt: str, age_group: str, voice_name: str, music_filename: str,
-    aspect_ratio: str, music_volume: float, transition_style: str
+    aspect_ratio: str, music_volume: float, transition_style: str, attempt: int = 1,
+    encoder_profile: Optional[str] = None, batch_id: Optional[str] = None
 ):
+    """
+    ลำดับงานเป็นกราฟ (ดู app/services/pipeline.py):
+        plan -> images -> frames ------------------.
+        plan -> voice -> subtitles, audio ----------+-> video -> upload
+    เสียงพากย์ ซับไตเติล และการผสมเพลง ขึ้นกับ script อย่างเดียว จึงทำไปพร้อมกับการสร้างภาพ
+    ขั้นตอนที่มี checkpoint จากรอบก่อน (กรณี retry หรือ plan ที่ batch สร้างไว้ให้) จะถูกข้ามไป
+    job ใน batch เดียวกัน (batch_id) ใช้โควต้าการสร้างภาพพร้อมกันร่วมกัน
+    """
     final_video_path = None
+    succeeded = False
+    started = time.monotonic()
+    work_dir = config.UPLOADS_DIR / job_id
+    work_dir.mkdir(parents=True, exist_ok=True)
     try:
-        update_job_status(job_id, "processing", "1/5: Generating story plan...")
-        logging.info(f"[{job_id}] Orchestrator: Calling Gemini...")
-        story_plan = gemini_service.create_story_plan_with_persona(idea=prompt, age_group=age_group)
-        story_script = story_plan.get('story_script')
-        image_prompts = story_plan.get('image_prompts')
-        if not story_script or not image_prompts: raise Exception("Gemini failed.")
-        logging.info(f"[{job_id}] Orchestrator: Story plan generated.")
-
-        update_job_status(job_id, "processing", "2/5: Generating images...")
-        logging.info(f"[{job_id}] Orchestrator: Calling Imagen...")
-        image_paths = image_generation_service.generate_images_from_prompts(
-            prompts=image_prompts, story_id=job_id, aspect_ratio=aspect_ratio
-        )
-        logging.info(f"[{job_id}] Orchestrator: All images generated.")
+        def generate_plan():
+            update_job_status(job_id, "processing", "1/5: Generating story plan...")
+            logging.info(f"[{job_id}] Orchestrator: Calling Gemini...")
+            # ถ้าเป็นการ retry หลังขั้นตอนถัดไปล้มเหลว ใช้ plan เดิมจาก cache แทนการสร้างใหม่
+            use_plan_cache = config.STORY_PLAN_CACHE_ENABLED or attempt > 1
+            # การเรียก Gemini รอบน loop กลางของ process (model_loop) ไม่ต้องใช้ thread ของ io pool
+            story_plan = gemini_service.create_story_plan_with_persona(
+                idea=prompt, age_group=age_group, use_cache=use_plan_cache
+            )
+            if not story_plan.get('story_script') or not story_plan.get('image_prompts'): raise Exception("Gemini failed.")
+            job_checkpoints.save(job_id, job_checkpoints.STAGE_PLAN, story_plan)
+            logging.info(f"[{job_id}] Orchestrator: Story plan generated.")
+            update_job_status(job_id, "processing", "2/5: Generating images and voice track...")
+            return story_plan
 
-        update_job_status(job_id, "processing", "3/5: Compiling video...")
-        if DEBUG_BYPASS_VIDEO_CREATION:
-            final_video_path_str = bypass_video_creation(output_filename=f"{job_id}.mp4")
-            logging.info(f"[{job_id}] Orchestrator: Bypassed video creation.")
-        else:
+        def generate_images(plan):
+            logging.info(f"[{job_id}] Orchestrator: Calling Imagen...")
+            image_paths = worker_pool.run_io(
+                image_generation_service.generate_images_from_prompts,
+                prompts=plan['image_prompts'], story_id=job_id, aspect_ratio=aspect_ratio,
+                on_progress=lambda done, total: report_progress(job_id, images_done=done, images_total=total),
+                budget=batch_id
+            )
+            job_checkpoints.save(job_id, job_checkpoints.STAGE_IMAGES, image_paths)
+            logging.info(f"[{job_id}] Orchestrator: All images generated.")
+            return image_paths
+
+        def normalize_frames(images):
+            return worker_pool.run_cpu(video_service.normalize_images, images, aspect_ratio)
+
+        def synthesize_voice(plan):
+            logging.info(f"[{job_id}] Orchestrator: Calling TTS...")
+            voice_track = worker_pool.run_io(
+                video_service.synthesize_voice_track, plan['story_script'], voice_name, str(work_dir / "voice.mp3")
+            )
+            job_checkpoints.save(job_id, job_checkpoints.STAGE_VOICE, voice_track)
+            logging.info(f"[{job_id}] Orchestrator: Voice track ready ({voice_track['duration']:.2f}s).")
+            return voice_track
+
+        def write_subtitles(plan, voice):
+            return video_service.write_subtitles(plan['story_script'], voice, str(work_dir / "subtitles.srt"))
+
+        def mix_audio(voice):
+            return worker_pool.run_cpu(
+                video_service.prepare_audio_track, voice, music_filename, music_volume, str(work_dir / "audio.wav")
+            )
+
+        def compile_video(plan, images, frames, voice, subtitles, audio):
+            update_job_status(job_id, "processing", "3/5: Compiling video...")
+            if DEBUG_BYPASS_VIDEO_CREATION:
+                logging.info(f"[{job_id}] Orchestrator: Bypassed video creation.")
+                return bypass_video_creation(output_filename=f"{job_id}.mp4")
             logging.info(f"[{job_id}] Orchestrator: Calling Video Service...")
-            final_video_path_str = video_service.create_video_with_music(
-                script=story_script, image_paths=image_paths, voice_name=voice_name,
+            return render_video_cached(
+                job_id, script=plan['story_script'], image_paths=images, voice_name=voice_name,
                 music_filename=music_filename, aspect_ratio=aspect_ratio,
                 music_volume=music_volume, transition_style=transition_style,
-                output_filename=f"{job_id}.mp4"
+                prepared={"frames": frames, "voice": voice, "subtitles": subtitles, "audio": audio},
+                encoder_profile=encoder_profile
             )
-        
+
+        # ผลลัพธ์ของขั้นตอนที่เสร็จแล้วจากรอบก่อน (กรณี retry) จะถูกใช้ต่อ ไม่ต้องสร้างใหม่
+        checkpoints = _resumable_checkpoints(job_id)
+        if checkpoints:
+            logging.info(f"[{job_id}] Orchestrator: Resuming with checkpointed stages: {sorted(checkpoints)}")
+            update_job_status(job_id, "processing", "2/5: Generating images and voice track...")
+        if job_checkpoints.STAGE_VIDEO in checkpoints and job_checkpoints.STAGE_PLAN in checkpoints:
+            results = checkpoints
+        else:
+            checkpoints.pop(job_checkpoints.STAGE_VIDEO, None)
+            dag = Pipeline(name=f"job-{job_id[:8]}")
+            dag.add(job_checkpoints.STAGE_PLAN, generate_plan)
+            dag.add(job_checkpoints.STAGE_IMAGES, generate_images, deps=["plan"])
+            dag.add("frames", normalize_frames, deps=["images"])
+            dag.add(job_checkpoints.STAGE_VOICE, synthesize_voice, deps=["plan"])
+            dag.add("subtitles", write_subtitles, deps=["plan", "voice"])
+            dag.add("audio", mix_audio, deps=["voice"])
+            dag.add(job_checkpoints.STAGE_VIDEO, compile_video, deps=["plan", "images", "frames", "voice", "subtitles", "audio"])
+            try:
+                results = dag.run(initial=checkpoints)
+            finally:
+                job_repository.update_timings(job_id, **dag.timings)
+            logging.info(f"[{job_id}] Orchestrator: Stage timings: " + ", ".join(
+                f"{name}={seconds:.2f}s" for name, seconds in dag.timings.items()
+            ))
+
+        story_script = results[job_checkpoints.STAGE_PLAN]['story_script']
+        final_video_path_str = results[job_checkpoints.STAGE_VIDEO]
         final_video_path = Path(final_video_path_str) if final_video_path_str else None
         if not final_video_path or not final_video_path.is_file(): raise Exception("Video step failed.")
+        job_checkpoints.save(job_id, job_checkpoints.STAGE_VIDEO, str(final_video_path))
         logging.info(f"[{job_id}] Orchestrator: Video step complete. Path: {final_video_path}")
 
         update_job_status(job_id, "processing", "4/5: Uploading to Google Drive...")
         logging.info(f"[{job_id}] Orchestrator: Uploading to Google Drive...")
         GOOGLE_DRIVE_FOLDER_ID = "YOUR_GOOGLE_DRIVE_FOLDER_ID_HERE"
-        shareable_link = google_drive_service.upload_video_to_drive(
-            local_video_path=str(final_video_path), remote_folder_id=GOOGLE_DRIVE_FOLDER_ID
-        )
+        upload_started = time.monotonic()
+        with metrics.timed("story_stage_duration_seconds", stage="upload"):
+            shareable_link = worker_pool.run_io(
+                google_drive_service.upload_video_to_drive,
+                local_video_path=str(final_video_path), remote_folder_id=GOOGLE_DRIVE_FOLDER_ID,
+                on_progress=lambda sent, total: report_progress(job_id, upload_bytes=sent, upload_total_bytes=total)
+            )
+        job_repository.update_timings(job_id, upload=time.monotonic() - upload_started)
 
         story_text_for_display = " ".join([line.get("text", "") for line in story_script])
         update_job_status(job_id, "completed", "5/5: Done!", video_url=shareable_link, story_text=story_text_for_display)
+        succeeded = True
         logging.info(f"[{job_id}] Orchestrator: Workflow completed! Video at {shareable_link}")
         
     except Exception as e:
         logging.exception(f"[{job_id}] Orchestrator: Workflow failed.")
         update_job_status(job_id, "failed", error=str(e))
     finally:
-        image_temp_dir = config.UPLOADS_DIR / job_id
-        if image_temp_dir.exists(): shutil.rmtree(image_temp_dir)
-        logging.info(f"[{job_id}] Orchestrator Cleanup complete.")
+        job_repository.update_timings(job_id, total=time.monotonic() - started)
+        metrics.inc("story_jobs_total", kind=JOB_KIND_MAGIC, status="completed" if succeeded else "failed")
+        # เก็บภาพและเสียงพากย์ไว้เมื่อ workflow ล้มเหลว เพื่อให้ POST /jobs/{job_id}/retry ทำต่อได้โดยไม่ต้องสร้างใหม่
+        if succeeded:
+            if work_dir.exists(): shutil.rmtree(work_dir)
+            job_checkpoints.clear(job_id)
+            logging.info(f"[{job_id}] Orchestrator Cleanup complete.")
+        else:
+            logging.info(f"[{job_id}] Orchestrator: Keeping checkpoints and images for retry.")
+
+def _enqueue_job(job_id: str, kind: str, payload: dict):
+    """ส่งงานเข้าคิวถาวร ถ้าคิวเต็มจะบันทึกสถานะแล้วโยน QueueFullError ต่อให้ endpoint"""
+    try:
+        job_queue.enqueue(job_id, kind, payload)
+    except job_queue.QueueFullError as e:
+        update_job_status(job_id, "failed", error=str(e))
+        raise
 
-# [แก้ไข] ใส่พารามิเตอร์ทั้งหมดกลับเข้ามา
 def start_video_creation_job(
-    background_tasks: BackgroundTasks, prompt: str, age_group: str, voice_name: str,
-    music_filename: str, aspect_ratio: str, music_volume: float, transition_style: str
+    prompt: str, age_group: str, voice_name: str,
+    music_filename: str, aspect_ratio: str, music_volume: float, transition_style: str,
+    encoder_profile: Optional[str] = None
 ) -> str:
     job_id = str(uuid.uuid4())
     logging.info(f"Agent Service: Queuing new MAGIC job with ID: {job_id}")
     update_job_status(job_id, "pending", "0/5: Job queued...")
-    background_tasks.add_task(
-        agent_orchestrator_workflow, job_id=job_id, prompt=prompt, age_group=age_group,
+    _enqueue_job(job_id, JOB_KIND_MAGIC, dict(
+        prompt=prompt, age_group=age_group,
         voice_name=voice_name, music_filename=music_filename, aspect_ratio=aspect_ratio,
-        music_volume=music_volume, transition_style=transition_style
-    )
+        music_volume=music_volume, transition_style=transition_style, encoder_profile=encoder_profile
+    ))
     return job_id
 
+# === Batch: หลายไอเดียจาก request เดียว (POST /agent/create-batch) ===
+def _batch_job_payload(job: Dict, batch_id: str, age_group: str, settings: Dict) -> Dict:
+    return dict(prompt=job["prompt"], age_group=age_group, batch_id=batch_id, **settings)
+
+def batch_planning_workflow(job_id: str, jobs: List[Dict], age_group: str, **settings):
+    """
+    งานแรกของ batch (job_id ของงานนี้คือ batch_id): เตรียมของที่ใช้ร่วมกันครั้งเดียว แล้วปล่อยงานย่อยที่จองที่ในคิวไว้
+    - authenticate Google Drive และ decode เพลงไว้ก่อน งานย่อยทุกงานใน process นี้ใช้ต่อได้เลย (ล้มเหลวได้ ไม่ทำให้ batch ล้ม)
+    - ขอ story plan จาก Gemini ทีละ BATCH_PLAN_GROUP_SIZE ไอเดียต่อการเรียก บันทึกเป็น checkpoint ของแต่ละงาน
+      ไอเดียที่ได้ plan ไม่ครบ งานย่อยจะสร้าง plan ของตัวเองตามปกติ
+    - ถ้ามีอะไรผิดพลาด งานย่อยที่ยังไม่ถูกปล่อยจะถูก mark failed (retry ทีละงานได้)
+    """
+    batch_id = job_id
+    remaining = jobs
+    try:
+        try:
+            google_drive_service.init_drive_client()
+        except Exception as e:
+            logging.warning(f"[{batch_id}] Batch: Could not authenticate Google Drive ahead of time: {e}")
+        try:
+            music_service.load_track(settings["music_filename"])
+        except Exception as e:
+            logging.warning(f"[{batch_id}] Batch: Could not pre-decode music: {e}")
+
+        # ถ้างานนี้เคยถูกทำไปบางส่วนแล้ว (worker ตายแล้วถูก reclaim) ข้ามงานย่อยที่ถูกปล่อยไปแล้ว
+        # (state None = batch ที่ส่งเข้ามาก่อนมีการจองที่ งานย่อยยังไม่อยู่ในคิว)
+        remaining = [job for job in jobs if job_queue.get_state(job["job_id"]) in (job_queue.STATE_RESERVED, None)]
+        group_size = max(1, config.BATCH_PLAN_GROUP_SIZE)
+        for start in range(0, len(remaining), group_size):
+            group = remaining[start:start + group_size]
+            for job in group:
+                update_job_status(job["job_id"], "pending", "0/5: Generating story plans for the batch...")
+            plans = [None] * len(group)
+            if len(group) > 1:
+                try:
+                    plans = gemini_service.create_story_plans_batch([job["prompt"] for job in group], age_group)
+                except Exception as e:
+                    logging.warning(f"[{batch_id}] Batch: Combined story planning failed, jobs will plan individually: {e}")
+            for job, plan in zip(group, plans):
+                if plan is not None:
+                    job_checkpoints.save(job["job_id"], job_checkpoints.STAGE_PLAN, plan)
+                update_job_status(job["job_id"], "pending", "0/5: Job queued...")
+                if not job_queue.release(job["job_id"]) and job_queue.get_state(job["job_id"]) is None:
+                    job_queue.enqueue(
+                        job["job_id"], JOB_KIND_MAGIC, _batch_job_payload(job, batch_id, age_group, settings),
+                        lane=batch_id, check_limit=False
+                    )
+        logging.info(f"[{batch_id}] Batch: Released {len(remaining)} jobs.")
+    except Exception as e:
+        logging.exception(f"[{batch_id}] Batch: Failed to queue batch jobs.")
+        error = f"Batch setup error: {str(e)}"
+        for job in remaining:
+            state = job_queue.get_state(job["job_id"])
+            if state in (job_queue.STATE_RESERVED, None):
+                if state is not None: job_queue.cancel_reserved(job["job_id"], error)
+                update_job_status(job["job_id"], "failed", error=error)
+
+def start_batch_job(
+    prompts: List[str], age_group: str, voice_name: str,
+    music_filename: str, aspect_ratio: str, music_volume: float, transition_style: str,
+    encoder_profile: Optional[str] = None
+) -> Dict:
+    """
+    สร้าง Job หนึ่งงานต่อไอเดีย แล้วส่งงานวางแผนของ batch เข้าคิว
+    งานวางแผนและงานย่อยทุกงานจองที่ในคิวไว้พร้อมกันใน transaction เดียว (งานย่อยจะถูกปล่อยโดยงานวางแผน)
+    ถ้าที่ในคิวไม่พอสำหรับทั้ง batch จะโยน QueueFullError โดยยังไม่สร้างอะไรเลย
+    """
+    batch_id = str(uuid.uuid4())
+    settings = dict(
+        voice_name=voice_name, music_filename=music_filename, aspect_ratio=aspect_ratio,
+        music_volume=music_volume, transition_style=transition_style, encoder_profile=encoder_profile
+    )
+    jobs = [dict(job_id=str(uuid.uuid4()), prompt=prompt) for prompt in prompts]
+    job_queue.enqueue_many(
+        [dict(job_id=batch_id, kind=JOB_KIND_BATCH_PLAN, payload=dict(jobs=jobs, age_group=age_group, **settings), reserved=True)]
+        + [
+            dict(job_id=job["job_id"], kind=JOB_KIND_MAGIC, payload=_batch_job_payload(job, batch_id, age_group, settings), reserved=True)
+            for job in jobs
+        ],
+        lane=batch_id
+    )
+    logging.info(f"Agent Service: Queued new BATCH {batch_id} with {len(prompts)} jobs.")
+    for job in jobs:
+        update_job_status(job["job_id"], "pending", "0/5: Waiting for batch story planning...", batch_id=batch_id)
+    # ปล่อยงานวางแผนหลังสร้างสถานะของงานย่อยครบแล้ว ไม่ให้ worker เขียนสถานะก่อนแล้วถูกทับ
+    job_queue.release(batch_id)
+    return dict(batch_id=batch_id, job_ids=[job["job_id"] for job in jobs])
+
 # === Workflow และฟังก์ชันสำหรับโหมด Manual Upload ===
 def manual_compilation_workflow(
     job_id: str, story_script: list, image_paths: List[str], voice_name: str,
-    music_filename: str, aspect_ratio: str, music_volume: float, transition_style: str
+    music_filename: str, aspect_ratio: str, music_volume: float, transition_style: str,
+    encoder_profile: Optional[str] = None
 ):
     final_video_path = None
+    succeeded = False
+    started = time.monotonic()
     image_temp_dir = Path(image_paths[0]).parent if image_paths else None
     try:
         update_job_status(job_id, "processing", "1/2: Compiling video...")
@@ -129,12 +404,13 @@ def manual_compilation_workflow(
             logging.info(f"[{job_id}] Manual: Bypassed video creation.")
         else:
             logging.info(f"[{job_id}] Manual: Calling Video Service...")
-            final_video_path_str = video_service.create_video_with_music(
-                script=story_script, image_paths=image_paths, voice_name=voice_name,
+            final_video_path_str = render_video_cached(
+                job_id, script=story_script, image_paths=image_paths, voice_name=voice_name,
                 music_filename=music_filename, aspect_ratio=aspect_ratio,
                 music_volume=music_volume, transition_style=transition_style,
-                output_filename=f"{job_id}.mp4"
+                encoder_profile=encoder_profile
             )
+            job_repository.update_timings(job_id, compile=time.monotonic() - started)
 
         final_video_path = Path(final_video_path_str) if final_video_path_str else None
         if not final_video_path or not final_video_path.is_file(): raise Exception("Manual video compilation failed.")
@@ -143,18 +419,20 @@ def manual_compilation_workflow(
         story_text_for_display = " ".join([line.get("text", "") for line in story_script])
         video_url = f"/content/{job_id}.mp4"
         update_job_status(job_id, "completed", "2/2: Done!", video_url=video_url, story_text=story_text_for_display)
+        succeeded = True
         logging.info(f"[{job_id}] Manual: Workflow completed! Video at {video_url}")
         
     except Exception as e:
         logging.exception(f"[{job_id}] Manual: Workflow failed.")
         update_job_status(job_id, "failed", error=f"Manual compilation error: {str(e)}")
     finally:
-        if image_temp_dir and image_temp_dir.exists(): shutil.rmtree(image_temp_dir)
+        job_repository.update_timings(job_id, total=time.monotonic() - started)
+        metrics.inc("story_jobs_total", kind=JOB_KIND_MANUAL, status="completed" if succeeded else "failed")
+        # ภาพที่อัปโหลดมาจะถูกเก็บไว้เมื่อล้มเหลว เพื่อให้ retry ได้โดยไม่ต้องอัปโหลดใหม่
+        if succeeded and image_temp_dir and image_temp_dir.exists(): shutil.rmtree(image_temp_dir)
         logging.info(f"[{job_id}] Manual: Cleanup complete.")
 
-# [แก้ไข] ใส่พารามิเตอร์ทั้งหมดกลับเข้ามา
 def start_manual_compilation_job(
-    background_tasks: BackgroundTasks,
     job_id: str,
     story_script_json: str,
     image_paths: List[str],
@@ -162,7 +440,8 @@ def start_manual_compilation_job(
     music_filename: str,
     aspect_ratio: str,
     music_volume: float,
-    transition_style: str
+    transition_style: str,
+    encoder_profile: Optional[str] = None
 ) -> str:
     logging.info(f"Agent Service: Queuing new MANUAL job with ID: {job_id}")
     update_job_status(job_id, "pending", "0/2: Job queued...")
@@ -170,11 +449,73 @@ def start_manual_compilation_job(
         story_script = json.loads(story_script_json)
     except json.JSONDecodeError:
         raise ValueError("Invalid JSON format for story script.")
-    background_tasks.add_task(
-        manual_compilation_workflow,
-        job_id=job_id, story_script=story_script, image_paths=image_paths,
+    _enqueue_job(job_id, JOB_KIND_MANUAL, dict(
+        story_script=story_script, image_paths=image_paths,
         voice_name=voice_name, music_filename=music_filename,
         aspect_ratio=aspect_ratio, music_volume=music_volume,
-        transition_style=transition_style
-    )
-    return job_id
\ No newline at end of file
+        transition_style=transition_style, encoder_profile=encoder_profile
+    ))
+    return job_id
+
+# === Retry งานที่ล้มเหลว (ทำต่อจากขั้นตอนแรกที่ยังไม่เสร็จ ดู job_checkpoints) ===
+def retry_job(job_id: str) -> bool:
+    """นำงานที่ failed กลับเข้าคิวด้วย payload เดิม คืน False ถ้างานนี้ retry ไม่ได้ (ไม่ได้ failed หรือไม่อยู่ในคิว)"""
+    job = job_repository.get_job(job_id)
+    if not job or job.get("status") != "failed":
+        return False
+    if job_queue.get_state(job_id) not in (job_queue.STATE_DONE, job_queue.STATE_FAILED):
+        return False
+    resume_from = list(job_checkpoints.load(job_id))
+    # ล้างสถานะของรอบที่ล้มเหลวก่อนคืนงานเข้าคิว ไม่เช่นนั้น worker ที่ lease งานไปทันทีจะถูกเขียนทับกลับเป็น pending
+    job_repository.reset_for_retry(job_id)
+    update_job_status(job_id, "pending", "Job queued for retry...")
+    try:
+        requeued = job_queue.requeue(job_id)
+    except job_queue.QueueFullError:
+        update_job_status(job_id, "failed", error=job.get("error", ""))
+        raise
+    if not requeued:
+        update_job_status(job_id, "failed", error=job.get("error", ""))
+        return False
+    logging.info(f"[{job_id}] Agent Service: Retrying job, checkpointed stages: {resume_from or 'none'}")
+    return True
+
+def purge_expired_failures() -> int:
+    """
+    ลบ checkpoint และไฟล์ภาพ/เสียงใน UPLOADS_DIR ของงาน failed ที่ไม่มีใคร retry ภายใน FAILED_JOB_RETENTION_SECONDS
+    (workflow เก็บไว้ให้ retry ทำต่อได้ แต่ถ้าไม่ถูก retry เลยจะค้างอยู่ตลอดไป) งานเหล่านี้จะ retry ไม่ได้อีก
+    """
+    if config.FAILED_JOB_RETENTION_SECONDS <= 0:
+        return 0
+    job_ids = job_queue.purge_failed(config.FAILED_JOB_RETENTION_SECONDS)
+    for job_id in job_ids:
+        job_checkpoints.clear(job_id)
+        shutil.rmtree(config.UPLOADS_DIR / job_id, ignore_errors=True)
+    if job_ids:
+        logging.info(f"Agent Service: Removed checkpoints and files of {len(job_ids)} failed jobs that were never retried.")
+    return len(job_ids)
+
+# === ตัวกลางสำหรับ worker (app/worker.py) ===
+JOB_WORKFLOWS = {
+    JOB_KIND_MAGIC: agent_orchestrator_workflow,
+    JOB_KIND_MANUAL: manual_compilation_workflow,
+    JOB_KIND_BATCH_PLAN: batch_planning_workflow,
+}
+
+def call_priority(kind: str, payload: dict) -> int:
+    """priority ของการเรียก model ของงาน: manual (มีผู้ใช้รออยู่) ก่อน -> งานทั่วไป -> งานใน batch"""
+    if kind == JOB_KIND_MANUAL:
+        return rate_limiter.INTERACTIVE
+    if kind == JOB_KIND_BATCH_PLAN or payload.get("batch_id"):
+        return rate_limiter.BATCH
+    return rate_limiter.DEFAULT
+
+def run_queued_job(kind: str, job_id: str, payload: dict, attempt: int = 1):
+    """เรียก workflow ตามชนิดของงานที่ worker lease มาจากคิว (attempt > 1 คือการลองใหม่)"""
+    workflow = JOB_WORKFLOWS.get(kind)
+    if workflow is None: raise ValueError(f"Unknown job kind: {kind}")
+    level = call_priority(kind, payload)
+    if kind == JOB_KIND_MAGIC:
+        payload = dict(payload, attempt=attempt)
+    with rate_limiter.priority(level):
+        workflow(job_id=job_id, **payload)
\ No newline at end of file
@@ -0,0 +1,143 @@
+# --- START OF FILE: app/services/cache_service.py ---
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+import logging
+from pathlib import Path
+from typing import Optional, Dict, List
+
+from app import config
+
+# Cache ไฟล์แบบ content-addressed บน disk (ใต้ config.CACHE_DIR)
+# - key คือ sha256 ของ input ที่กำหนดผลลัพธ์ทั้งหมด ไฟล์เดียวกันจึงใช้ซ้ำได้ทุก process
+# - จำกัดขนาดรวมไว้ที่ max_bytes แล้วลบไฟล์ที่ถูกใช้ล่าสุดนานที่สุดก่อน (LRU ตาม mtime)
+# - นับ hit/miss/eviction ไว้ใน process เพื่อดูอัตรา hit (ทุก instance อยู่ใน CACHES ให้ /metrics อ่านได้)
+
+CACHES: List["DiskCache"] = []
+
+
+class DiskCache:
+    def __init__(self, name: str, max_bytes: int, suffix: str = ""):
+        self.name = name
+        self.directory = config.CACHE_DIR / name
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        CACHES.append(self)
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """สร้าง key จากค่าใดๆ ที่ serialize เป็น JSON ได้"""
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+        """sha256 ของเนื้อหาไฟล์ (อ่านทีละ chunk)"""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get_copy(self, key: str, destination: str) -> Optional[Path]:
+        """ถ้ามีใน cache ให้ hardlink (หรือ copy ถ้าอยู่คนละ filesystem) ไปที่ destination"""
+        path = self.get(key)
+        if path is None:
+            return None
+        destination_path = Path(destination)
+        destination_path.parent.mkdir(parents=True, exist_ok=True)
+        if destination_path.exists():
+            destination_path.unlink()
+        try:
+            os.link(path, destination_path)
+        except OSError:
+            shutil.copyfile(path, destination_path)
+        return destination_path
+
+    def path_for(self, key: str) -> Path:
+        return self.directory / f"{key}{self.suffix}"
+
+    def get(self, key: str) -> Optional[Path]:
+        """คืน Path ของไฟล์ใน cache (และขยับให้เป็นไฟล์ที่ใช้ล่าสุด) หรือ None ถ้าไม่มี"""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put_bytes(self, key: str, data: bytes) -> Path:
+        tmp_path = self.directory / f".{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        return self._commit(key, tmp_path)
+
+    def put_file(self, key: str, source_path: str) -> Path:
+        tmp_path = self.directory / f".{uuid.uuid4().hex}.tmp"
+        shutil.copyfile(source_path, tmp_path)
+        return self._commit(key, tmp_path)
+
+    def _commit(self, key: str, tmp_path: Path) -> Path:
+        # os.replace เป็น atomic: process อื่นจะเห็นไฟล์ครบทั้งไฟล์หรือไม่เห็นเลย
+        path = self.path_for(key)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """ลบไฟล์ที่ไม่ได้ใช้นานที่สุดจนกว่าขนาดรวมจะไม่เกิน max_bytes"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+        logging.info(f"Cache '{self.name}': evicted down to {total} bytes (limit {self.max_bytes}).")
+
+    def stats(self) -> Dict:
+        entries = self._entries()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes,
+            }
+
+# --- END OF FILE ---
@@ -0,0 +1,130 @@
+# --- START OF FILE: app/services/clients.py ---
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from app import config
+from . import model_loop
+
+# Client ของ Vertex AI / TTS แบบ lazy: สร้างเมื่อถูกใช้ครั้งแรกเท่านั้น (ครั้งเดียวต่อ process, thread-safe)
+# - import SDK ตัวหนัก (vertexai, google.cloud.texttospeech) อยู่ใน factory ไม่ใช่ตอน import module
+#   API / worker จึงเริ่มรับ request ได้ทันที และ worker ที่ทำแต่งาน manual ไม่ต้องโหลด Imagen / Gemini เลย
+# - warm_up() สร้างทุก client ไว้ก่อน (bootstrap เรียกใน thread เบื้องหลังตาม MODEL_CLIENT_INIT)
+# - service ยังรับ client จากภายนอกได้ผ่าน set_* เดิม (เช่น backend ปลอมใน app/bench) ซึ่งจะไม่เรียก factory อีก
+# บน loop กลางของ model_loop ต้องใช้ get_async() (factory ที่ช้าจะรันใน thread แยก ไม่ block การเรียก model อื่น)
+
+
+class LazyClient:
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self._factory = factory
+        self._client = None
+        self._injected = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._client is not None
+
+    @property
+    def injected(self) -> bool:
+        """client ถูกฉีดเข้ามาผ่าน set() (ไม่ได้สร้างจาก factory)"""
+        return self._injected
+
+    def set(self, client):
+        with self._lock:
+            self._client = client
+            self._injected = client is not None
+
+    def get(self):
+        client = self._client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._client is None:
+                started = time.monotonic()
+                self._client = self._factory()
+                logging.info(f"Clients: Created '{self.name}' in {time.monotonic() - started:.2f}s.")
+            return self._client
+
+    async def get_async(self):
+        if self._client is not None:
+            return self._client
+        return await asyncio.to_thread(self.get)
+
+
+# --- factory (import SDK ภายในเท่านั้น) ---
+_vertexai_lock = threading.Lock()
+_vertexai_ready = False
+
+
+def _init_vertexai():
+    global _vertexai_ready
+    with _vertexai_lock:
+        if _vertexai_ready: return
+        project_id = os.environ.get("GCP_PROJECT_ID")
+        if not project_id:
+            raise ValueError("CRITICAL: GCP_PROJECT_ID environment variable is not set.")
+        if "GOOGLE_APPLICATION_CREDENTIALS" not in os.environ:
+            raise ValueError("CRITICAL: GOOGLE_APPLICATION_CREDENTIALS environment variable is not set.")
+        location = os.environ.get("GCP_LOCATION", "us-central1")
+        import vertexai
+        logging.info(f"Clients: Initializing Vertex AI (project {project_id}, location {location})...")
+        vertexai.init(project=project_id, location=location)
+        _vertexai_ready = True
+
+
+def _create_imagen():
+    _init_vertexai()
+    from vertexai.preview.vision_models import ImageGenerationModel
+    return ImageGenerationModel.from_pretrained(config.IMAGEN_MODEL_NAME)
+
+
+def _create_gemini():
+    _init_vertexai()
+    from vertexai.generative_models import GenerativeModel
+    return GenerativeModel(config.GEMINI_MODEL_NAME)
+
+
+def _create_tts():
+    from google.cloud import texttospeech
+    return texttospeech.TextToSpeechClient()
+
+
+async def _create_tts_async_on_loop():
+    from google.cloud import texttospeech
+    return texttospeech.TextToSpeechAsyncClient()
+
+
+def _create_tts_async():
+    # client แบบ async (gRPC aio) ผูกกับ loop ที่สร้างมัน จึงต้องสร้างบน loop กลาง
+    # import module ก่อนใน thread นี้ เพื่อให้ส่วนที่รันบน loop เหลือแค่การสร้าง object
+    from google.cloud import texttospeech  # noqa: F401
+    return model_loop.run(_create_tts_async_on_loop())
+
+
+imagen = LazyClient("imagen", _create_imagen)
+gemini = LazyClient("gemini", _create_gemini)
+tts = LazyClient("tts", _create_tts)
+tts_async = LazyClient("tts_async", _create_tts_async)
+
+# client ที่ warm_up สร้างไว้ก่อน (tts แบบ blocking ใช้เฉพาะเมื่อถูกฉีดเข้ามาเอง ดู tts_service)
+WARM_UP_CLIENTS = (gemini, imagen, tts_async)
+
+
+def warm_up() -> Dict[str, Optional[str]]:
+    """สร้าง client ทั้งหมดที่ยังไม่มี คืน dict ของชื่อ -> error (None = สำเร็จ) client ที่สร้างไม่ได้จะลองใหม่เมื่อถูกใช้จริง"""
+    errors = {}
+    for client in WARM_UP_CLIENTS:
+        try:
+            client.get()
+            errors[client.name] = None
+        except Exception as e:
+            logging.warning(f"Clients: Could not create '{client.name}' during warm-up: {e}")
+            errors[client.name] = str(e)
+    return errors
+
+# --- END OF FILE ---
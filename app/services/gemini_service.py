@@ -1,38 +1,82 @@
 # --- START OF FILE: app/services/gemini_service.py (เวอร์ชัน Final) ---
+import asyncio
 import logging
 import json
-from typing import Optional, Dict
+from typing import TYPE_CHECKING, Optional, Dict, List
 
-# [แก้ไข] Import library ที่ถูกต้องจาก Vertex AI SDK
-from vertexai.generative_models import GenerativeModel, Part, GenerationConfig
+# Vertex AI SDK โหลดเมื่อใช้ครั้งแรกเท่านั้น (ดู app/services/clients.py)
+if TYPE_CHECKING:
+    from vertexai.generative_models import GenerativeModel, GenerationConfig
 
 # [ใหม่] Import Persona ที่เราสร้างขึ้น
 from app.agents.personas import PERSONA_FOR_AGES_5_TO_7
+from app import config
+from app.services.cache_service import DiskCache
+from app.services import plan_cache, metrics, model_loop, clients
 
 # [แก้ไข] เราจะใช้ Dependency Injection เหมือน service อื่นๆ
-# สร้างตัวแปร Global ไว้รอรับ Model จาก main.py
-GEMINI_MODEL: Optional[GenerativeModel] = None
-
-def set_gemini_model(model: GenerativeModel):
-    """ฟังก์ชันนี้จะถูกเรียกโดย main.py ตอน Startup เพื่อตั้งค่า Model"""
-    global GEMINI_MODEL
-    GEMINI_MODEL = model
+# ถ้าไม่มีใครฉีด Model เข้ามา clients.gemini จะสร้างให้เองเมื่อถูกใช้ครั้งแรก
+def set_gemini_model(model: "GenerativeModel"):
+    """ฉีด Model จากภายนอก (เช่น backend ปลอมของ app/bench) แทนตัวที่ clients สร้างเอง"""
+    clients.gemini.set(model)
     logging.info("✅ Gemini 1.5 Pro Model has been successfully injected.")
 
-def create_story_plan_with_persona(idea: str, age_group: str, image_style: str = "3D animated movie style") -> Dict:
+# ค่า generation config ของ story plan (เป็นส่วนหนึ่งของ key ใน plan cache ด้วย)
+STORY_PLAN_GENERATION_CONFIG = dict(
+    temperature=0.8,
+    top_p=1.0,
+    max_output_tokens=4096,
+    response_mime_type="application/json", # บังคับให้ Gemini ตอบเป็น JSON
+)
+
+def story_plan_cache_key(system_prompt: str, idea: str, age_group: str, image_style: str) -> str:
+    # ชื่อ Model จาก client ที่ถูกฉีดเข้ามา ไม่เช่นนั้นใช้ชื่อใน config (key เดิมเสมอไม่ว่า Model ถูกสร้างแล้วหรือยัง และไม่ต้องสร้าง Model เพื่อคำนวณ key)
+    if clients.gemini.injected:
+        model_name = getattr(clients.gemini.get(), "_model_name", "")
+    else:
+        model_name = config.GEMINI_MODEL_NAME
+    return DiskCache.make_key(system_prompt, idea, age_group, image_style, model_name, STORY_PLAN_GENERATION_CONFIG)
+
+def _persona_for(age_group: str) -> str:
+    # เลือก Persona ตามกลุ่มอายุ
+    if age_group in ["3-5", "5-7", "8-10"]: # ทำให้รองรับกลุ่มอายุทั้งหมดที่เรามี
+        return PERSONA_FOR_AGES_5_TO_7 # ตอนนี้ยังใช้ Persona เดียวกันไปก่อน
+    return PERSONA_FOR_AGES_5_TO_7
+
+def _is_story_plan(plan) -> bool:
+    return isinstance(plan, dict) and all(k in plan for k in ["story_script", "image_prompts"])
+
+async def _generate_content(parts: List, generation_config: "GenerationConfig"):
+    """เรียก Gemini บน loop กลาง (model_loop) ภายใต้ rate limit และ limit ของ backend gemini (ลองใหม่เมื่อเจอ quota error)"""
+    model = await clients.gemini.get_async()
+    if hasattr(model, "generate_content_async"):
+        return await model_loop.call(
+            model_loop.GEMINI, lambda: model.generate_content_async(parts, generation_config=generation_config)
+        )
+    return await model_loop.call(model_loop.GEMINI, lambda: model_loop.in_executor(
+        model_loop.GEMINI, model.generate_content, parts, generation_config=generation_config
+    ))
+
+def create_story_plan_with_persona(
+    idea: str, age_group: str, image_style: str = "3D animated movie style", use_cache: Optional[bool] = None
+) -> Dict:
     """
     สร้าง Story Plan ทั้งหมดโดยใช้ Persona ที่กำหนดไว้ (ฟังก์ชันหลักของเรา)
+    plan ที่สร้างสำเร็จจะถูกบันทึกลง plan cache เสมอ ส่วนการอ่านจาก cache ทำเมื่อ use_cache เป็น True
+    (ค่าเริ่มต้นตาม config.STORY_PLAN_CACHE_ENABLED)
+    เวอร์ชัน blocking: รอผลจาก create_story_plan_with_persona_async ที่รันบน loop กลาง
     """
-    if not GEMINI_MODEL:
-        raise Exception("Gemini Model has not been set. Call set_gemini_model() during application startup.")
-        
+    return model_loop.run(create_story_plan_with_persona_async(idea, age_group, image_style, use_cache))
+
+async def create_story_plan_with_persona_async(
+    idea: str, age_group: str, image_style: str = "3D animated movie style", use_cache: Optional[bool] = None
+) -> Dict:
+    """เวอร์ชัน async ของ create_story_plan_with_persona (ต้องรันบน loop กลาง ดู model_loop.run / run_async)"""
+    if use_cache is None:
+        use_cache = config.STORY_PLAN_CACHE_ENABLED
     logging.info(f"Gemini Service: Creating story plan for age group {age_group} with idea: '{idea}'")
 
-    # เลือก Persona ตามกลุ่มอายุ
-    if age_group in ["3-5", "5-7", "8-10"]: # ทำให้รองรับกลุ่มอายุทั้งหมดที่เรามี
-        system_prompt = PERSONA_FOR_AGES_5_TO_7 # ตอนนี้ยังใช้ Persona เดียวกันไปก่อน
-    else:
-        system_prompt = PERSONA_FOR_AGES_5_TO_7
+    system_prompt = _persona_for(age_group)
 
     user_prompt = f"""
 Here is the user's story idea: "{idea}"
@@ -41,13 +85,20 @@ The visual style for the images should be: "{image_style}"
 Now, generate the complete JSON story plan according to the principles I provided.
 """
 
+    cache_key = story_plan_cache_key(system_prompt, idea, age_group, image_style)
+    if use_cache:
+        # plan cache อยู่บน disk / SQLite จึงอ่านเขียนใน thread แยก ไม่ block loop กลาง
+        cached_plan = await asyncio.to_thread(plan_cache.get, cache_key)
+        metrics.inc("story_plan_cache_requests_total", result="hit" if cached_plan is not None else "miss")
+        if cached_plan is not None:
+            logging.info(f"Gemini Service: Story plan served from cache ({cache_key[:12]}).")
+            return cached_plan
+
     # --- การเรียก Gemini API (Vertex AI SDK) ---
-    generation_config = GenerationConfig(
-        temperature=0.8,
-        top_p=1.0,
-        max_output_tokens=4096,
-        response_mime_type="application/json", # บังคับให้ Gemini ตอบเป็น JSON
-    )
+    # cache hit ไม่ต้องสร้าง Model เลย ส่วน cache miss สร้าง (และ import SDK) ใน thread แยก ไม่ block loop กลาง
+    await clients.gemini.get_async()
+    from vertexai.generative_models import Part, GenerationConfig
+    generation_config = GenerationConfig(**STORY_PLAN_GENERATION_CONFIG)
     
     # สร้าง Prompt ที่สมบูรณ์
     full_prompt_parts = [
@@ -56,10 +107,7 @@ Now, generate the complete JSON story plan according to the principles I provide
     ]
 
     try:
-        response = GEMINI_MODEL.generate_content(
-            full_prompt_parts,
-            generation_config=generation_config,
-        )
+        response = await _generate_content(full_prompt_parts, generation_config)
         
         logging.info("--- Gemini Raw Response (JSON Mode) ---")
         logging.info(response.text)
@@ -68,16 +116,63 @@ Now, generate the complete JSON story plan according to the principles I provide
         json_response = json.loads(response.text)
         
         # ตรวจสอบโครงสร้างพื้นฐานของ JSON ที่ได้กลับมา
-        if not all(k in json_response for k in ["story_script", "image_prompts"]):
+        if not _is_story_plan(json_response):
             raise ValueError("The AI response is missing required keys: 'story_script' or 'image_prompts'.")
 
         logging.info("Gemini Service: Story plan generated successfully via Persona.")
+        await asyncio.to_thread(plan_cache.put, cache_key, json_response)
         return json_response
 
     except Exception as e:
         logging.exception("Gemini Service Error: Failed to generate or parse story plan.")
         raise e
 
+def create_story_plans_batch(
+    ideas: List[str], age_group: str, image_style: str = "3D animated movie style"
+) -> List[Optional[Dict]]:
+    """
+    สร้าง Story Plan ของหลายไอเดียในการเรียก Gemini ครั้งเดียว (persona ถูกส่งไปครั้งเดียวแทนที่จะส่งซ้ำทุกไอเดีย)
+    คืน list ตามลำดับของ ideas: plan ที่ใช้ได้จะถูกบันทึกลง plan cache ด้วย key เดียวกับ create_story_plan_with_persona
+    ส่วนไอเดียที่ Gemini ตอบมาไม่ครบ/ผิดรูปแบบจะเป็น None (ให้ผู้เรียกสร้างทีละเรื่องเอง)
+    """
+    clients.gemini.get()
+    from vertexai.generative_models import Part, GenerationConfig
+
+    logging.info(f"Gemini Service: Creating {len(ideas)} story plans in one request for age group {age_group}.")
+    system_prompt = _persona_for(age_group)
+    numbered_ideas = "\n".join(f'{i + 1}. "{idea}"' for i, idea in enumerate(ideas))
+    user_prompt = f"""
+Here are {len(ideas)} separate story ideas from the user:
+{numbered_ideas}
+The visual style for the images should be: "{image_style}"
+
+Now, generate one complete JSON story plan for EACH idea according to the principles I provided.
+Respond with a JSON object of the form {{"plans": [...]}} containing exactly {len(ideas)} story plans, in the same order as the ideas.
+"""
+    # เผื่อ output token ให้พอสำหรับทุกเรื่องในการเรียกครั้งเดียว
+    generation_config = GenerationConfig(**dict(
+        STORY_PLAN_GENERATION_CONFIG, max_output_tokens=STORY_PLAN_GENERATION_CONFIG["max_output_tokens"] * len(ideas)
+    ))
+    response = model_loop.run(_generate_content(
+        [Part.from_text(system_prompt), Part.from_text(user_prompt)], generation_config
+    ))
+    plans = json.loads(response.text).get("plans")
+    if not isinstance(plans, list):
+        raise ValueError("The AI response is missing the 'plans' list.")
+    if len(plans) != len(ideas):
+        logging.warning(f"Gemini Service: Batch returned {len(plans)} plans for {len(ideas)} ideas.")
+
+    results: List[Optional[Dict]] = []
+    for i, idea in enumerate(ideas):
+        plan = plans[i] if i < len(plans) else None
+        if _is_story_plan(plan):
+            plan_cache.put(story_plan_cache_key(system_prompt, idea, age_group, image_style), plan)
+            results.append(plan)
+        else:
+            results.append(None)
+    logging.info(f"Gemini Service: Batch produced {sum(plan is not None for plan in results)}/{len(ideas)} usable plans.")
+    return results
+
 # [เก็บไว้/ปรับปรุง] ฟังก์ชันเก่า สำหรับโหมด Manual
 # เราจะทำให้มันเรียกใช้ฟังก์ชันใหม่ เพื่อลดความซ้ำซ้อน
 def generate_full_script(user_prompt: str, image_style: str) -> Dict:
@@ -1,55 +1,156 @@
 # --- START OF FILE: app/services/google_drive_service.py ---
 import os
+import time
+import socket
+import logging
+import threading
 from pathlib import Path
-from pydrive2.auth import GoogleAuth
-from pydrive2.drive import GoogleDrive
+from typing import TYPE_CHECKING, Optional, Callable
+
+from app import config
+from app.services import metrics
+
+# PyDrive2 / googleapiclient โหลดเมื่อใช้ครั้งแรกเท่านั้น (worker ที่ไม่ได้อัปโหลดไม่ต้องจ่ายเวลา import)
+if TYPE_CHECKING:
+    from pydrive2.auth import GoogleAuth
+    from pydrive2.drive import GoogleDrive
 
 # ระบุ Path ไปยังไฟล์ credentials ที่รากของโปรเจกต์
 # เราจะตั้งค่า Working Directory ให้ถูกต้องเพื่อให้ PyDrive2 หาไฟล์เจอ
 SETTINGS_YAML_PATH = Path(__file__).parent.parent.parent / "settings.yaml"
 
-def authenticate_gdrive():
-    """จัดการการ Authentication และคืนค่า Drive object"""
-    gauth = GoogleAuth(settings_file=str(SETTINGS_YAML_PATH))
-    
-    # พยายามโหลด credentials ที่เคยบันทึกไว้ ถ้าไม่มีจะเปิดเบราว์เซอร์
-    gauth.LocalWebserverAuth()
-    
-    drive = GoogleDrive(gauth)
-    return drive
-
-def upload_video_to_drive(local_video_path: str, remote_folder_id: str) -> str:
+# Client ที่ authenticate ครั้งเดียวแล้วใช้ซ้ำทั้ง process (refresh token เองเมื่อหมดอายุ)
+_GAUTH: Optional["GoogleAuth"] = None
+_DRIVE: Optional["GoogleDrive"] = None
+_auth_lock = threading.Lock()
+
+# error ชั่วคราวที่ควรลองส่ง chunk เดิมใหม่ (การ upload แบบ resumable จะถามเซิร์ฟเวอร์ก่อนว่ารับไปถึง byte ไหนแล้ว)
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+UPLOAD_MAX_RETRIES = 5
+
+
+class DriveAuthError(Exception):
+    pass
+
+
+def _load_credentials(gauth: "GoogleAuth"):
+    """โหลด credentials โดยไม่เปิดเบราว์เซอร์ (container ไม่มีหน้าจอ จะค้างรอ redirect ไปตลอด)
+    - settings.yaml ตั้ง client_config_backend: service -> ใช้ service account
+    - นอกนั้นใช้ credentials ที่เคยบันทึกไว้ (DRIVE_CREDENTIALS_FILE หรือ save_credentials_file ใน settings.yaml)
+      ถ้า access token หมดอายุจะ refresh ด้วย refresh token ถ้าไม่มีไฟล์ให้ล้มทันที
     """
-    อัปโหลดไฟล์วิดีโอไปยัง Google Drive และคืนค่า Shareable Link
-    
+    if gauth.settings.get("client_config_backend") == "service":
+        gauth.ServiceAuth()
+        return
+    gauth.LoadCredentialsFile(config.DRIVE_CREDENTIALS_FILE or None)
+    if gauth.credentials is None:
+        raise DriveAuthError(
+            "No saved Google Drive credentials. Create them once on a machine with a browser "
+            "(GoogleAuth().LocalWebserverAuth() with save_credentials) and set DRIVE_CREDENTIALS_FILE, "
+            "or use a service account (client_config_backend: service in settings.yaml)."
+        )
+    if gauth.access_token_expired:
+        gauth.Refresh()
+    gauth.Authorize()
+
+
+def authenticate_gdrive() -> "GoogleDrive":
+    """จัดการการ Authentication ครั้งแรก แล้วคืน Drive object ตัวเดิมในครั้งถัดไป"""
+    global _GAUTH, _DRIVE
+    with _auth_lock:
+        if _GAUTH is None:
+            from pydrive2.auth import GoogleAuth
+            from pydrive2.drive import GoogleDrive
+            gauth = GoogleAuth(settings_file=str(SETTINGS_YAML_PATH))
+            _load_credentials(gauth)
+            _GAUTH = gauth
+            _DRIVE = GoogleDrive(gauth)
+            logging.info("Google Drive Service: Authenticated, client will be reused.")
+        elif _GAUTH.access_token_expired:
+            logging.info("Google Drive Service: Access token expired, refreshing...")
+            if _GAUTH.auth_method == "service":
+                _GAUTH.ServiceAuth()
+            else:
+                _GAUTH.Refresh()
+                _GAUTH.Authorize()
+        return _DRIVE
+
+
+def init_drive_client():
+    """เรียกตอน startup เพื่อ authenticate ไว้ก่อน (ไม่ทำให้แอปล้มถ้ายังไม่มี credentials)"""
+    try:
+        authenticate_gdrive()
+    except Exception as e:
+        logging.warning(f"Google Drive Service: Startup authentication skipped: {e}")
+
+
+def _is_retryable(error: Exception) -> bool:
+    import httplib2
+    from googleapiclient.errors import HttpError
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUS_CODES
+    return isinstance(error, (ConnectionError, socket.timeout, TimeoutError, httplib2.HttpLib2Error))
+
+
+def upload_video_to_drive(local_video_path: str, remote_folder_id: str, on_progress: Optional[Callable[[int, int], None]] = None) -> str:
+    """
+    อัปโหลดไฟล์วิดีโอไปยัง Google Drive แบบ resumable ทีละ chunk และคืนค่า Shareable Link
+    ถ้า chunk ไหนล้มเหลวชั่วคราว จะต่อจาก byte ที่เซิร์ฟเวอร์รับไว้แล้ว ไม่ส่งซ้ำตั้งแต่ต้น
+
     :param local_video_path: Path ของไฟล์วิดีโอในเครื่อง
     :param remote_folder_id: ID ของโฟลเดอร์ใน Google Drive ที่จะอัปโหลดไป
+    :param on_progress: callback(byte ที่ส่งแล้ว, byte ทั้งหมด)
     :return: ลิงก์สำหรับแชร์ไฟล์
     """
-    print(f"Google Drive Service: Authenticating...")
+    from googleapiclient.http import MediaFileUpload
     try:
-        drive = authenticate_gdrive()
+        authenticate_gdrive()
+        # httplib2.Http ใช้ข้าม thread ไม่ได้ แต่ละ upload จึงขอ http object ที่ authorize แล้วของตัวเอง
+        http = _GAUTH.Get_Http_Object()
+        service = _GAUTH.service
         video_filename = os.path.basename(local_video_path)
-        print(f"Google Drive Service: Uploading '{video_filename}' to folder ID '{remote_folder_id}'...")
-
-        file_drive = drive.CreateFile({
-            'title': video_filename,
-            'parents': [{'id': remote_folder_id}],
-            'mimeType': 'video/mp4'
-        })
-        
-        file_drive.SetContentFile(local_video_path)
-        file_drive.Upload()
-        
+        total_bytes = os.path.getsize(local_video_path)
+        print(f"Google Drive Service: Uploading '{video_filename}' ({total_bytes} bytes) to folder ID '{remote_folder_id}'...")
+
+        media = MediaFileUpload(
+            local_video_path, mimetype='video/mp4', chunksize=config.DRIVE_UPLOAD_CHUNK_BYTES, resumable=True
+        )
+        request = service.files().insert(
+            body={'title': video_filename, 'parents': [{'id': remote_folder_id}], 'mimeType': 'video/mp4'},
+            media_body=media
+        )
+        if on_progress: on_progress(0, total_bytes)
+
+        response = None
+        retries = 0
+        while response is None:
+            try:
+                status, response = request.next_chunk(http=http)
+                retries = 0
+                if status and on_progress: on_progress(status.resumable_progress, total_bytes)
+            except Exception as e:
+                if not _is_retryable(e) or retries >= UPLOAD_MAX_RETRIES:
+                    raise
+                retries += 1
+                metrics.inc("story_backend_retries_total", backend="drive")
+                delay = 2 ** retries
+                print(f"Google Drive Service: Chunk failed ({e}), resuming in {delay}s (retry {retries}/{UPLOAD_MAX_RETRIES})...")
+                time.sleep(delay)
+        if on_progress: on_progress(total_bytes, total_bytes)
+
         # ทำให้ไฟล์แชร์ได้แบบ "anyone with the link can view"
-        file_drive.InsertPermission({'type': 'anyone', 'role': 'reader', 'withLink': True})
-        
-        shareable_link = file_drive['alternateLink']
+        service.permissions().insert(
+            fileId=response['id'], body={'type': 'anyone', 'role': 'reader', 'withLink': True}
+        ).execute(http=http)
+
+        shareable_link = response['alternateLink']
         print(f"Google Drive Service: Upload complete! Shareable link: {shareable_link}")
-        
+
         return shareable_link
 
     except Exception as e:
         print(f"Google Drive Service: An error occurred during upload: {e}")
         # อาจจะคืนค่าเป็น None หรือ re-raise exception ขึ้นไป
-        raise e
\ No newline at end of file
+        raise e
+
+# --- END OF FILE ---
@@ -1,34 +1,109 @@
 # --- START OF FILE: app/services/image_generation_service.py (เวอร์ชัน Dependency Injection) ---
 import os
 import time
-from vertexai.preview.vision_models import ImageGenerationModel
+import random
+import asyncio
+import weakref
 from pathlib import Path
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional, Callable
 from app import config
+from app.services import metrics, model_loop, rate_limiter, clients
 
-# [แก้ไข] สร้างตัวแปร Global ไว้รอรับ Model แต่ยังไม่สร้าง
-IMAGE_MODEL: Optional[ImageGenerationModel] = None
+# Vertex AI SDK โหลดเมื่อใช้ครั้งแรกเท่านั้น (clients.imagen สร้าง Model ให้เองถ้าไม่มีใครฉีดเข้ามา)
+if TYPE_CHECKING:
+    from vertexai.preview.vision_models import ImageGenerationModel
 
 # [แก้ไข] สร้างฟังก์ชันสำหรับ "รับ" Model จากภายนอก
-def set_image_model(model: ImageGenerationModel):
-    """ฟังก์ชันนี้จะถูกเรียกโดย main.py ตอน Startup เพื่อตั้งค่า Model"""
-    global IMAGE_MODEL
-    IMAGE_MODEL = model
+def set_image_model(model: "ImageGenerationModel"):
+    """ฉีด Model จากภายนอก (เช่น backend ปลอมของ app/bench) แทนตัวที่ clients สร้างเอง"""
+    clients.imagen.set(model)
     print("✅ Vertex AI Image Generation Model has been successfully injected.")
 
 
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 15
+
+
+def _retry_delay(attempt: int) -> float:
+    """Exponential backoff แบบมี jitter เพื่อไม่ให้หลาย job ยิงซ้ำพร้อมกัน"""
+    return RETRY_BASE_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def _retry_after(attempt: int, error: Exception) -> Optional[float]:
+    """
+    วินาทีที่ต้องรอก่อนลองครั้งถัดไป หรือ None ถ้าไม่ลองแล้ว
+    quota error ลองใหม่ได้ทันที (สูงสุด QUOTA_MAX_RETRIES ครั้ง): rate limiter ของ imagen ที่ทุก job ใช้ร่วมกัน
+    ลด rate และพักการจ่าย token ไปแล้ว การลองใหม่จึงต่อคิวตาม priority แทนที่แต่ละ job จะ sleep เองพร้อมกัน
+    """
+    if rate_limiter.is_quota_error(error) and config.MODEL_RATE_PER_MINUTE.get(model_loop.IMAGEN, 0) > 0:
+        return 0.0 if attempt < config.QUOTA_MAX_RETRIES else None
+    return _retry_delay(attempt) if attempt < MAX_RETRIES - 1 else None
+
+
+# โควต้าการเรียก Imagen พร้อมกันที่หลาย job ใช้ร่วมกัน (เช่นทุก job ใน batch เดียวกัน)
+# เป็น asyncio.Semaphore บน loop กลางของ model_loop (ใช้บน loop เท่านั้น จึงไม่ต้องใช้ lock)
+# ผู้ที่รอ budget เป็นแค่ coroutine ไม่ถือ thread ของ Imagen และไม่ถือ slot / token ของ rate limiter
+# เก็บแบบ weak reference: เมื่อไม่มี job ไหนใช้ budget นั้นแล้วจะถูกเก็บกวาดเอง
+_budgets: "weakref.WeakValueDictionary[str, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+
+def generation_budget(name: str, limit: Optional[int] = None) -> asyncio.Semaphore:
+    """Semaphore ของ budget ชื่อ name (สร้างครั้งแรกด้วยขนาด limit, ค่าเริ่มต้น BATCH_IMAGE_CONCURRENCY) เรียกบน loop กลางเท่านั้น"""
+    budget = _budgets.get(name)
+    if budget is None:
+        budget = asyncio.Semaphore(limit or config.BATCH_IMAGE_CONCURRENCY)
+        _budgets[name] = budget
+    return budget
+
+
+def _generate_and_save(prompt: str, aspect_ratio: str, file_path: Path) -> str:
+    """เรียก Imagen 1 ครั้ง แล้วเขียนไฟล์ (blocking)"""
+    with metrics.timed("story_image_request_duration_seconds"):
+        images = clients.imagen.get().generate_images(
+            prompt=prompt,
+            number_of_images=1,
+            aspect_ratio=aspect_ratio
+        )
+
+    image_bytes = images[0]._image_bytes
+    if not image_bytes:
+        raise ValueError("API returned an empty image.")
+
+    with open(file_path, "wb") as f:
+        f.write(image_bytes)
+    metrics.inc("story_bytes_written_total", len(image_bytes), kind="image")
+    return str(file_path)
+
+
+async def _generate_image(prompt: str, aspect_ratio: str, file_path: Path, budget: Optional[str] = None) -> str:
+    """สร้างภาพ 1 ภาพบน loop กลาง ถ้ามี budget จะรอที่ของ budget ก่อน แล้วจึงรอ token / slot ของ Imagen"""
+    if not budget:
+        return await model_loop.run_blocking(model_loop.IMAGEN, _generate_and_save, prompt, aspect_ratio, file_path)
+    async with generation_budget(budget):
+        return await model_loop.run_blocking(model_loop.IMAGEN, _generate_and_save, prompt, aspect_ratio, file_path)
+
+
 def generate_images_from_prompts(
     prompts: List[str],
     story_id: str,
-    aspect_ratio: str = "1:1"
+    aspect_ratio: str = "1:1",
+    concurrency: Optional[int] = None,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    budget: Optional[str] = None
 ) -> List[str]:
     """
     สร้างภาพจาก Prompts โดยใช้ Vertex AI พร้อมกลยุทธ์ Retry with Exponential Backoff
+    (ยกเว้น quota error ที่ให้ rate limiter กลางเป็นตัวกำหนดจังหวะ ดู _retry_after)
+    ถ้า concurrency > 1 จะยิงหลาย prompt พร้อมกัน (ดู generate_images_from_prompts_async)
+    budget คือชื่อโควต้าที่ใช้ร่วมกับ job อื่น (ดู generation_budget) นอกเหนือจาก concurrency ของ job นี้เอง
     """
-    # [แก้ไข] ตรวจสอบ Model ที่ถูก set ไว้
-    if not IMAGE_MODEL:
-        raise Exception("Image Generation Model has not been set. Call set_image_model() during application startup.")
-        
+    # สร้าง Model ตอนนี้ถ้ายังไม่มี (error ของการสร้างจะโยนออกไปก่อนเริ่มงาน ไม่ถูกนับเป็นการ retry)
+    clients.imagen.get()
+
+    concurrency = concurrency or config.IMAGE_GENERATION_CONCURRENCY
+    if concurrency > 1:
+        return model_loop.run(generate_images_from_prompts_async(prompts, story_id, aspect_ratio, concurrency, on_progress, budget))
+
     print(f"Image Generation Service: Generating {len(prompts)} images with aspect ratio {aspect_ratio}...")
     
     image_paths = []
@@ -37,38 +112,82 @@ def generate_images_from_prompts(
 
     for i, prompt in enumerate(prompts):
         print(f"  - Generating image {i+1}/{len(prompts)} for prompt: '{prompt[:70]}...'")
-        
-        max_retries = 3
-        base_delay = 15
 
-        for attempt in range(max_retries):
+        attempt = 0
+        while True:
             try:
-                images = IMAGE_MODEL.generate_images(
-                    prompt=prompt,
-                    number_of_images=1,
-                    aspect_ratio=aspect_ratio
-                )
-
-                image_bytes = images[0]._image_bytes
-                if not image_bytes:
-                    raise ValueError("API returned an empty image.")
-
-                file_path = job_output_dir / f"image_{i}.png"
-                with open(file_path, "wb") as f:
-                    f.write(image_bytes)
-                image_paths.append(str(file_path))
+                file_path = model_loop.run(_generate_image(prompt, aspect_ratio, job_output_dir / f"image_{i}.png", budget))
+                image_paths.append(file_path)
                 print(f"  - ✅ Image saved to -> {file_path}")
+                if on_progress: on_progress(len(image_paths), len(prompts))
                 break 
 
             except Exception as e:
-                print(f"  - ⚠️ Attempt {attempt + 1}/{max_retries} failed: {e}")
-                if attempt < max_retries - 1:
-                    delay = base_delay * (2 ** attempt)
-                    print(f"  - Retrying in {delay} seconds...")
-                    time.sleep(delay)
-                else:
+                print(f"  - ⚠️ Attempt {attempt + 1} failed: {e}")
+                delay = _retry_after(attempt, e)
+                if delay is None:
                     print(f"  - ❌ All retries failed for prompt.")
-                    raise Exception(f"Failed to generate image after {max_retries} attempts.") from e
+                    raise Exception(f"Failed to generate image after {attempt + 1} attempts.") from e
+                attempt += 1
+                metrics.inc("story_backend_retries_total", backend="imagen")
+                print(f"  - Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
             
     print("Image Generation Service: All images generated successfully.")
-    return image_paths
\ No newline at end of file
+    return image_paths
+
+
+async def generate_images_from_prompts_async(
+    prompts: List[str],
+    story_id: str,
+    aspect_ratio: str = "1:1",
+    concurrency: int = 4,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    budget: Optional[str] = None
+) -> List[str]:
+    """
+    สร้างภาพทุก prompt พร้อมกัน (จำกัดไม่เกิน concurrency งานต่อ job ด้วย asyncio.Semaphore) รันบน loop กลางของ model_loop
+    Imagen SDK ไม่มี API แบบ async จึงเรียกผ่าน model_loop.run_blocking (จำกัดรวมทั้ง process ตาม IMAGEN_MAX_IN_FLIGHT)
+    on_progress(จำนวนที่เสร็จ, ทั้งหมด) ถูกเรียกทุกครั้งที่ได้ภาพเพิ่ม ใน thread แยกตามลำดับ (เช่น report_progress ที่เขียน SQLite)
+    - ช่วงที่รอ retry จะคืน slot ให้ prompt อื่นใช้ และไม่ block thread ใดๆ
+    - ผลลัพธ์เรียงตามลำดับฉากเดิมเสมอ
+    """
+    await clients.imagen.get_async()
+
+    print(f"Image Generation Service: Generating {len(prompts)} images concurrently (max {concurrency}) with aspect ratio {aspect_ratio}...")
+
+    job_output_dir = config.UPLOADS_DIR / story_id
+    job_output_dir.mkdir(parents=True, exist_ok=True)
+    semaphore = asyncio.Semaphore(concurrency)
+    progress_lock = asyncio.Lock()
+    completed = 0
+
+    async def generate_one(i: int, prompt: str) -> str:
+        nonlocal completed
+        attempt = 0
+        while True:
+            try:
+                async with semaphore:
+                    file_path = await _generate_image(prompt, aspect_ratio, job_output_dir / f"image_{i}.png", budget)
+                print(f"  - ✅ Image {i+1}/{len(prompts)} saved to -> {file_path}")
+                completed += 1
+                if on_progress:
+                    # lock ของ asyncio ปล่อยตามลำดับที่มารอ ความคืบหน้าจึงไม่ถูกเขียนย้อนหลัง
+                    done = completed
+                    async with progress_lock:
+                        await asyncio.to_thread(on_progress, done, len(prompts))
+                return file_path
+            except Exception as e:
+                print(f"  - ⚠️ Image {i+1}: attempt {attempt + 1} failed: {e}")
+                delay = _retry_after(attempt, e)
+                if delay is None:
+                    print(f"  - ❌ All retries failed for image {i+1}.")
+                    raise Exception(f"Failed to generate image after {attempt + 1} attempts.") from e
+                attempt += 1
+                metrics.inc("story_backend_retries_total", backend="imagen")
+                print(f"  - Image {i+1}: retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+
+    image_paths = await asyncio.gather(*(generate_one(i, prompt) for i, prompt in enumerate(prompts)))
+    print("Image Generation Service: All images generated successfully.")
+    return list(image_paths)
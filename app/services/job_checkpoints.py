@@ -0,0 +1,71 @@
+# --- START OF FILE: app/services/job_checkpoints.py ---
+import json
+import os
+import threading
+import time
+from typing import Optional, Dict
+
+from . import job_repository
+
+# Checkpoint ของแต่ละขั้นตอนใน pipeline (อยู่ในฐานข้อมูล SQLite เดียวกับ job_repository)
+# - แต่ละขั้นตอนบันทึกสิ่งที่สร้างเสร็จแล้ว (story plan, path ของภาพ, เสียงพากย์, path ของวิดีโอ ...)
+# - เมื่อสั่ง retry ผ่าน POST /jobs/{job_id}/retry workflow จะข้ามขั้นตอนที่มี checkpoint อยู่แล้ว
+#   และเริ่มทำต่อจากขั้นตอนแรกที่ยังไม่เสร็จ
+
+STAGE_PLAN = "plan"
+STAGE_IMAGES = "images"
+STAGE_VOICE = "voice"
+STAGE_VIDEO = "video"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_checkpoints (
+    job_id      TEXT NOT NULL,
+    stage       TEXT NOT NULL,
+    artifact    TEXT NOT NULL,
+    created_at  REAL NOT NULL,
+    PRIMARY KEY (job_id, stage)
+);
+"""
+
+_schema_lock = threading.Lock()
+_schema_ready_pid: Optional[int] = None
+
+
+def _connection():
+    global _schema_ready_pid
+    conn = job_repository.get_connection()
+    if _schema_ready_pid != os.getpid():
+        with _schema_lock:
+            if _schema_ready_pid != os.getpid():
+                conn.executescript(_SCHEMA)
+                _schema_ready_pid = os.getpid()
+    return conn
+
+
+def save(job_id: str, stage: str, artifact):
+    """บันทึกผลลัพธ์ของขั้นตอน (ค่าใดๆ ที่ serialize เป็น JSON ได้) ทับของเดิมถ้ามี"""
+    _connection().execute(
+        """
+        INSERT INTO job_checkpoints (job_id, stage, artifact, created_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(job_id, stage) DO UPDATE SET artifact = excluded.artifact, created_at = excluded.created_at
+        """,
+        (job_id, stage, json.dumps(artifact, ensure_ascii=False), time.time()),
+    )
+
+
+def load(job_id: str) -> Dict:
+    """คืน dict ของ stage -> artifact ที่บันทึกไว้ของ Job นี้"""
+    rows = _connection().execute(
+        "SELECT stage, artifact FROM job_checkpoints WHERE job_id = ?", (job_id,)
+    ).fetchall()
+    return {row["stage"]: json.loads(row["artifact"]) for row in rows}
+
+
+def discard(job_id: str, stage: str):
+    _connection().execute("DELETE FROM job_checkpoints WHERE job_id = ? AND stage = ?", (job_id, stage))
+
+
+def clear(job_id: str):
+    _connection().execute("DELETE FROM job_checkpoints WHERE job_id = ?", (job_id,))
+
+# --- END OF FILE ---
@@ -0,0 +1,54 @@
+# --- START OF FILE: app/services/job_events.py ---
+import asyncio
+import threading
+from typing import Dict, Set, Tuple
+
+# Pub/Sub ภายใน process สำหรับส่งสถานะ Job แบบ push (ใช้กับ GET /jobs/{job_id}/events)
+# - ฝั่ง endpoint (async) subscribe ได้ asyncio.Queue ของ event loop ตัวเอง
+# - ฝั่ง workflow (thread ใน worker pool) เรียก publish() ได้เลย ส่งข้าม thread ด้วย call_soon_threadsafe
+# งานที่รันใน worker คนละ process จะไม่ถูก publish มาที่นี่ endpoint จึงตรวจ job_repository เป็นระยะด้วย
+
+_lock = threading.Lock()
+_subscribers: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+
+
+def subscribe(job_id: str) -> asyncio.Queue:
+    """ต้องเรียกจากใน event loop"""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=100)
+    with _lock:
+        _subscribers.setdefault(job_id, set()).add((asyncio.get_running_loop(), queue))
+    return queue
+
+
+def unsubscribe(job_id: str, queue: asyncio.Queue):
+    with _lock:
+        subscribers = _subscribers.get(job_id, set())
+        subscribers.difference_update({entry for entry in subscribers if entry[1] is queue})
+        if not subscribers:
+            _subscribers.pop(job_id, None)
+
+
+def _deliver(queue: asyncio.Queue, event: Dict):
+    # ถ้า client อ่านไม่ทัน ทิ้ง event เก่าสุด (event ถัดไปมีสถานะล่าสุดครบอยู่แล้ว)
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+def has_subscribers(job_id: str) -> bool:
+    with _lock:
+        return bool(_subscribers.get(job_id))
+
+
+def publish(job_id: str, event: Dict):
+    """ส่ง event ให้ทุก subscriber ของ job นี้ (เรียกจาก thread ไหนก็ได้)"""
+    with _lock:
+        subscribers = list(_subscribers.get(job_id, ()))
+    for loop, queue in subscribers:
+        try:
+            loop.call_soon_threadsafe(_deliver, queue, event)
+        except RuntimeError:
+            # event loop ปิดไปแล้ว
+            unsubscribe(job_id, queue)
+
+# --- END OF FILE ---
@@ -0,0 +1,319 @@
+# --- START OF FILE: app/services/job_queue.py ---
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional, Dict, List
+
+from app import config
+from . import job_repository
+
+# คิวงานแบบถาวร (อยู่ในฐานข้อมูล SQLite เดียวกับ job_repository)
+# - API แค่ enqueue งาน แล้ว worker (ใน process ไหนก็ได้ บนเครื่องเดียวกัน) มา lease งานไปทำ
+# - worker ต้องส่ง heartbeat ต่ออายุ lease เรื่อยๆ ถ้า worker ตาย lease จะหมดอายุ
+#   แล้ว reclaim_expired_leases() จะคืนงานเข้าคิว (หรือ mark failed ถ้าลองครบจำนวนครั้งแล้ว)
+# - แต่ละงานอยู่ใน lane (งานเดี่ยวมี lane ของตัวเอง งานใน batch เดียวกันใช้ lane เดียวกัน)
+#   lease_next เลือก lane ที่มีงานกำลังทำอยู่น้อยที่สุดก่อน batch ใหญ่จึงไม่แย่ง worker ทั้งหมดจากงานเดี่ยว
+
+STATE_QUEUED = "queued"
+# จองที่ในคิวไว้แล้ว (นับรวมใน MAX_QUEUED_JOBS) แต่ worker ยังไม่ lease จนกว่าจะ release() เช่นงานย่อยของ batch ที่รอ story plan
+STATE_RESERVED = "reserved"
+STATE_LEASED = "leased"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_queue (
+    job_id            TEXT PRIMARY KEY,
+    kind              TEXT NOT NULL,
+    payload           TEXT NOT NULL,
+    state             TEXT NOT NULL,
+    priority          INTEGER NOT NULL DEFAULT 0,
+    attempts          INTEGER NOT NULL DEFAULT 0,
+    lease_owner       TEXT,
+    lease_expires_at  REAL,
+    error             TEXT NOT NULL DEFAULT '',
+    lane              TEXT NOT NULL DEFAULT '',
+    created_at        REAL NOT NULL,
+    updated_at        REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_job_queue_ready ON job_queue(state, priority DESC, created_at);
+CREATE INDEX IF NOT EXISTS idx_job_queue_lease ON job_queue(state, lease_expires_at);
+"""
+
+# index ที่ใช้คอลัมน์ที่เพิ่มทีหลัง ต้องสร้างหลังจาก ALTER TABLE แล้ว
+_POST_MIGRATION_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_job_queue_lane ON job_queue(lane, state);
+"""
+
+# คอลัมน์ที่เพิ่มทีหลัง: เติมให้ฐานข้อมูลเก่าที่สร้างไว้ก่อนหน้าอัตโนมัติ
+_ADDED_COLUMNS = {
+    "lane": "TEXT NOT NULL DEFAULT ''",
+}
+
+
+class QueueFullError(Exception):
+    pass
+
+
+_schema_lock = threading.Lock()
+_schema_ready_pid: Optional[int] = None
+
+
+def _connection():
+    global _schema_ready_pid
+    conn = job_repository.get_connection()
+    if _schema_ready_pid != os.getpid():
+        with _schema_lock:
+            if _schema_ready_pid != os.getpid():
+                conn.executescript(_SCHEMA)
+                existing = {row["name"] for row in conn.execute("PRAGMA table_info(job_queue)")}
+                for column, ddl in _ADDED_COLUMNS.items():
+                    if column not in existing:
+                        conn.execute(f"ALTER TABLE job_queue ADD COLUMN {column} {ddl}")
+                if "lane" not in existing:
+                    # งานที่ค้างอยู่ในคิวก่อนมีคอลัมน์ lane ถือเป็นงานเดี่ยว
+                    conn.execute("UPDATE job_queue SET lane = job_id WHERE lane = ''")
+                conn.executescript(_POST_MIGRATION_SCHEMA)
+                _schema_ready_pid = os.getpid()
+    return conn
+
+
+def _queue_depth(conn) -> int:
+    row = conn.execute("SELECT COUNT(*) FROM job_queue WHERE state IN (?, ?)", (STATE_QUEUED, STATE_RESERVED)).fetchone()
+    return row[0]
+
+
+def queue_depth() -> int:
+    """จำนวนงานที่รอ worker อยู่ในคิว (รวมงานที่จองที่ไว้แล้ว)"""
+    return _queue_depth(_connection())
+
+
+def _check_capacity(conn, count: int):
+    depth = _queue_depth(conn)
+    if depth + count > config.MAX_QUEUED_JOBS:
+        raise QueueFullError(f"Job queue is full ({depth} jobs waiting). Please retry later.")
+
+
+def check_capacity(count: int = 1):
+    """โยน QueueFullError ถ้าเพิ่มงานอีก count งานแล้วจะเกิน MAX_QUEUED_JOBS"""
+    _check_capacity(_connection(), count)
+
+
+def get_state(job_id: str) -> Optional[str]:
+    """สถานะของงานในคิว (reserved/queued/leased/done/failed) หรือ None ถ้าไม่มีงานนี้ในคิว"""
+    row = _connection().execute("SELECT state FROM job_queue WHERE job_id = ?", (job_id,)).fetchone()
+    return row["state"] if row else None
+
+
+def _insert(conn, job_id: str, kind: str, payload: Dict, state: str, priority: int, lane: Optional[str]):
+    now = time.time()
+    conn.execute(
+        """
+        INSERT INTO job_queue (job_id, kind, payload, state, priority, lane, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (job_id, kind, json.dumps(payload), state, priority, lane or job_id, now, now),
+    )
+
+
+def enqueue(job_id: str, kind: str, payload: Dict, priority: int = 0, lane: Optional[str] = None, check_limit: bool = True):
+    """
+    เพิ่มงานเข้าคิว ถ้าคิวเต็ม (MAX_QUEUED_JOBS) จะโยน QueueFullError
+    lane ไม่ส่ง = lane ของตัวเอง, check_limit=False ใช้กับงานที่ต้องเข้าคิวแม้คิวจะเต็ม
+    """
+    conn = _connection()
+    if check_limit:
+        _check_capacity(conn, 1)
+    _insert(conn, job_id, kind, payload, STATE_QUEUED, priority, lane)
+
+
+def enqueue_many(jobs: List[Dict], lane: Optional[str] = None):
+    """
+    เพิ่มหลายงานใน transaction เดียว ถ้าที่ในคิวไม่พอสำหรับทั้งชุดจะโยน QueueFullError โดยไม่เพิ่มงานใดเลย
+    แต่ละงานคือ dict(job_id, kind, payload, reserved=False) reserved=True = จองที่ไว้ (worker ยังไม่ lease จนกว่าจะ release)
+    """
+    conn = _connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _check_capacity(conn, len(jobs))
+        for job in jobs:
+            state = STATE_RESERVED if job.get("reserved") else STATE_QUEUED
+            _insert(conn, job["job_id"], job["kind"], job["payload"], state, job.get("priority", 0), lane)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def release(job_id: str) -> bool:
+    """ปล่อยงานที่จองที่ไว้ให้ worker lease ได้ คืน False ถ้างานนี้ไม่ได้อยู่ในสถานะ reserved"""
+    cursor = _connection().execute(
+        "UPDATE job_queue SET state = ?, updated_at = ? WHERE job_id = ? AND state = ?",
+        (STATE_QUEUED, time.time(), job_id, STATE_RESERVED),
+    )
+    return cursor.rowcount == 1
+
+
+def cancel_reserved(job_id: str, error: str) -> bool:
+    """mark งานที่จองที่ไว้เป็น failed (คืนที่ในคิว และ retry ผ่าน requeue ได้ตามปกติ)"""
+    cursor = _connection().execute(
+        "UPDATE job_queue SET state = ?, error = ?, updated_at = ? WHERE job_id = ? AND state = ?",
+        (STATE_FAILED, error, time.time(), job_id, STATE_RESERVED),
+    )
+    return cursor.rowcount == 1
+
+
+def lease_next(worker_id: str, lease_seconds: float = None) -> Optional[Dict]:
+    """
+    จองงานถัดไป คืน dict ของงาน หรือ None ถ้าคิวว่าง
+    ลำดับ: priority สูงก่อน -> lane ที่มีงานกำลังทำอยู่น้อยที่สุดก่อน -> เก่าสุดก่อน
+    """
+    lease_seconds = lease_seconds or config.JOB_LEASE_SECONDS
+    conn = _connection()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            """
+            SELECT q.*, (
+                SELECT COUNT(*) FROM job_queue AS active WHERE active.lane = q.lane AND active.state = ?
+            ) AS lane_active
+            FROM job_queue AS q WHERE q.state = ?
+            ORDER BY q.priority DESC, lane_active, q.created_at LIMIT 1
+            """,
+            (STATE_LEASED, STATE_QUEUED),
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            """
+            UPDATE job_queue SET state = ?, lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1, updated_at = ?
+            WHERE job_id = ?
+            """,
+            (STATE_LEASED, worker_id, now + lease_seconds, now, row["job_id"]),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    job = dict(row)
+    del job["lane_active"]
+    job["payload"] = json.loads(job["payload"])
+    job["attempts"] += 1
+    return job
+
+
+def heartbeat(job_id: str, worker_id: str, lease_seconds: float = None) -> bool:
+    """ต่ออายุ lease คืน False ถ้า lease ไม่ใช่ของ worker นี้แล้ว (เช่น ถูก reclaim ไปก่อน)"""
+    lease_seconds = lease_seconds or config.JOB_LEASE_SECONDS
+    now = time.time()
+    cursor = _connection().execute(
+        "UPDATE job_queue SET lease_expires_at = ?, updated_at = ? WHERE job_id = ? AND lease_owner = ? AND state = ?",
+        (now + lease_seconds, now, job_id, worker_id, STATE_LEASED),
+    )
+    return cursor.rowcount == 1
+
+
+def _finish(job_id: str, worker_id: str, state: str, error: str = ""):
+    _connection().execute(
+        "UPDATE job_queue SET state = ?, error = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ? "
+        "WHERE job_id = ? AND lease_owner = ?",
+        (state, error, time.time(), job_id, worker_id),
+    )
+
+
+def complete(job_id: str, worker_id: str):
+    _finish(job_id, worker_id, STATE_DONE)
+
+
+def fail(job_id: str, worker_id: str, error: str):
+    _finish(job_id, worker_id, STATE_FAILED, error)
+
+
+def requeue(job_id: str) -> bool:
+    """
+    นำงานที่จบไปแล้ว (done/failed) กลับเข้าคิวด้วย payload เดิม ใช้กับ POST /jobs/{job_id}/retry
+    คืน False ถ้าไม่มีงานนี้ หรือยังอยู่ในคิว/กำลังทำอยู่
+    """
+    check_capacity()
+    cursor = _connection().execute(
+        """
+        UPDATE job_queue SET state = ?, attempts = 0, error = '', lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+        WHERE job_id = ? AND state IN (?, ?)
+        """,
+        (STATE_QUEUED, time.time(), job_id, STATE_DONE, STATE_FAILED),
+    )
+    return cursor.rowcount == 1
+
+
+def purge_failed(older_than_seconds: float) -> List[str]:
+    """
+    ลบงานที่ล้มเหลวและจบไปนานกว่า older_than_seconds ออกจากคิว (retry ไม่ได้อีก) คืน job_id ที่ถูกลบ
+    workflow จับ exception เองแล้ว mark job เป็น failed ใน job_repository แต่ worker ยัง complete งานในคิว (state done)
+    จึงดูทั้งสถานะของ job และ state ของคิว
+    """
+    conn = _connection()
+    cutoff = time.time() - older_than_seconds
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            """
+            SELECT q.job_id FROM job_queue AS q JOIN jobs AS j ON j.job_id = q.job_id
+            WHERE q.state IN (?, ?) AND j.status = 'failed' AND q.updated_at < ? AND j.updated_at < ?
+            """,
+            (STATE_DONE, STATE_FAILED, cutoff, cutoff),
+        ).fetchall()
+        job_ids = [row["job_id"] for row in rows]
+        conn.executemany(
+            "DELETE FROM job_queue WHERE job_id = ? AND state IN (?, ?)", [(job_id, STATE_DONE, STATE_FAILED) for job_id in job_ids]
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return job_ids
+
+
+def reclaim_expired_leases() -> int:
+    """
+    คืนงานที่ lease หมดอายุ (worker ตายหรือหยุดส่ง heartbeat) กลับเข้าคิว
+    งานที่ลองครบ JOB_MAX_ATTEMPTS แล้วจะถูก mark failed ทั้งในคิวและใน job_repository
+    """
+    conn = _connection()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            "SELECT job_id, attempts FROM job_queue WHERE state = ? AND lease_expires_at < ?", (STATE_LEASED, now)
+        ).fetchall()
+        requeued, exhausted = [], []
+        for row in rows:
+            if row["attempts"] >= config.JOB_MAX_ATTEMPTS:
+                exhausted.append(row["job_id"])
+                conn.execute(
+                    "UPDATE job_queue SET state = ?, error = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ? WHERE job_id = ?",
+                    (STATE_FAILED, "Worker lease expired too many times.", now, row["job_id"]),
+                )
+            else:
+                requeued.append(row["job_id"])
+                conn.execute(
+                    "UPDATE job_queue SET state = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ? WHERE job_id = ?",
+                    (STATE_QUEUED, now, row["job_id"]),
+                )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    for job_id in requeued:
+        job_repository.upsert_job(job_id, "pending", stage="Requeued after worker interruption...")
+    for job_id in exhausted:
+        job_repository.upsert_job(job_id, "failed", error="Job was interrupted too many times and has been abandoned.")
+    if rows:
+        logging.warning(f"Job Queue: Reclaimed {len(requeued)} expired leases, abandoned {len(exhausted)} jobs.")
+    return len(rows)
+
+# --- END OF FILE ---
@@ -0,0 +1,206 @@
+# --- START OF FILE: app/services/job_repository.py ---
+import sqlite3
+import threading
+import time
+import os
+import json
+from typing import Optional, Dict, List
+
+from app import config
+
+# Repository สำหรับเก็บสถานะของ Job ทั้งหมด (แทนที่ shelve + FileLock เดิม)
+# - ใช้ SQLite โหมด WAL: ผู้อ่านไม่ต้องรอผู้เขียน (อ่านได้โดยไม่ต้องล็อก)
+# - แต่ละ Thread ในแต่ละ Process มี Connection ของตัวเอง (connection pool ต่อ process)
+# - เขียนแบบ upsert ทีละแถว ไม่ต้องเขียนไฟล์ทั้งก้อนใหม่ทุกครั้งเหมือน shelve(writeback=True)
+
+DB_PATH = str(config.JOB_DB_PATH)
+BUSY_TIMEOUT_MS = 10_000
+
+# ฟิลด์ที่คืนให้ client ผ่าน /jobs/{job_id}/status (ไม่ส่งค่าว่างออกไป เหมือนพฤติกรรมเดิม)
+PUBLIC_FIELDS = ("status", "stage", "error", "video_url", "story_text")
+# ฟิลด์ที่เก็บเป็น JSON (timings คือเวลาเป็นวินาทีของแต่ละ stage ของ Job)
+JSON_FIELDS = ("progress", "timings")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id      TEXT PRIMARY KEY,
+    status      TEXT NOT NULL,
+    stage       TEXT NOT NULL DEFAULT '',
+    error       TEXT NOT NULL DEFAULT '',
+    video_url   TEXT NOT NULL DEFAULT '',
+    story_text  TEXT NOT NULL DEFAULT '',
+    progress    TEXT NOT NULL DEFAULT '{}',
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at);
+"""
+
+# คอลัมน์ที่เพิ่มทีหลัง: เติมให้ฐานข้อมูลเก่าที่สร้างไว้ก่อนหน้าอัตโนมัติ
+_ADDED_COLUMNS = {
+    "progress": "TEXT NOT NULL DEFAULT '{}'",
+    "batch_id": "TEXT NOT NULL DEFAULT ''",
+    "timings": "TEXT NOT NULL DEFAULT '{}'",
+}
+
+# index ที่ใช้คอลัมน์ที่เพิ่มทีหลัง ต้องสร้างหลังจาก ALTER TABLE แล้ว
+_POST_MIGRATION_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_jobs_batch_id ON jobs(batch_id);
+"""
+
+# ถ้ายังมี job ใดใน batch ที่อยู่ในสถานะเหล่านี้ ถือว่า batch ยังไม่จบ
+ACTIVE_STATUSES = ("pending", "processing")
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready_pid: Optional[int] = None
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def _ensure_schema(conn: sqlite3.Connection):
+    global _schema_ready_pid
+    if _schema_ready_pid == os.getpid():
+        return
+    with _schema_lock:
+        if _schema_ready_pid != os.getpid():
+            conn.executescript(_SCHEMA)
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, ddl in _ADDED_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {ddl}")
+            conn.executescript(_POST_MIGRATION_SCHEMA)
+            _schema_ready_pid = os.getpid()
+
+
+def get_connection() -> sqlite3.Connection:
+    """คืน Connection ของ Thread ปัจจุบัน (สร้างใหม่ถ้ายังไม่มี หรือถ้าเพิ่ง fork มาเป็น process ใหม่)"""
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    _ensure_schema(conn)
+    return conn
+
+
+def upsert_job(
+    job_id: str, status: str, stage: str = "", error: str = "", video_url: str = "", story_text: str = "", batch_id: str = ""
+):
+    """
+    สร้างหรืออัปเดตแถวของ Job หนึ่งแถว
+    ฟิลด์ที่ส่งมาเป็นค่าว่างจะไม่ไปทับค่าเดิม (เหมือน update_job_status แบบเดิม)
+    batch_id ถูกบันทึกตอนสร้างแถวเท่านั้น
+    """
+    now = time.time()
+    get_connection().execute(
+        """
+        INSERT INTO jobs (job_id, status, stage, error, video_url, story_text, batch_id, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(job_id) DO UPDATE SET
+            status     = excluded.status,
+            stage      = CASE WHEN excluded.stage      != '' THEN excluded.stage      ELSE jobs.stage      END,
+            error      = CASE WHEN excluded.error      != '' THEN excluded.error      ELSE jobs.error      END,
+            video_url  = CASE WHEN excluded.video_url  != '' THEN excluded.video_url  ELSE jobs.video_url  END,
+            story_text = CASE WHEN excluded.story_text != '' THEN excluded.story_text ELSE jobs.story_text END,
+            updated_at = excluded.updated_at
+        """,
+        (job_id, status, stage, error, video_url, story_text, batch_id, now, now),
+    )
+
+
+def update_progress(job_id: str, **progress):
+    """รวมค่าความคืบหน้า (เช่น images_done, render_percent, upload_bytes) เข้ากับของเดิมของ Job"""
+    get_connection().execute(
+        "UPDATE jobs SET progress = json_patch(progress, ?), updated_at = ? WHERE job_id = ?",
+        (json.dumps(progress), time.time(), job_id),
+    )
+
+
+def update_timings(job_id: str, **timings):
+    """รวมเวลาของแต่ละ stage (วินาที เช่น plan=3.2, video=41.0) เข้ากับของเดิมของ Job"""
+    get_connection().execute(
+        "UPDATE jobs SET timings = json_patch(timings, ?), updated_at = ? WHERE job_id = ?",
+        (json.dumps({name: round(seconds, 3) for name, seconds in timings.items()}), time.time(), job_id),
+    )
+
+
+def reset_for_retry(job_id: str):
+    """ล้าง error ความคืบหน้า และเวลาของรอบที่ล้มเหลว (upsert_job ไม่ทับฟิลด์ด้วยค่าว่าง จึงต้องล้างตรงนี้)"""
+    get_connection().execute(
+        "UPDATE jobs SET error = '', progress = '{}', timings = '{}', updated_at = ? WHERE job_id = ?", (time.time(), job_id)
+    )
+
+
+def _public_view(row: sqlite3.Row) -> Dict:
+    job = {field: row[field] for field in PUBLIC_FIELDS if row[field]}
+    for field in JSON_FIELDS:
+        value = json.loads(row[field]) if row[field] else None
+        if value: job[field] = value
+    return job
+
+
+def get_job(job_id: str) -> Optional[Dict]:
+    """อ่านสถานะของ Job (ไม่ต้องล็อก เพราะ WAL ให้ผู้อ่านเห็น snapshot ล่าสุดที่ commit แล้ว)"""
+    row = get_connection().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    return _public_view(row)
+
+
+def get_job_version(job_id: str) -> Optional[float]:
+    """เวลาที่ Job ถูกแก้ไขล่าสุด ใช้ตรวจว่ามีอะไรเปลี่ยนโดยไม่ต้องอ่านทั้งแถว"""
+    row = get_connection().execute("SELECT updated_at FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    return row[0] if row else None
+
+
+def list_jobs(status: Optional[str] = None, limit: int = 100) -> List[Dict]:
+    """รายการ Job ล่าสุด (กรองตาม status ได้) ใช้ index บน status และ created_at"""
+    conn = get_connection()
+    if status:
+        rows = conn.execute(
+            "SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?", (status, limit)
+        ).fetchall()
+    else:
+        rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+    return [dict(row) for row in rows]
+
+def _batch_status(counts: Dict[str, int]) -> str:
+    total = sum(counts.values())
+    if any(counts.get(status) for status in ACTIVE_STATUSES):
+        return "pending" if counts.get("pending") == total else "processing"
+    if counts.get("completed") == total: return "completed"
+    if counts.get("failed") == total: return "failed"
+    return "completed_with_errors"
+
+
+def get_batch(batch_id: str) -> Optional[Dict]:
+    """
+    สถานะรวมของทุก Job ใน batch (จำนวนแยกตาม status + สถานะของแต่ละ Job เรียงตามลำดับที่ส่งมา)
+    คืน None ถ้าไม่มี batch นี้
+    """
+    rows = get_connection().execute(
+        "SELECT * FROM jobs WHERE batch_id = ? ORDER BY created_at, rowid", (batch_id,)
+    ).fetchall()
+    if not rows:
+        return None
+    counts: Dict[str, int] = {}
+    for row in rows:
+        counts[row["status"]] = counts.get(row["status"], 0) + 1
+    return {
+        "batch_id": batch_id,
+        "status": _batch_status(counts),
+        "total": len(rows),
+        "counts": counts,
+        "jobs": [dict(job_id=row["job_id"], **_public_view(row)) for row in rows],
+    }
+
+# --- END OF FILE ---
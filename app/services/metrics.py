@@ -0,0 +1,202 @@
+# --- START OF FILE: app/services/metrics.py ---
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+from . import cache_service, job_queue, pipeline, rate_limiter, worker_pool
+
+# Metrics ภายใน process (counter / gauge / histogram) แสดงผลแบบ Prometheus text format ที่ GET /metrics
+# - ค่าเป็นของ process ที่ถูก scrape เท่านั้น (API + embedded worker) worker ที่แยก process ให้เปิด --metrics-port ของตัวเอง
+# - ความยาวคิว (queue depth) อ่านจากฐานข้อมูลตอน scrape จึงเป็นค่ารวมของทุก process
+# - เวลาของทุก stage ใน Pipeline ถูกเก็บอัตโนมัติผ่าน pipeline.add_listener (ดูท้ายไฟล์)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# bucket (วินาที) ครอบคลุมตั้งแต่การเรียก API สั้นๆ ไปจนถึงการ render หลายนาที
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# ชื่อ metric -> (ชนิด, คำอธิบาย)
+METRICS = {
+    "story_stage_duration_seconds": (HISTOGRAM, "Duration of each job stage (plan, images, voice, video, upload, ...)."),
+    "story_stage_failures_total": (COUNTER, "Job stages that raised an error."),
+    "story_jobs_total": (COUNTER, "Finished jobs by kind and final status."),
+    "story_render_duration_seconds": (HISTOGRAM, "Wall time of the ffmpeg render by render mode and encoder profile."),
+    "story_image_request_duration_seconds": (HISTOGRAM, "Duration of a single Imagen request."),
+    "story_tts_request_duration_seconds": (HISTOGRAM, "Duration of text-to-speech synthesis by TTS mode."),
+    "story_backend_retries_total": (COUNTER, "Retries of calls to external backends."),
+    "story_quota_errors_total": (COUNTER, "Quota / 429 errors returned by model backends."),
+    "story_model_wait_seconds": (HISTOGRAM, "Time model calls waited for the rate limiter by backend and priority."),
+    "story_model_rate_per_minute": (GAUGE, "Current adaptive request rate of each model backend."),
+    "story_plan_cache_requests_total": (COUNTER, "Story plan cache lookups by result."),
+    "story_bytes_written_total": (COUNTER, "Bytes of generated files written to disk by kind."),
+    "story_ffmpeg_processes": (GAUGE, "ffmpeg processes currently running."),
+    "story_queue_depth": (GAUGE, "Jobs waiting in the persistent queue (all processes)."),
+    "story_jobs_in_flight": (GAUGE, "Jobs accepted by this process's job pool (running or waiting)."),
+    "story_cache_hits_total": (COUNTER, "Disk cache hits by cache name."),
+    "story_cache_misses_total": (COUNTER, "Disk cache misses by cache name."),
+    "story_cache_evictions_total": (COUNTER, "Disk cache evictions by cache name."),
+    "story_cache_bytes": (GAUGE, "Bytes currently stored in each disk cache."),
+}
+
+_lock = threading.Lock()
+_values: Dict[Tuple[str, Tuple], float] = {}
+_histograms: Dict[Tuple[str, Tuple], List] = {}  # [จำนวนต่อ bucket..., sum, count]
+_collectors: List[Callable[[], None]] = []
+
+
+def _key(name: str, labels: Dict) -> Tuple[str, Tuple]:
+    if name not in METRICS: raise KeyError(f"Unknown metric: {name}")
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+
+def set_value(name: str, value: float, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = value
+
+
+def observe(name: str, seconds: float, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * len(DEFAULT_BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if seconds <= bound: histogram[i] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """จับเวลาของบล็อก with แล้ว observe เข้า histogram (บันทึกแม้บล็อกจะโยน error)"""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - started, **labels)
+
+
+@contextmanager
+def in_progress(name: str, **labels):
+    """gauge นับจำนวนงานที่กำลังทำอยู่ (+1 ตอนเข้า, -1 ตอนออก)"""
+    inc(name, 1, **labels)
+    try:
+        yield
+    finally:
+        inc(name, -1, **labels)
+
+
+def register_collector(collector: Callable[[], None]):
+    """ฟังก์ชันที่ถูกเรียกก่อน render ทุกครั้ง ใช้อัปเดตค่าที่ต้องอ่านจากที่อื่น (เช่น ความยาวคิว)"""
+    _collectors.append(collector)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(pairs) -> str:
+    if not pairs: return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render() -> str:
+    """ค่าทั้งหมดในรูปแบบ Prometheus text exposition format (version 0.0.4)"""
+    for collector in list(_collectors):
+        try:
+            collector()
+        except Exception:
+            pass  # metrics ต้องไม่ทำให้ /metrics ล้ม ถ้าอ่านค่าไม่ได้ก็แค่ไม่อัปเดตรอบนี้
+    with _lock:
+        values = dict(_values)
+        histograms = {key: list(value) for key, value in _histograms.items()}
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == HISTOGRAM:
+            for (metric, pairs), histogram in sorted(histograms.items()):
+                if metric != name: continue
+                for bound, count in zip(DEFAULT_BUCKETS, histogram):
+                    lines.append(f"{name}_bucket{_labels(pairs + (('le', _format(bound)),))} {count}")
+                lines.append(f"{name}_bucket{_labels(pairs + (('le', '+Inf'),))} {histogram[-1]}")
+                lines.append(f"{name}_sum{_labels(pairs)} {histogram[-2]:.6f}")
+                lines.append(f"{name}_count{_labels(pairs)} {histogram[-1]}")
+        else:
+            for (metric, pairs), value in sorted(values.items()):
+                if metric == name: lines.append(f"{name}{_labels(pairs)} {_format(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# --- ค่าที่อ่านตอน scrape ---
+def _collect_queues():
+    set_value("story_queue_depth", job_queue.queue_depth())
+    set_value("story_jobs_in_flight", worker_pool.queue_depth())
+
+
+def _collect_rate_limits():
+    for backend, stats in rate_limiter.snapshot().items():
+        set_value("story_model_rate_per_minute", stats["rate_per_minute"], backend=backend)
+
+
+def _collect_caches():
+    for cache in cache_service.CACHES:
+        stats = cache.stats()
+        set_value("story_cache_hits_total", stats["hits"], cache=cache.name)
+        set_value("story_cache_misses_total", stats["misses"], cache=cache.name)
+        set_value("story_cache_evictions_total", stats["evictions"], cache=cache.name)
+        set_value("story_cache_bytes", stats["bytes"], cache=cache.name)
+
+
+def _record_pipeline_task(pipeline_name: str, task_name: str, seconds: float, error):
+    observe("story_stage_duration_seconds", seconds, stage=task_name)
+    if error is not None:
+        inc("story_stage_failures_total", stage=task_name)
+
+
+def serve(port: int, host: str = "0.0.0.0"):
+    """เปิด HTTP server เล็กๆ ใน thread แยกที่ตอบ /metrics (ใช้กับ worker ที่แยก process จาก API)"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # ไม่ log ทุก scrape
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+register_collector(_collect_queues)
+register_collector(_collect_caches)
+register_collector(_collect_rate_limits)
+pipeline.add_listener(_record_pipeline_task)
+
+# --- END OF FILE ---
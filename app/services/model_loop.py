@@ -0,0 +1,147 @@
+# --- START OF FILE: app/services/model_loop.py ---
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional
+
+from app import config
+from . import metrics, rate_limiter
+
+# Event loop กลางของ process สำหรับการเรียก model ภายนอกแบบ async (Gemini / Imagen / TTS)
+# - รันอยู่ใน thread ของตัวเอง 1 thread ทุก workflow ส่ง coroutine มารันที่นี่ (run / run_async)
+#   client แบบ async ของ SDK (gRPC aio) ผูกกับ loop ที่สร้างมัน จึงต้องใช้ loop เดียวกันตลอด
+#   ทั้ง process ใช้ connection pool ชุดเดียวกัน
+# - การเรียกที่รออยู่เป็นแค่ coroutine ไม่กิน OS thread ต่อการเรียกหนึ่งครั้ง
+# - slot(backend) รอ token จาก rate limiter ของ backend ตาม priority ของผู้เรียก (ดู rate_limiter.py)
+#   แล้วจำกัดจำนวนการเรียกที่ค้างอยู่พร้อมกันต่อ backend ทั้ง process (MODEL_MAX_IN_FLIGHT)
+#   ผลของการเรียก (สำเร็จ / quota error) ถูกส่งกลับไปปรับ rate ของ backend นั้น
+# - SDK ที่ไม่มี API แบบ async (เช่น Imagen) ใช้ run_blocking: thread pool แยกต่อ backend ขนาดเท่ากับ limit
+
+GEMINI = "gemini"
+IMAGEN = "imagen"
+TTS = "tts"
+
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+_executors: Dict[str, ThreadPoolExecutor] = {}
+
+
+def max_in_flight(backend: str) -> int:
+    return config.MODEL_MAX_IN_FLIGHT.get(backend, config.IO_WORKERS)
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """loop กลางของ process (เริ่ม thread เมื่อถูกใช้ครั้งแรก)"""
+    global _loop, _thread
+    with _lock:
+        if _loop is None or not _thread.is_alive():
+            _loop = asyncio.new_event_loop()
+            _semaphores.clear()
+            rate_limiter.reset()
+            _thread = threading.Thread(target=_loop.run_forever, name="model-loop", daemon=True)
+            _thread.start()
+            logging.info("Model Loop: Started shared event loop for model calls.")
+        return _loop
+
+
+def _check_not_on_loop(loop: asyncio.AbstractEventLoop):
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    if running is loop:
+        raise RuntimeError("model_loop.run() cannot be called from the model loop itself; await the coroutine instead.")
+
+
+async def _with_priority(coro, level: int):
+    # task บน loop กลางไม่ได้สืบทอด context ของ thread ที่ส่งมา จึงส่ง priority ของผู้เรียกต่อให้เอง
+    with rate_limiter.priority(level):
+        return await coro
+
+
+def run(coro, timeout: Optional[float] = None):
+    """รัน coroutine บน loop กลางแล้วรอผล (เรียกจาก thread ปกติ เช่น workflow หรือ pipeline task)"""
+    loop = get_loop()
+    _check_not_on_loop(loop)
+    coro = _with_priority(coro, rate_limiter.current_priority())
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+
+async def run_async(coro):
+    """เวอร์ชันสำหรับ async handler ของ FastAPI: รอผลจาก loop กลางโดยไม่ block event loop ของตัวเอง"""
+    loop = get_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    coro = _with_priority(coro, rate_limiter.current_priority())
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+@asynccontextmanager
+async def slot(backend: str):
+    """รอ token ของ backend แล้วจอง 1 ที่จาก limit ของ backend (ใช้ได้บน loop กลางเท่านั้น)"""
+    limiter = rate_limiter.bucket(backend)
+    if limiter is not None:
+        level = rate_limiter.current_priority()
+        with metrics.timed("story_model_wait_seconds", backend=backend, priority=rate_limiter.PRIORITY_NAMES.get(level, level)):
+            await limiter.acquire(level)
+    semaphore = _semaphores.get(backend)
+    if semaphore is None:
+        semaphore = _semaphores[backend] = asyncio.Semaphore(max_in_flight(backend))
+    async with semaphore:
+        issued_at = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if rate_limiter.is_quota_error(e):
+                metrics.inc("story_quota_errors_total", backend=backend)
+                if limiter is not None: limiter.on_quota_error(issued_at)
+            raise
+        else:
+            if limiter is not None: limiter.on_success()
+
+
+async def call(backend: str, make_call: Callable[[], Awaitable]):
+    """
+    await make_call() ภายใต้ slot ของ backend และลองใหม่เมื่อเจอ quota error (สูงสุด QUOTA_MAX_RETRIES ครั้ง)
+    ระยะรอก่อนลองใหม่มาจาก rate limiter ที่เพิ่งลด rate และพักการจ่าย token ไป ทุก job จึงไม่ถอยพร้อมกันแบบตายตัว
+    """
+    for attempt in range(config.QUOTA_MAX_RETRIES + 1):
+        try:
+            async with slot(backend):
+                return await make_call()
+        except Exception as e:
+            if not rate_limiter.is_quota_error(e) or attempt >= config.QUOTA_MAX_RETRIES:
+                raise
+            metrics.inc("story_backend_retries_total", backend=backend)
+            logging.warning(f"Model Loop: {backend} quota error ({e}), retry {attempt + 1}/{config.QUOTA_MAX_RETRIES}.")
+            if rate_limiter.bucket(backend) is None:
+                await asyncio.sleep(config.QUOTA_COOLDOWN_SECONDS * 2 ** attempt)
+
+
+def _executor(backend: str) -> ThreadPoolExecutor:
+    with _lock:
+        executor = _executors.get(backend)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_in_flight(backend), thread_name_prefix=f"{backend}-call")
+            _executors[backend] = executor
+        return executor
+
+
+async def in_executor(backend: str, fn: Callable, *args, **kwargs):
+    """เรียกฟังก์ชันแบบ blocking ของ SDK ที่ไม่มี async ใน thread pool ของ backend นั้น (ผู้เรียกต้องถือ slot เอง)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor(backend), functools.partial(fn, *args, **kwargs))
+
+
+async def run_blocking(backend: str, fn: Callable, *args, **kwargs):
+    """in_executor ภายใต้ slot ของ backend (ไม่ลองใหม่เอง ใช้กับผู้เรียกที่มี retry ของตัวเอง เช่น Imagen)"""
+    async with slot(backend):
+        return await in_executor(backend, fn, *args, **kwargs)
+
+# --- END OF FILE ---
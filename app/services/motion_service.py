@@ -0,0 +1,140 @@
+# --- START OF FILE: app/services/motion_service.py ---
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Iterator, Optional
+
+import numpy as np
+from PIL import Image
+
+from app import config
+
+# Ken Burns แบบ numpy (ใช้แทน filter zoompan ของ ffmpeg ในโหมด render "numpy")
+# - คำนวณกรอบ crop (x, y, w, h) ของทุกเฟรมใน clip ครั้งเดียวเป็น array
+# - แต่ละเฟรมคือการ crop + resize จากภาพที่โหลดไว้แล้ว (Pillow resize แบบมี box ทำใน C)
+# - transition ระหว่างฉากทำใน numpy เลียนแบบ xfade ของ ffmpeg
+# ได้ frame RGB24 เรียงตามเวลาทั้งวิดีโอ ส่งเข้า ffmpeg encoder ตัวเดียวทาง stdin (ดู video_service._render_numpy)
+
+# ต้องตรงกับ video_service.zoom_pan_effects (ใช้ 'name' ของ preset เลือกสูตร)
+ZOOM_STEP = 0.0015
+MAX_ZOOM = 1.2
+TRANSITIONS = ("fade", "fadeblack", "wipeleft", "slideup", "circleopen", "pixelize")
+
+
+def zoom_pan_windows(effect_name: str, frame_count: int, iw: int, ih: int) -> np.ndarray:
+    """
+    กรอบ crop ของเฟรม 0..frame_count-1 เป็น array (frame_count, 4) ของ x, y, w, h
+    สูตรเดียวกับ zoompan: w = iw/zoom, h = ih/zoom
+    """
+    n = np.arange(frame_count, dtype=np.float64)
+    if effect_name == "zoom_in":
+        # z='min(zoom+0.0015,1.2)' (zoom ของเฟรมก่อนหน้าเริ่มที่ 1)
+        zoom = np.minimum(1.0 + ZOOM_STEP * (n + 1), MAX_ZOOM)
+    elif effect_name == "zoom_out":
+        # z='1.2-0.0015*on' (zoompan ไม่ให้ zoom ต่ำกว่า 1)
+        zoom = np.maximum(MAX_ZOOM - ZOOM_STEP * n, 1.0)
+    else:
+        zoom = np.full(frame_count, MAX_ZOOM)
+    w, h = iw / zoom, ih / zoom
+    if effect_name in ("zoom_in", "zoom_out"):
+        x, y = iw / 2 - w / 2, ih / 2 - h / 2
+    elif effect_name == "pan_bottom_right":
+        x, y = iw - w, ih - h
+    else:
+        x, y = np.zeros(frame_count), np.zeros(frame_count)
+    return np.stack([x, y, w, h], axis=1)
+
+
+def clip_frames(frame_path: str, duration: float, effect_name: str, video_width: int, video_height: int) -> Iterator[np.ndarray]:
+    """
+    เฟรม RGB (H, W, 3) uint8 ของฉากเดียว ยาว duration วินาที
+    resize ของ Pillow ปล่อย GIL จึงสร้างทีละชุดพร้อมกันหลาย thread (ชุดละไม่กี่เฟรม ไม่ให้กินหน่วยความจำ)
+    """
+    frame_count = max(1, int(duration * config.VIDEO_FPS))
+    with Image.open(frame_path) as source:
+        image = source.convert("RGB")
+    image.load()
+    windows = zoom_pan_windows(effect_name, frame_count, image.width, image.height)
+
+    def render(window) -> np.ndarray:
+        x, y, w, h = window
+        return np.asarray(image.resize((video_width, video_height), Image.BILINEAR, box=(x, y, x + w, y + h)))
+
+    workers = max(1, config.MOTION_WORKERS)
+    batch = workers * 2
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="motion") as pool:
+        for start in range(0, frame_count, batch):
+            yield from pool.map(render, windows[start:start + batch])
+
+
+def _mix(a: np.ndarray, b: np.ndarray, progress: float) -> np.ndarray:
+    # ผสมแบบ fixed-point 8 bit (เร็วกว่าแปลงเป็น float ทั้งเฟรม)
+    weight = int(round(progress * 256))
+    return ((a.astype(np.uint16) * (256 - weight) + b.astype(np.uint16) * weight) >> 8).astype(np.uint8)
+
+
+def blend_transition(a: np.ndarray, b: np.ndarray, progress: float, style: str) -> np.ndarray:
+    """เฟรมระหว่าง transition จาก a ไป b (progress 0 -> 1) ตาม style ของ xfade"""
+    height, width = a.shape[:2]
+    if style == "wipeleft":
+        edge = int(round(width * (1 - progress)))
+        out = b.copy()
+        out[:, :edge] = a[:, :edge]
+        return out
+    if style == "slideup":
+        offset = int(round(height * progress))
+        return np.concatenate([a[offset:], b[:offset]], axis=0)
+    if style == "circleopen":
+        yy, xx = np.ogrid[:height, :width]
+        radius = progress * np.hypot(width / 2, height / 2)
+        inside = (xx - width / 2) ** 2 + (yy - height / 2) ** 2 <= radius ** 2
+        return np.where(inside[..., None], b, a)
+    if style == "fadeblack":
+        black = np.zeros_like(a)
+        if progress < 0.5:
+            return _mix(a, black, progress * 2)
+        return _mix(black, b, progress * 2 - 1)
+    mixed = _mix(a, b, progress)
+    if style == "pixelize":
+        # บล็อกใหญ่สุดตรงกลาง transition แล้วค่อยๆ กลับมาคมชัด
+        block = max(1, int(round(min(width, height) / 20 * (1 - abs(progress * 2 - 1)))))
+        if block > 1:
+            small = mixed[::block, ::block]
+            mixed = np.repeat(np.repeat(small, block, axis=0), block, axis=1)[:height, :width]
+    return mixed
+
+
+def video_frames(
+    frame_paths: List[str], durations: List[float], effect_names: List[str], video_width: int, video_height: int,
+    transition_style: str, transition_duration: float
+) -> Iterator[np.ndarray]:
+    """
+    เฟรมของทั้งวิดีโอตามลำดับเวลา ฉากที่ i+1 เริ่มซ้อนทับฉาก i ในช่วง transition_duration วินาทีสุดท้าย
+    (เหมือน offset ของ xfade ใน video_service.join_clips_with_transitions)
+    """
+    style = transition_style if transition_style in TRANSITIONS else "fade"
+    overlap = int(round(transition_duration * config.VIDEO_FPS)) if len(frame_paths) > 1 else 0
+    carry: Optional[List[np.ndarray]] = None
+    for i, frame_path in enumerate(frame_paths):
+        frames = clip_frames(frame_path, durations[i], effect_names[i], video_width, video_height)
+        is_last = i == len(frame_paths) - 1
+        # ช่วงต้นของฉาก: ซ้อนกับเฟรมท้ายของฉากก่อนหน้า
+        if carry:
+            for k, previous in enumerate(carry):
+                current = next(frames, None)
+                if current is None: break
+                yield blend_transition(previous, current, (k + 1) / (len(carry) + 1), style)
+        # ช่วงกลาง: เฟรมของฉากนี้อย่างเดียว แต่เก็บเฟรมท้ายไว้ซ้อนกับฉากถัดไป
+        tail: List[np.ndarray] = []
+        for current in frames:
+            if not is_last and overlap:
+                tail.append(current)
+                if len(tail) > overlap:
+                    yield tail.pop(0)
+            else:
+                yield current
+        carry = tail
+
+
+def effect_names(effects: List[Dict[str, str]]) -> List[str]:
+    return [effect.get("name", "zoom_in") for effect in effects]
+
+# --- END OF FILE ---
@@ -0,0 +1,168 @@
+# --- START OF FILE: app/services/music_service.py ---
+import logging
+import os
+import threading
+import wave
+from pathlib import Path
+from typing import Optional, Dict, List
+
+import ffmpeg
+import numpy as np
+
+from app import config
+from app.services.cache_service import DiskCache
+from app.services import metrics
+
+# ตัวจัดการเพลงประกอบ (แทนการให้ ffmpeg decode MP3 ทั้งเพลงใหม่ทุก job)
+# - decode แต่ละเพลงใน config.MUSIC_DIR ครั้งเดียวเป็น PCM int16 แล้วปรับความดัง (RMS) ให้ทุกเพลงเท่ากัน
+#   เก็บเป็นไฟล์ .npy ใต้ CACHE_DIR/music ทุก process เปิดแบบ mmap ใช้ page cache ร่วมกัน
+# - ชื่อเพลงไม่สนตัวพิมพ์เล็ก/ใหญ่ และไม่ต้องมี .mp3 ก็ได้ ("epic", "Epic.mp3" คือเพลงเดียวกัน)
+# - mix_with_voice ผสมเสียงพากย์กับเพลงด้วย numpy สูตรเดียวกับ amix ของ ffmpeg (weights "1 v", normalize)
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+NO_MUSIC = "none"
+MUSIC_EXTENSIONS = (".mp3", ".wav", ".m4a", ".aac", ".ogg")
+
+_lock = threading.Lock()
+_decoded: Dict[str, np.ndarray] = {}
+
+
+class UnknownMusicError(ValueError):
+    pass
+
+
+def _track_index() -> Dict[str, Path]:
+    """ชื่อเพลง (ตัวพิมพ์เล็ก ไม่มีนามสกุล) -> path ของไฟล์"""
+    if not config.MUSIC_DIR.is_dir(): return {}
+    return {
+        path.stem.lower(): path
+        for path in sorted(config.MUSIC_DIR.iterdir())
+        if path.is_file() and path.suffix.lower() in MUSIC_EXTENSIONS
+    }
+
+
+def available_tracks() -> List[str]:
+    return [path.name for path in _track_index().values()]
+
+
+def _track_name(music_filename: str) -> str:
+    name = (music_filename or NO_MUSIC).strip()
+    stem, suffix = os.path.splitext(name)
+    return (stem if suffix.lower() in MUSIC_EXTENSIONS else name).lower()
+
+
+def resolve_track(music_filename: str) -> Optional[Path]:
+    """
+    คืน path ของเพลง หรือ None ถ้าเลือก "none"
+    ชื่อที่ไม่มีอยู่จริงจะโยน UnknownMusicError (ไม่ข้ามไปเงียบๆ เหมือนเดิม)
+    """
+    name = _track_name(music_filename)
+    if name == NO_MUSIC: return None
+    path = _track_index().get(name)
+    if path is None:
+        raise UnknownMusicError(
+            f"Unknown music track '{music_filename}'. Available: {', '.join([NO_MUSIC] + available_tracks())}"
+        )
+    return path
+
+
+def validate_music_filename(music_filename: str):
+    """เรียกตอนรับ request เพื่อตอบ 400 ทันทีถ้าเลือกเพลงที่ไม่มี"""
+    resolve_track(music_filename)
+
+
+def _decode_to_pcm(path: Path) -> np.ndarray:
+    out, _ = (
+        ffmpeg.input(str(path))
+        .output('pipe:', format='s16le', acodec='pcm_s16le', ac=CHANNELS, ar=SAMPLE_RATE)
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    return np.frombuffer(out, dtype=np.int16).reshape(-1, CHANNELS)
+
+
+def _normalize_loudness(samples: np.ndarray) -> np.ndarray:
+    """ปรับ RMS ให้เท่ากับ MUSIC_TARGET_RMS_DBFS (จำกัดไม่ให้ peak เกินเต็มสเกล)"""
+    as_float = samples.astype(np.float32) / 32768.0
+    rms = float(np.sqrt(np.mean(np.square(as_float)))) if as_float.size else 0.0
+    if rms <= 0: return samples
+    gain = (10 ** (config.MUSIC_TARGET_RMS_DBFS / 20)) / rms
+    peak = float(np.max(np.abs(as_float)))
+    if peak * gain > 1.0: gain = 1.0 / peak
+    return np.clip(as_float * gain * 32767.0, -32768, 32767).astype(np.int16)
+
+
+def _cache_path(path: Path) -> Path:
+    key = DiskCache.make_key(
+        "music-v1", DiskCache.hash_file(str(path)), SAMPLE_RATE, CHANNELS, config.MUSIC_TARGET_RMS_DBFS
+    )
+    return config.CACHE_DIR / "music" / f"{key}.npy"
+
+
+def load_track(music_filename: str) -> Optional[np.ndarray]:
+    """PCM int16 (samples, channels) ของเพลงที่ปรับความดังแล้ว decode ครั้งแรกที่ใช้ แล้วใช้ซ้ำ"""
+    path = resolve_track(music_filename)
+    if path is None: return None
+    name = path.stem.lower()
+    with _lock:
+        samples = _decoded.get(name)
+        if samples is not None: return samples
+        cache_path = _cache_path(path)
+        if cache_path.is_file():
+            samples = np.load(cache_path, mmap_mode='r')
+        else:
+            samples = _normalize_loudness(_decode_to_pcm(path))
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp.npy")
+            np.save(tmp_path, samples)
+            os.replace(tmp_path, cache_path)
+            logging.info(f"Music Service: Decoded '{path.name}' ({len(samples) / SAMPLE_RATE:.1f}s) -> {cache_path.name}")
+        _decoded[name] = samples
+        return samples
+
+
+def preload_tracks():
+    """decode ทุกเพลงไว้ก่อนตอน startup (เพลงที่ decode ไม่ได้จะแค่ log ไว้)"""
+    for filename in available_tracks():
+        try:
+            load_track(filename)
+        except Exception as e:
+            logging.warning(f"Music Service: Could not pre-decode '{filename}': {e}")
+
+
+def get_segment(music_filename: str, seconds: float, volume: float) -> Optional[np.ndarray]:
+    """เพลงช่วง N วินาทีแรกที่ระดับเสียง volume เป็น float32 (samples, channels) None ถ้าไม่ใช้เพลง"""
+    samples = load_track(music_filename)
+    if samples is None: return None
+    count = min(len(samples), int(round(seconds * SAMPLE_RATE)))
+    return samples[:count].astype(np.float32) * float(volume)
+
+
+def _write_wav(samples: np.ndarray, output_path: str):
+    pcm = np.clip(samples, -32768, 32767).astype(np.int16)
+    with wave.open(output_path, "wb") as f:
+        f.setnchannels(CHANNELS)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm.tobytes())
+    metrics.inc("story_bytes_written_total", pcm.nbytes, kind="audio")
+
+
+def mix_with_voice(voice_audio_path: str, music_filename: str, music_volume: float, output_path: str) -> str:
+    """
+    ผสมเสียงพากย์กับเพลงเป็น WAV ไฟล์เดียว ความยาวเท่าเสียงพากย์
+    เทียบเท่า amix=duration=first:weights="1 v" (normalize): (voice + v * music) / (1 + v) ช่วงที่มีเพลง
+    amix normalize ด้วยน้ำหนักรวมของ input ที่ยังเล่นอยู่ ถ้าเพลงสั้นกว่าเสียงพากย์ ช่วงหลังเพลงจบจึงเป็นเสียงพากย์เต็มระดับ
+    """
+    voice = _decode_to_pcm(Path(voice_audio_path)).astype(np.float32)
+    music = get_segment(music_filename, len(voice) / SAMPLE_RATE, music_volume)
+    mixed = voice
+    if music is not None and len(music):
+        mixed = voice.copy()
+        overlap = mixed[:len(music)]
+        overlap += music
+        overlap /= (1.0 + float(music_volume))
+    _write_wav(mixed, output_path)
+    return output_path
+
+# --- END OF FILE ---
@@ -0,0 +1,89 @@
+# --- START OF FILE: app/services/pipeline.py ---
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterable, List
+
+# ตัวรันงานแบบกราฟ dependency ขนาดเล็กสำหรับ workflow ของ Job
+# - แต่ละ task เริ่มทันทีที่ task ที่มันต้องใช้ผลลัพธ์เสร็จครบ (task ที่ไม่ขึ้นต่อกันรันพร้อมกัน)
+# - task ได้รับผลลัพธ์ของ dependency เป็น keyword argument ตามชื่อ task
+# - thread ในนี้เป็นแค่ตัวประสานงาน งานหนักจริงยังส่งต่อไปที่ worker_pool (run_io / run_cpu)
+#   task รันใน context ของผู้เรียก run() (เช่น priority ของ rate_limiter)
+# - ถ้า task ใดล้มเหลว จะไม่เริ่ม task ใหม่อีก รอ task ที่กำลังรันให้จบ แล้วโยน error แรกออกไป
+# - listener ที่ลงทะเบียนด้วย add_listener จะถูกเรียกทุกครั้งที่ task จบ (ใช้เก็บเวลาของแต่ละ stage เช่นใน app/bench)
+
+# listener(ชื่อ pipeline, ชื่อ task, วินาที, error หรือ None)
+_listeners: List[Callable[[str, str, float, Exception], None]] = []
+
+
+def add_listener(listener: Callable[[str, str, float, Exception], None]):
+    _listeners.append(listener)
+
+
+def remove_listener(listener: Callable[[str, str, float, Exception], None]):
+    if listener in _listeners: _listeners.remove(listener)
+
+
+class Pipeline:
+    def __init__(self, name: str = "pipeline"):
+        self.name = name
+        self._tasks: Dict[str, tuple] = {}
+        self.timings: Dict[str, float] = {}
+
+    def add(self, name: str, fn: Callable, deps: Iterable[str] = ()) -> "Pipeline":
+        self._tasks[name] = (fn, tuple(deps))
+        return self
+
+    def _run_task(self, name: str, fn: Callable, kwargs: Dict):
+        started = time.monotonic()
+        error = None
+        try:
+            return fn(**kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.timings[name] = time.monotonic() - started
+            for listener in list(_listeners):
+                try:
+                    listener(self.name, name, self.timings[name], error)
+                except Exception:
+                    logging.exception(f"Pipeline '{self.name}': Listener failed for task '{name}'.")
+
+    def run(self, initial: Dict = None) -> Dict:
+        """รันทุก task คืน dict ของชื่อ task -> ผลลัพธ์ (initial คือผลลัพธ์ที่มีอยู่แล้ว เช่นจาก checkpoint)"""
+        results = dict(initial or {})
+        pending = {name: task for name, task in self._tasks.items() if name not in results}
+        for name, (_, deps) in pending.items():
+            unknown = [dep for dep in deps if dep not in self._tasks and dep not in results]
+            if unknown: raise ValueError(f"Pipeline '{self.name}': Task '{name}' depends on unknown tasks {unknown}.")
+        running = {}
+        first_error = None
+
+        with ThreadPoolExecutor(max_workers=max(1, len(pending)), thread_name_prefix=self.name) as pool:
+            while pending or running:
+                if first_error is None:
+                    for name, (fn, deps) in list(pending.items()):
+                        if all(dep in results for dep in deps):
+                            del pending[name]
+                            kwargs = {dep: results[dep] for dep in deps}
+                            running[pool.submit(contextvars.copy_context().run, self._run_task, name, fn, kwargs)] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        logging.error(f"Pipeline '{self.name}': Task '{name}' failed: {e}")
+                        if first_error is None: first_error = e
+
+        if first_error is not None:
+            raise first_error
+        if pending:
+            raise RuntimeError(f"Pipeline '{self.name}': Tasks could not be scheduled: {sorted(pending)}")
+        return results
+
+# --- END OF FILE ---
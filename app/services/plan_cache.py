@@ -0,0 +1,97 @@
+# --- START OF FILE: app/services/plan_cache.py ---
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional, Dict
+
+from app import config
+from . import job_repository
+
+# Cache ของ story plan ที่ได้จาก Gemini (อยู่ในฐานข้อมูล SQLite เดียวกับ job_repository)
+# - key คือ hash ของ persona, idea, age_group, image_style, ชื่อ model และ generation config
+# - worker ทุก process บนเครื่องเดียวกันเห็น cache เดียวกัน
+# - plan ที่เก่ากว่า STORY_PLAN_CACHE_TTL_SECONDS ถือว่าหมดอายุ
+# - เก็บได้ไม่เกิน STORY_PLAN_CACHE_MAX_ENTRIES แถว เกินแล้วลบแถวที่ใช้ล่าสุดนานที่สุดก่อน (LRU)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS story_plans (
+    cache_key     TEXT PRIMARY KEY,
+    plan          TEXT NOT NULL,
+    created_at    REAL NOT NULL,
+    last_used_at  REAL NOT NULL,
+    hits          INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_story_plans_last_used ON story_plans(last_used_at);
+"""
+
+_schema_lock = threading.Lock()
+_schema_ready_pid: Optional[int] = None
+
+
+def _connection():
+    global _schema_ready_pid
+    conn = job_repository.get_connection()
+    if _schema_ready_pid != os.getpid():
+        with _schema_lock:
+            if _schema_ready_pid != os.getpid():
+                conn.executescript(_SCHEMA)
+                _schema_ready_pid = os.getpid()
+    return conn
+
+
+def get(cache_key: str) -> Optional[Dict]:
+    """คืน plan ที่ยังไม่หมดอายุ (และบันทึกว่าเพิ่งถูกใช้) หรือ None ถ้าไม่มี"""
+    now = time.time()
+    conn = _connection()
+    row = conn.execute(
+        "SELECT plan FROM story_plans WHERE cache_key = ? AND created_at >= ?",
+        (cache_key, now - config.STORY_PLAN_CACHE_TTL_SECONDS),
+    ).fetchone()
+    if row is None:
+        return None
+    conn.execute(
+        "UPDATE story_plans SET last_used_at = ?, hits = hits + 1 WHERE cache_key = ?", (now, cache_key)
+    )
+    return json.loads(row["plan"])
+
+
+def put(cache_key: str, plan: Dict):
+    now = time.time()
+    conn = _connection()
+    conn.execute(
+        """
+        INSERT INTO story_plans (cache_key, plan, created_at, last_used_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(cache_key) DO UPDATE SET
+            plan = excluded.plan, created_at = excluded.created_at, last_used_at = excluded.last_used_at
+        """,
+        (cache_key, json.dumps(plan, ensure_ascii=False), now, now),
+    )
+    evict()
+
+
+def evict() -> int:
+    """ลบ plan ที่หมดอายุ แล้วตัดแถวที่ใช้ล่าสุดนานที่สุดออกจนเหลือไม่เกิน STORY_PLAN_CACHE_MAX_ENTRIES"""
+    conn = _connection()
+    expired = conn.execute(
+        "DELETE FROM story_plans WHERE created_at < ?", (time.time() - config.STORY_PLAN_CACHE_TTL_SECONDS,)
+    ).rowcount
+    overflow = conn.execute(
+        """
+        DELETE FROM story_plans WHERE cache_key IN (
+            SELECT cache_key FROM story_plans ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+        )
+        """,
+        (config.STORY_PLAN_CACHE_MAX_ENTRIES,),
+    ).rowcount
+    if expired or overflow:
+        logging.info(f"Plan cache: removed {expired} expired and {overflow} least recently used plans.")
+    return expired + overflow
+
+
+def stats() -> Dict:
+    row = _connection().execute("SELECT COUNT(*) AS entries, COALESCE(SUM(hits), 0) AS hits FROM story_plans").fetchone()
+    return {"entries": row["entries"], "hits": row["hits"], "max_entries": config.STORY_PLAN_CACHE_MAX_ENTRIES}
+
+# --- END OF FILE ---
@@ -0,0 +1,166 @@
+# --- START OF FILE: app/services/rate_limiter.py ---
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from app import config
+
+# Rate limit แบบ token bucket ต่อ model (Gemini / Imagen / TTS) ที่ทุก job ใน process ใช้ร่วมกัน
+# - ใช้ผ่าน model_loop.slot เท่านั้น (ทุกอย่างในนี้รันบน loop กลางของ model_loop จึงไม่ต้องใช้ lock)
+# - ปรับ rate เองจากผลการเรียก (AIMD): เจอ 429 / quota error -> ลด rate ครึ่งหนึ่งและหยุดจ่าย token ชั่วคราว
+#   เรียกสำเร็จ -> เพิ่ม rate ทีละนิดจนกลับไปที่เพดาน (MODEL_RATE_PER_MINUTE)
+#   การเรียกที่เริ่มก่อนการปรับครั้งล่าสุดจะไม่ถูกนับซ้ำ (429 จากคลื่นเดียวกันลด rate แค่ครั้งเดียว)
+# - คิวรอ token เรียงตาม priority (งาน interactive ของโหมด manual ก่อน -> งานทั่วไป -> งานใน batch) แล้วตามลำดับที่มาถึง
+# priority ของการเรียกมาจาก context ของผู้เรียก (ดู priority() และ model_loop.run)
+
+INTERACTIVE = 0
+DEFAULT = 1
+BATCH = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", DEFAULT: "default", BATCH: "batch"}
+
+# สัดส่วนของเพดานที่เพิ่มต่อการเรียกสำเร็จ 1 ครั้ง และที่ลดลงเมื่อเจอ quota error
+RECOVERY_STEP = 0.05
+DECREASE_FACTOR = 0.5
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("model_call_priority", default=DEFAULT)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+@contextmanager
+def priority(level: int):
+    """การเรียก model ทั้งหมดภายในบล็อกนี้ (รวมถึงใน worker_pool / Pipeline ที่ถูกเรียกต่อ) ใช้ priority นี้"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def is_quota_error(error: BaseException) -> bool:
+    """429 / ResourceExhausted / ข้อความที่บอกว่าเกินโควต้า (SDK แต่ละตัวโยน exception คนละแบบ)"""
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "resource exhausted" in message or "rate limit" in message
+
+
+class AdaptiveTokenBucket:
+    def __init__(self, name: str, rate_per_minute: float):
+        self.name = name
+        self.max_rate = rate_per_minute / 60
+        self.min_rate = self.max_rate * config.RATE_LIMIT_MIN_FRACTION
+        self.rate = self.max_rate
+        # จ่ายได้ทันทีสูงสุดเท่ากับ token ของ 5 วินาที
+        self.burst = max(1.0, self.max_rate * 5)
+        self.tokens = self.burst
+        self.quota_errors = 0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._adjusted_at = 0.0
+        self._consecutive_errors = 0
+        self._waiters: List = []  # heap ของ (priority, ลำดับ, future)
+        self._sequence = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self._updated = now
+
+    def _take(self) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def _seconds_until_token(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        return max(0.0, self._updated - now) + max(0.0, 1 - self.tokens) / self.rate
+
+    async def acquire(self, level: int = DEFAULT):
+        """รอจนได้ token 1 อัน (ถ้ามีคนรออยู่แล้ว ต้องเข้าคิวตาม priority แม้จะมี token เหลือ)"""
+        if not self._waiters and self._take():
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (level, next(self._sequence), future))
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        try:
+            while self._waiters:
+                if self._waiters[0][2].done():  # ผู้รอที่ถูกยกเลิกไปแล้ว
+                    heapq.heappop(self._waiters)
+                    continue
+                if self._take():
+                    heapq.heappop(self._waiters)[2].set_result(None)
+                else:
+                    await asyncio.sleep(self._seconds_until_token())
+        finally:
+            self._dispatcher = None
+
+    def on_success(self):
+        self._consecutive_errors = 0
+        self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_STEP)
+
+    def on_quota_error(self, issued_at: float):
+        """issued_at: เวลาที่การเรียกนั้นได้ token (เรียกก่อนการปรับครั้งล่าสุด = ถูกนับไปแล้ว)"""
+        self.quota_errors += 1
+        if issued_at < self._adjusted_at:
+            return
+        now = time.monotonic()
+        self._consecutive_errors += 1
+        self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+        cooldown = min(
+            config.QUOTA_COOLDOWN_MAX_SECONDS,
+            config.QUOTA_COOLDOWN_SECONDS * 2 ** (self._consecutive_errors - 1),
+        )
+        self._adjusted_at = now
+        self._paused_until = now + cooldown
+        # token ที่เหลือถูกทิ้ง และเริ่มสะสมใหม่หลังหมดช่วงพัก
+        self.tokens = 0.0
+        self._updated = self._paused_until
+
+    def snapshot(self) -> Dict:
+        return dict(
+            rate_per_minute=self.rate * 60, max_rate_per_minute=self.max_rate * 60, waiting=len(self._waiters),
+            quota_errors=self.quota_errors, paused_seconds=max(0.0, self._paused_until - time.monotonic()),
+        )
+
+
+_buckets: Dict[str, AdaptiveTokenBucket] = {}
+
+
+def bucket(backend: str) -> Optional[AdaptiveTokenBucket]:
+    """bucket ของ backend (None = ไม่จำกัด rate เมื่อ MODEL_RATE_PER_MINUTE ของ backend นั้น <= 0)"""
+    limiter = _buckets.get(backend)
+    if limiter is None:
+        rate_per_minute = config.MODEL_RATE_PER_MINUTE.get(backend, 0)
+        if rate_per_minute <= 0:
+            return None
+        limiter = _buckets[backend] = AdaptiveTokenBucket(backend, rate_per_minute)
+    return limiter
+
+
+def reset():
+    """ลบ bucket ทั้งหมด (เมื่อ model_loop สร้าง loop ใหม่ future ที่ค้างอยู่ใช้กับ loop ใหม่ไม่ได้)"""
+    _buckets.clear()
+
+
+def snapshot() -> Dict[str, Dict]:
+    return {name: limiter.snapshot() for name, limiter in list(_buckets.items())}
+
+# --- END OF FILE ---
@@ -1,20 +1,31 @@
 # --- START OF FILE: app/services/tts_service.py (เวอร์ชัน Dependency Injection) ---
+import asyncio
 import os
-from google.cloud import texttospeech
+import shutil
+import ffmpeg
 from pathlib import Path
-from typing import Optional, List, Dict
+from typing import TYPE_CHECKING, Optional, List, Dict, Tuple
 from xml.sax.saxutils import escape
 
-# [แก้ไข] สร้างตัวแปร Global ไว้รอรับ Client แต่ยังไม่สร้างมัน
-TTS_CLIENT: Optional[texttospeech.TextToSpeechClient] = None
+from app import config
+from app.services.cache_service import DiskCache
+from app.services import metrics, model_loop, clients
+
+# google.cloud.texttospeech โหลดเมื่อใช้ครั้งแรกเท่านั้น (ดู app/services/clients.py)
+if TYPE_CHECKING:
+    from google.cloud import texttospeech
 
 # [แก้ไข] สร้างฟังก์ชันสำหรับ "รับ" Client จากภายนอก
-def set_tts_client(client: texttospeech.TextToSpeechClient):
-    """ฟังก์ชันนี้จะถูกเรียกโดย main.py ตอน Startup เพื่อตั้งค่า Client"""
-    global TTS_CLIENT
-    TTS_CLIENT = client
+def set_tts_client(client: "texttospeech.TextToSpeechClient"):
+    """ฉีด Client แบบ blocking จากภายนอก (ใช้แทน client แบบ async เมื่อไม่มีใครฉีดตัวนั้นเข้ามา)"""
+    clients.tts.set(client)
     print("✅ TTS Service: Google Cloud Client has been successfully injected.")
 
+# ค่าเริ่มต้นใช้ client แบบ async (gRPC aio) ที่ clients.tts_async สร้างบน loop กลางของ model_loop
+def set_tts_async_client(client: "texttospeech.TextToSpeechAsyncClient"):
+    clients.tts_async.set(client)
+    print("✅ TTS Service: Google Cloud async client has been successfully injected.")
+
 # (ส่วนของ SSML templates และ script_to_ssml เหมือนเดิมทั้งหมด)
 SSML_BREAK = '<break time="700ms"/>'
 EMOTION_SSML_TEMPLATES = {
@@ -27,37 +38,79 @@ EMOTION_SSML_TEMPLATES = {
     "mysterious": f'<prosody rate="slow" volume="medium">%s</prosody>{SSML_BREAK}',
     "default": f'<p>%s</p>{SSML_BREAK}'
 }
+def _line_to_ssml_body(line: Dict[str, str]) -> str:
+    text = escape(line.get("text", ""))
+    emotion = line.get("emotion", "default").lower()
+    template = EMOTION_SSML_TEMPLATES.get(emotion, EMOTION_SSML_TEMPLATES["default"])
+    return template % text + "\n"
+
 def script_to_ssml(script: List[Dict[str, str]]) -> str:
-    ssml_body = ""
-    for line in script:
-        text = escape(line.get("text", ""))
-        emotion = line.get("emotion", "default").lower()
-        template = EMOTION_SSML_TEMPLATES.get(emotion, EMOTION_SSML_TEMPLATES["default"])
-        ssml_body += template % text + "\n"
+    ssml_body = "".join(_line_to_ssml_body(line) for line in script)
     return f'<speak>{ssml_body}</speak>'
 
+def line_to_ssml(line: Dict[str, str]) -> str:
+    """SSML ของบทพูด 1 บรรทัด (ใช้กับโหมดสังเคราะห์เสียงทีละบรรทัด)"""
+    return f'<speak>{_line_to_ssml_body(line)}</speak>'
+
+
+# Cache เสียงพากย์: key = hash(SSML ที่สร้างจาก script_to_ssml, voice_name, encoding)
+# compile ซ้ำโดยที่ script/เสียงเหมือนเดิม (เช่น เปลี่ยนแค่เพลงหรือ transition) จะไม่เรียก TTS อีก
+AUDIO_ENCODING_NAME = "MP3"
+AUDIO_CACHE = DiskCache("tts", max_bytes=config.TTS_CACHE_MAX_BYTES, suffix=".mp3")
+
+def audio_cache_key(ssml_text: str, voice_name: str) -> str:
+    return DiskCache.make_key(ssml_text, voice_name, AUDIO_ENCODING_NAME)
+
+
+async def _synthesize_ssml_async(ssml_text: str, voice_name: str) -> bytes:
+    """เรียก TTS บน loop กลาง (model_loop) ภายใต้ rate limit และ limit ของ backend tts (ลองใหม่เมื่อเจอ quota error)"""
+    # ได้ client ก่อน: การสร้างครั้งแรก (รวมการ import SDK) ทำใน thread แยก ไม่ block loop กลาง
+    use_blocking_client = clients.tts.ready and not clients.tts_async.ready
+    client = clients.tts.get() if use_blocking_client else await clients.tts_async.get_async()
+    from google.cloud import texttospeech
+    synthesis_input = texttospeech.SynthesisInput(ssml=ssml_text)
+    language_code = "-".join(voice_name.split("-")[:2])
+    voice = texttospeech.VoiceSelectionParams(language_code=language_code, name=voice_name)
+    audio_config = texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.MP3)
+    with metrics.timed("story_tts_request_duration_seconds", mode=config.TTS_MODE):
+        if use_blocking_client:
+            response = await model_loop.call(model_loop.TTS, lambda: model_loop.in_executor(
+                model_loop.TTS, client.synthesize_speech, input=synthesis_input, voice=voice, audio_config=audio_config
+            ))
+        else:
+            response = await model_loop.call(model_loop.TTS, lambda: client.synthesize_speech(
+                input=synthesis_input, voice=voice, audio_config=audio_config
+            ))
+    metrics.inc("story_bytes_written_total", len(response.audio_content), kind="voice")
+    return response.audio_content
+
+
+def _synthesize_ssml(ssml_text: str, voice_name: str) -> bytes:
+    return model_loop.run(_synthesize_ssml_async(ssml_text, voice_name))
+
 
 def convert_script_to_speech(script: List[Dict[str, str]], full_output_path: str, voice_name: str = "en-US-Wavenet-C") -> Optional[str]:
     print(f"Google TTS Service: Converting script to speech with voice '{voice_name}'...")
     
-    if not TTS_CLIENT:
-        print("Google TTS Service Error: Client has not been set. Call set_tts_client() during application startup.")
-        return None
+    ssml_text = script_to_ssml(script)
+    cache_key = audio_cache_key(ssml_text, voice_name)
+    cached_path = AUDIO_CACHE.get(cache_key)
+    if cached_path:
+        output_file = Path(full_output_path)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(cached_path, output_file)
+        print(f"Google TTS Service: Cache hit ({cache_key[:12]}), audio copied to -> {output_file}")
+        return str(output_file)
 
     try:
-        ssml_text = script_to_ssml(script)
-        synthesis_input = texttospeech.SynthesisInput(ssml=ssml_text)
-        language_code = "-".join(voice_name.split("-")[:2])
-        voice = texttospeech.VoiceSelectionParams(language_code=language_code, name=voice_name)
-        audio_config = texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.MP3)
-        
-        response = TTS_CLIENT.synthesize_speech(input=synthesis_input, voice=voice, audio_config=audio_config)
+        audio_content = _synthesize_ssml(ssml_text, voice_name)
         
         output_file = Path(full_output_path)
         output_file.parent.mkdir(parents=True, exist_ok=True)
         with open(output_file, "wb") as out:
-            out.write(response.audio_content)
+            out.write(audio_content)
             print(f"Google TTS Service: Audio content saved to -> {output_file}")
+        AUDIO_CACHE.put_bytes(cache_key, audio_content)
         
         return str(output_file)
 
@@ -65,4 +118,67 @@ def convert_script_to_speech(script: List[Dict[str, str]], full_output_path: str
         print(f"Google TTS Service Error during synthesis: {e}")
         import traceback
         traceback.print_exc()
-        return None
\ No newline at end of file
+        return None
+
+
+async def _line_audio_path(line: Dict[str, str], voice_name: str, semaphore: asyncio.Semaphore) -> Path:
+    """คืนไฟล์เสียงของบรรทัดเดียวจาก cache (สังเคราะห์ใหม่ถ้ายังไม่มี)"""
+    ssml_text = line_to_ssml(line)
+    cache_key = audio_cache_key(ssml_text, voice_name)
+    # อ่าน/เขียนไฟล์และ index ของ cache ใน thread แยก ไม่ block loop กลางที่การเรียก model อื่นใช้อยู่
+    cached_path = await asyncio.to_thread(AUDIO_CACHE.get, cache_key)
+    if cached_path:
+        return cached_path
+    async with semaphore:
+        audio_content = await _synthesize_ssml_async(ssml_text, voice_name)
+    return await asyncio.to_thread(AUDIO_CACHE.put_bytes, cache_key, audio_content)
+
+
+async def _line_audio_paths(script: List[Dict[str, str]], voice_name: str) -> List[Path]:
+    # จำกัดต่อ job ด้วย TTS_LINE_CONCURRENCY (limit รวมทั้ง process อยู่ที่ slot ของ backend tts)
+    semaphore = asyncio.Semaphore(max(1, config.TTS_LINE_CONCURRENCY))
+    return list(await asyncio.gather(*(_line_audio_path(line, voice_name, semaphore) for line in script)))
+
+
+def _probe_duration(file_path: str) -> float:
+    return float(ffmpeg.probe(file_path)['format']['duration'])
+
+
+def convert_script_lines_to_speech(
+    script: List[Dict[str, str]], full_output_path: str, voice_name: str = "en-US-Wavenet-C"
+) -> Optional[Tuple[str, List[float]]]:
+    """
+    สังเคราะห์เสียงทีละบรรทัดของ story_script แบบขนานบน loop กลาง (cache แยกรายบรรทัด)
+    แล้วต่อไฟล์ด้วย concat demuxer ของ ffmpeg โดยไม่ encode ใหม่
+    คืนค่า (path ของไฟล์เสียงรวม, ความยาวของแต่ละบรรทัดเป็นวินาที)
+    """
+    print(f"Google TTS Service: Converting {len(script)} script lines to speech with voice '{voice_name}'...")
+    if not script:
+        return None
+
+    uncached = [line for line in script if not AUDIO_CACHE.path_for(audio_cache_key(line_to_ssml(line), voice_name)).is_file()]
+    try:
+        line_paths = model_loop.run(_line_audio_paths(script, voice_name))
+        print(f"Google TTS Service: {len(script) - len(uncached)}/{len(script)} lines served from cache.")
+
+        output_file = Path(full_output_path)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        concat_list_path = output_file.with_suffix(".concat.txt")
+        with open(concat_list_path, "w", encoding="utf-8") as f:
+            for path in line_paths:
+                f.write(f"file '{Path(path).resolve().as_posix()}'\n")
+        (
+            ffmpeg.input(str(concat_list_path), format='concat', safe=0)
+            .output(str(output_file), c='copy')
+            .overwrite_output()
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+        line_durations = [_probe_duration(str(path)) for path in line_paths]
+        print(f"Google TTS Service: Line audio concatenated to -> {output_file}")
+        return str(output_file), line_durations
+
+    except Exception as e:
+        print(f"Google TTS Service Error during per-line synthesis: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
@@ -0,0 +1,91 @@
+# --- START OF FILE: app/services/upload_service.py ---
+import hashlib
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import List, Dict
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from app import config
+
+# บันทึกไฟล์ที่อัปโหลดลง disk ทีละ chunk
+# - ไม่อ่านทั้งไฟล์เข้า memory และการเขียนไฟล์ทำใน threadpool จึงไม่ block event loop
+# - ตรวจขนาดต่อไฟล์และขนาดรวมต่อ request ระหว่างที่ stream อยู่ (เกินเมื่อไหร่หยุดทันที)
+# - คำนวณ sha256 ไปพร้อมกัน เพื่อตรวจจับไฟล์ที่อัปโหลดซ้ำกัน
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+def _open_for_write(path: Path):
+    return open(path, "wb")
+
+
+async def _stream_to_disk(upload: UploadFile, destination: Path, max_file_bytes: int, remaining_request_bytes: int) -> Dict:
+    digest = hashlib.sha256()
+    size = 0
+    buffer = await run_in_threadpool(_open_for_write, destination)
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_file_bytes:
+                raise UploadTooLargeError(f"File '{upload.filename}' exceeds the {max_file_bytes} byte limit.")
+            if size > remaining_request_bytes:
+                raise UploadTooLargeError(f"Upload exceeds the {config.MAX_UPLOAD_REQUEST_BYTES} byte request limit.")
+            digest.update(chunk)
+            await run_in_threadpool(buffer.write, chunk)
+    finally:
+        await run_in_threadpool(buffer.close)
+    return {"sha256": digest.hexdigest(), "size": size}
+
+
+async def save_uploads(
+    uploads: List[UploadFile],
+    upload_dir: Path,
+    max_file_bytes: int = config.MAX_UPLOAD_FILE_BYTES,
+    max_request_bytes: int = config.MAX_UPLOAD_REQUEST_BYTES,
+) -> List[Dict]:
+    """
+    บันทึกไฟล์ทั้งหมดตามลำดับ คืนค่า list ของ {path, sha256, size, duplicate_of}
+    ไฟล์ที่เนื้อหาซ้ำกับไฟล์ก่อนหน้าใน request เดียวกันจะไม่ถูกเก็บซ้ำ แต่ชี้ไปที่ไฟล์เดิม
+    """
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    saved: List[Dict] = []
+    paths_by_hash: Dict[str, str] = {}
+    total_bytes = 0
+    for index, upload in enumerate(uploads):
+        suffix = Path(upload.filename or "").suffix.lower() or ".png"
+        tmp_path = upload_dir / f".{uuid.uuid4().hex}.part"
+        try:
+            result = await _stream_to_disk(upload, tmp_path, max_file_bytes, max_request_bytes - total_bytes)
+        except Exception:
+            if tmp_path.exists(): tmp_path.unlink()
+            raise
+        finally:
+            await upload.close()
+        total_bytes += result["size"]
+
+        duplicate_of = paths_by_hash.get(result["sha256"])
+        if duplicate_of:
+            tmp_path.unlink()
+            logging.info(f"Upload Service: '{upload.filename}' duplicates an earlier upload ({result['sha256'][:12]}).")
+            file_path = duplicate_of
+        else:
+            file_path = str(upload_dir / f"image_{index}{suffix}")
+            os.replace(tmp_path, file_path)
+            paths_by_hash[result["sha256"]] = file_path
+        saved.append({"path": file_path, "sha256": result["sha256"], "size": result["size"], "duplicate_of": duplicate_of})
+
+    logging.info(f"Upload Service: Saved {len(saved)} files ({total_bytes} bytes) to {upload_dir}.")
+    return saved
+
+# --- END OF FILE ---
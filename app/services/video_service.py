@@ -1,12 +1,18 @@
 # --- START OF FILE: app/services/video_service.py (เวอร์ชันแก้ไขสมบูรณ์) ---
 import ffmpeg
+import io
 import os
 import shutil
 import uuid
 import random
-from typing import List, Optional, Dict
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Dict, Callable
 from pathlib import Path
-from app.services import tts_service
+from PIL import Image, ImageOps
+from app.services import tts_service, music_service, motion_service, metrics
+from app.services.cache_service import DiskCache
 from app import config
 
 
@@ -21,23 +27,47 @@ def format_time(seconds: float) -> str:
     minutes %= 60
     return f"{hours:02d}:{minutes:02d}:{seconds:02d},{millis:03d}"
 
-def create_srt_file_by_word_groups(script: List[Dict[str, str]], voice_duration: float, output_path: str, words_per_chunk: int = 6):
-    if not script: return
-    full_text = " ".join([line.get("text", "") for line in script])
-    all_words = full_text.split()
-    if not all_words: return
-    chunks = [" ".join(all_words[i:i + words_per_chunk]) for i in range(0, len(all_words), words_per_chunk)]
-    duration_per_chunk = voice_duration / len(chunks) if chunks else 0
+def _write_srt(entries: List, output_path: str):
     with open(output_path, "w", encoding="utf-8") as f:
-        for i, chunk_text in enumerate(chunks):
-            start_time = i * duration_per_chunk
-            end_time = start_time + duration_per_chunk
-            if i < len(chunks) - 1: end_time -= 0.1
-            if end_time <= start_time: end_time = start_time + 0.1
+        for i, (start_time, end_time, chunk_text) in enumerate(entries):
             f.write(f"{i + 1}\n")
             f.write(f"{format_time(start_time)} --> {format_time(end_time)}\n")
             f.write(f"{chunk_text}\n\n")
-    print(f"  - Subtitle file created with {len(chunks)} word chunks.")
+
+def _chunk_entries(words: List[str], start: float, duration: float, words_per_chunk: int, is_last_group: bool) -> List:
+    chunks = [" ".join(words[i:i + words_per_chunk]) for i in range(0, len(words), words_per_chunk)]
+    duration_per_chunk = duration / len(chunks) if chunks else 0
+    entries = []
+    for i, chunk_text in enumerate(chunks):
+        start_time = start + i * duration_per_chunk
+        end_time = start_time + duration_per_chunk
+        if i < len(chunks) - 1 or not is_last_group: end_time -= 0.1
+        if end_time <= start_time: end_time = start_time + 0.1
+        entries.append((start_time, end_time, chunk_text))
+    return entries
+
+def create_srt_file_by_word_groups(
+    script: List[Dict[str, str]], voice_duration: float, output_path: str, words_per_chunk: int = 6,
+    line_durations: Optional[List[float]] = None
+):
+    """
+    สร้างซับไตเติลเป็นกลุ่มคำ
+    ถ้ามี line_durations (ความยาวเสียงของแต่ละบรรทัด) จะจัดเวลาซับตามบรรทัดจริง
+    ไม่เช่นนั้นเฉลี่ยคำทั้งหมดให้เท่ากันตลอด voice_duration แบบเดิม
+    """
+    if not script: return
+    if line_durations and len(line_durations) == len(script):
+        entries, line_start = [], 0.0
+        for i, (line, line_duration) in enumerate(zip(script, line_durations)):
+            words = line.get("text", "").split()
+            entries += _chunk_entries(words, line_start, line_duration, words_per_chunk, i == len(script) - 1)
+            line_start += line_duration
+    else:
+        full_text = " ".join([line.get("text", "") for line in script])
+        entries = _chunk_entries(full_text.split(), 0.0, voice_duration, words_per_chunk, True)
+    if not entries: return
+    _write_srt(entries, output_path)
+    print(f"  - Subtitle file created with {len(entries)} word chunks.")
 
 def get_audio_duration(file_path: str) -> float:
     try:
@@ -47,119 +77,552 @@ def get_audio_duration(file_path: str) -> float:
         print(f"Error probing audio duration for {file_path}: {e.stderr.decode()}")
         return 0
 
-# --- [การแก้ไขจุดที่ 1: เปลี่ยนพารามิเตอร์] ---
+# --- โหมดการ Render ---
+# single_pass: video chain (zoompan/xfade/subtitles) + audio chain (voice+music amix) อยู่ใน ffmpeg ครั้งเดียว เขียน MP4 ตรงๆ
+# three_stage: แบบเดิม silent_video.mp4 -> final_audio.aac -> remux (เก็บไว้เทียบ wall time / disk I/O)
+# segmented: encode แต่ละฉากแยกกันพร้อมกันหลาย core แล้วต่อด้วย xfade รอบสุดท้าย
+# numpy: สร้างเฟรม Ken Burns + transition ใน Python (motion_service) แล้วส่ง raw video เข้า ffmpeg encoder ตัวเดียว
+RENDER_MODE_SINGLE_PASS = "single_pass"
+RENDER_MODE_THREE_STAGE = "three_stage"
+RENDER_MODE_SEGMENTED = "segmented"
+RENDER_MODE_NUMPY = "numpy"
+RENDER_MODES = (RENDER_MODE_SINGLE_PASS, RENDER_MODE_THREE_STAGE, RENDER_MODE_SEGMENTED, RENDER_MODE_NUMPY)
+
+SUBTITLE_STYLE = 'FontName=Arial,FontSize=24,PrimaryColour=&HFFFFFF,BorderStyle=1,OutlineColour=&H000000,Outline=1,Shadow=0.5,Alignment=2'
+
+zoom_pan_effects = [
+    {'name': 'zoom_in', 'z': 'min(zoom+0.0015,1.2)', 'x': 'iw/2-(iw/zoom/2)', 'y': 'ih/2-(ih/zoom/2)'},
+    {'name': 'zoom_out', 'z': '1.2-0.0015*on', 'x': 'iw/2-(iw/zoom/2)', 'y': 'ih/2-(ih/zoom/2)'},
+    {'name': 'pan_top_left', 'z': '1.2', 'x': '0', 'y': '0'},
+    {'name': 'pan_bottom_right', 'z': '1.2', 'x': 'iw-iw/zoom', 'y': 'ih-ih/zoom'},
+]
+
+def durations_per_image(voice_duration: float, image_count: int, line_durations: Optional[List[float]] = None) -> List[float]:
+    """
+    เวลาที่แต่ละภาพอยู่บนจอ
+    - ถ้ารู้ความยาวเสียงรายบรรทัด: ภาพแต่ละภาพยาวเท่ากับบรรทัดของมันพอดี
+      (ถ้าบรรทัดมากกว่าภาพ จะแบ่งบรรทัดเป็นกลุ่มต่อเนื่องตามลำดับ)
+    - ไม่เช่นนั้นเฉลี่ย voice_duration ให้ทุกภาพเท่ากันแบบเดิม
+    """
+    if image_count <= 0: return []
+    if line_durations and len(line_durations) >= image_count:
+        durations = [0.0] * image_count
+        for j, line_duration in enumerate(line_durations):
+            durations[j * image_count // len(line_durations)] += line_duration
+        return durations
+    return [voice_duration / image_count] * image_count
+
+def pick_zoom_pan_effects(count: int, seed: Optional[int] = None) -> List[Dict[str, str]]:
+    """สุ่ม effect ของแต่ละภาพ ถ้าให้ seed มา ผลจะเหมือนเดิมทุกครั้ง"""
+    rng = random.Random(seed)
+    return [rng.choice(zoom_pan_effects) for _ in range(count)]
+
+def render_cache_key(
+    script: List[Dict[str, str]], image_paths: List[str], voice_name: str, music_filename: str,
+    music_volume: float, aspect_ratio: str, transition_style: str
+) -> str:
+    """
+    key ของ compile หนึ่งครั้ง: script, เนื้อหาภาพ (hash), เสียง, เพลง, ระดับเสียงเพลง, สัดส่วนภาพ, transition
+    รวมถึงค่าตั้งค่าที่เปลี่ยนผลลัพธ์ (fps, โหมด TTS, การใช้ motion engine แบบ numpy) ด้วย
+    (seed ของ effect มาจาก key นี้ จึงไม่รวมโปรไฟล์ encoder: ทุกโปรไฟล์ได้ภาพเคลื่อนไหวแบบเดียวกัน ดู render_output_key)
+    """
+    image_hashes = [DiskCache.hash_file(path) for path in image_paths]
+    return DiskCache.make_key(
+        "render-v3", script, image_hashes, voice_name, music_filename, float(music_volume),
+        aspect_ratio, transition_style, config.VIDEO_FPS, config.TTS_MODE, config.VIDEO_RENDER_MODE == RENDER_MODE_NUMPY
+    )
+
+def render_output_key(content_key: str, encoder_profile: str) -> str:
+    """key ของไฟล์ใน RENDER_CACHE: เนื้อหาเดียวกันแต่ encode ต่างโปรไฟล์เป็นคนละไฟล์"""
+    return DiskCache.make_key(content_key, encoder_profile)
+
+def seed_from_key(cache_key: str) -> int:
+    return int(cache_key[:16], 16)
+
+# Cache ของวิดีโอที่ render เสร็จแล้ว (key จาก render_cache_key)
+RENDER_CACHE = DiskCache("renders", max_bytes=config.RENDER_CACHE_MAX_BYTES, suffix=".mp4")
+
+def get_video_size(aspect_ratio: str):
+    if aspect_ratio == "9:16": return 720, 1280
+    elif aspect_ratio == "1:1": return 1080, 1080
+    else: return 1280, 720
+
+TRANSITION_DURATION = 1.0
+
+# --- โปรไฟล์การ encode ตามปลายทางของวิดีโอ ---
+# draft: เร็วที่สุด (ค่าเดิมก่อนมีโปรไฟล์) ไฟล์ใหญ่ | social: สมดุลขนาด/เวลา สำหรับอัปโหลด | archive: คุณภาพสูง ช้า
+# gop_seconds: ระยะห่าง keyframe, threads: None = แบ่ง core ตามจำนวน render พร้อมกัน (config.CPU_WORKERS)
+ENCODER_PROFILES = {
+    "draft": {"preset": "ultrafast", "crf": 23, "tune": None, "gop_seconds": 10, "threads": None, "audio_bitrate": "128k"},
+    "social": {"preset": "veryfast", "crf": 23, "tune": "film", "gop_seconds": 2, "threads": None, "audio_bitrate": "128k"},
+    "archive": {"preset": "slow", "crf": 18, "tune": "film", "gop_seconds": 5, "threads": None, "audio_bitrate": "192k"},
+}
+# เลือกโปรไฟล์ตามความยาวคิว (ดู choose_encoder_profile)
+ENCODER_PROFILE_ADAPTIVE = "adaptive"
+ENCODER_PROFILE_NAMES = tuple(ENCODER_PROFILES) + (ENCODER_PROFILE_ADAPTIVE,)
+
+def _validate_encoder_settings():
+    # ตรวจค่าจาก env ตั้งแต่ตอน import ไม่ให้ไปพังตอน render งานแรก (ชื่อที่มาจาก request ตรวจใน endpoint)
+    if config.ENCODER_PROFILE not in ENCODER_PROFILE_NAMES:
+        raise ValueError(f"Unknown ENCODER_PROFILE '{config.ENCODER_PROFILE}'. Available: {', '.join(ENCODER_PROFILE_NAMES)}")
+    if config.ENCODER_ADAPTIVE_PROFILE not in ENCODER_PROFILES:
+        raise ValueError(
+            f"Unknown ENCODER_ADAPTIVE_PROFILE '{config.ENCODER_ADAPTIVE_PROFILE}'. Available: {', '.join(ENCODER_PROFILES)}"
+        )
+
+_validate_encoder_settings()
+
+def choose_encoder_profile(name: Optional[str], queue_depth: int = 0) -> str:
+    """แปลงชื่อที่ขอมา (รวมถึง "adaptive") เป็นชื่อโปรไฟล์จริง คิวยาวเกิน ENCODER_ADAPTIVE_DRAFT_DEPTH -> draft"""
+    name = name or config.ENCODER_PROFILE
+    if name not in ENCODER_PROFILE_NAMES: raise ValueError(f"Unknown encoder profile: {name}")
+    if name != ENCODER_PROFILE_ADAPTIVE: return name
+    return "draft" if queue_depth >= config.ENCODER_ADAPTIVE_DRAFT_DEPTH else config.ENCODER_ADAPTIVE_PROFILE
+
+def encoder_threads(profile: Dict) -> int:
+    # กำหนด threads ชัดเจน ไม่ให้ libx264 ของหลาย render พร้อมกันแย่ง core เกินจำนวนจริง
+    return profile.get("threads") or max(1, (os.cpu_count() or 1) // max(1, config.CPU_WORKERS))
+
+def _video_encode_args(profile: Dict) -> Dict:
+    args = dict(
+        vcodec='libx264', pix_fmt='yuv420p', preset=profile["preset"], crf=profile["crf"],
+        g=int(profile["gop_seconds"] * config.VIDEO_FPS), threads=encoder_threads(profile)
+    )
+    if profile.get("tune"): args["tune"] = profile["tune"]
+    return args
+
+def _audio_encode_args(profile: Dict) -> Dict:
+    return dict(acodec='aac', audio_bitrate=profile["audio_bitrate"])
+
+def _run_ffmpeg(stream_spec, total_seconds: Optional[float] = None, on_progress: Optional[Callable[[int], None]] = None):
+    """
+    รัน ffmpeg ถ้ามี on_progress จะเปิด -progress pipe:1 แล้วรายงานเปอร์เซ็นต์ (เทียบกับ total_seconds)
+    """
+    stream_spec = stream_spec.overwrite_output()
+    with metrics.in_progress("story_ffmpeg_processes"):
+        if not on_progress or not total_seconds:
+            stream_spec.run(capture_stdout=True, capture_stderr=True)
+            return
+        process = stream_spec.global_args('-progress', 'pipe:1', '-nostats').run_async(pipe_stdout=True, pipe_stderr=True)
+        _follow_progress(process, total_seconds, on_progress)
+
+def _follow_progress(process, total_seconds: float, on_progress: Callable[[int], None]):
+    """อ่าน -progress ของ ffmpeg ที่รันอยู่จนจบ แล้วรายงานเปอร์เซ็นต์"""
+    # อ่าน stderr ใน thread แยก ไม่ให้ pipe เต็มจน ffmpeg ค้าง
+    stderr_chunks = []
+    stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+    stderr_reader.start()
+
+    last_percent = -1
+    for raw_line in process.stdout:
+        key, _, value = raw_line.decode('utf-8', errors='ignore').strip().partition('=')
+        # out_time_ms ของ ffmpeg เป็นหน่วย microsecond เหมือน out_time_us
+        if key not in ('out_time_us', 'out_time_ms'): continue
+        try:
+            seconds = int(value) / 1_000_000
+        except ValueError:
+            continue
+        percent = max(0, min(99, int(seconds / total_seconds * 100)))
+        if percent > last_percent:
+            last_percent = percent
+            on_progress(percent)
+
+    process.wait()
+    stderr_reader.join()
+    if process.returncode != 0:
+        raise ffmpeg.Error('ffmpeg', b'', b"".join(stderr_chunks))
+    on_progress(100)
+
+def clip_durations(screen_durations: List[float], transition_duration: float = TRANSITION_DURATION) -> List[float]:
+    """
+    ความยาวของแต่ละ clip ที่ต้อง render จากเวลาที่ภาพอยู่บนจอ (durations_per_image)
+    ทุก clip ยกเว้น clip สุดท้ายยาวขึ้น transition_duration เพื่อซ้อนกับ clip ถัดไปใน xfade
+    ภาพที่ i จึงเริ่มที่ sum(screen_durations[:i]) พอดีกับเสียงบรรยายของมัน และวิดีโอยาวเท่ากับเสียงพากย์
+    """
+    if not screen_durations: return []
+    return [duration + transition_duration for duration in screen_durations[:-1]] + [screen_durations[-1]]
+
+def get_video_length(durations: List[float], transition_duration: float = TRANSITION_DURATION) -> float:
+    """ความยาววิดีโอหลังต่อด้วย xfade (แต่ละรอยต่อซ้อนกัน transition_duration วินาที)"""
+    return sum(durations) - transition_duration * max(0, len(durations) - 1)
+
+# --- ขั้นตอน normalize ภาพ: ย่อ/crop ภาพครั้งเดียวเป็นขนาดที่ใช้ทำ Ken Burns แทนการ scale ทุกเฟรมใน ffmpeg ---
+ZOOM_PAN_HEADROOM = 1.2
+# ภาพที่ normalize แล้ว key = (hash ของภาพต้นฉบับ, ขนาดปลายทาง) ใช้ซ้ำได้ข้าม job (เช่น retry หรือ compile ใหม่)
+FRAME_CACHE = DiskCache("frames", max_bytes=config.FRAME_CACHE_MAX_BYTES, suffix=".png")
+
+def working_frame_size(video_width: int, video_height: int):
+    """ขนาดภาพก่อนเข้า zoompan (ใหญ่กว่าวิดีโอ 1.2 เท่า เผื่อพื้นที่ให้ซูม/แพน)"""
+    return int(video_width * ZOOM_PAN_HEADROOM), int(video_height * ZOOM_PAN_HEADROOM)
+
+def _normalize_image(image_path: str, target_w: int, target_h: int) -> str:
+    cache_key = DiskCache.make_key("frame-v1", DiskCache.hash_file(image_path), target_w, target_h)
+    cached_path = FRAME_CACHE.get(cache_key)
+    if cached_path: return str(cached_path)
+    with Image.open(image_path) as image:
+        # scale ให้เต็มกรอบแล้ว crop ตรงกลาง เหมือน scale+crop เดิมใน ffmpeg
+        frame = ImageOps.fit(image.convert("RGB"), (target_w, target_h), method=Image.LANCZOS)
+    buffer = io.BytesIO()
+    frame.save(buffer, format="PNG", compress_level=1)
+    metrics.inc("story_bytes_written_total", buffer.tell(), kind="frame")
+    return str(FRAME_CACHE.put_bytes(cache_key, buffer.getvalue()))
+
+def normalize_images(image_paths: List[str], aspect_ratio: str) -> List[str]:
+    """ย่อ/crop ทุกภาพเป็นขนาด working frame แบบขนาน (cache ตาม hash ของภาพและสัดส่วน) คืน path ตามลำดับเดิม"""
+    target_w, target_h = working_frame_size(*get_video_size(aspect_ratio))
+    workers = max(1, min(len(image_paths), config.IMAGE_NORMALIZE_WORKERS))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        frame_paths = list(pool.map(lambda path: _normalize_image(path, target_w, target_h), image_paths))
+    print(f"  - Normalized {len(frame_paths)} images to {target_w}x{target_h}.")
+    return frame_paths
+
+def build_animated_clip(frame_path: str, duration: float, video_width: int, video_height: int, effect: Dict[str, str]):
+    """ภาพที่ normalize แล้ว (ดู normalize_images) -> zoompan (Ken Burns) ยาว duration วินาที"""
+    clip = ffmpeg.input(frame_path, loop=1, t=duration, framerate=config.VIDEO_FPS)
+    return clip.filter(
+        'zoompan', z=effect['z'], x=effect['x'], y=effect['y'],
+        d=int(duration * config.VIDEO_FPS), s=f'{video_width}x{video_height}', fps=config.VIDEO_FPS
+    )
+
+def burn_subtitles(video_stream, srt_path: Optional[Path]):
+    if srt_path and srt_path.is_file():
+        return video_stream.filter('subtitles', filename=str(srt_path).replace('\\', '/'), force_style=SUBTITLE_STYLE)
+    return video_stream
+
+def join_clips_with_transitions(
+    clips: list, durations: List[float], transition_style: str,
+    srt_path: Optional[Path] = None, transition_duration: float = TRANSITION_DURATION
+):
+    """
+    ต่อ clip ด้วย xfade แล้วฝังซับไตเติล (durations คือความยาวของแต่ละ clip รวมช่วงที่ซ้อนกับ clip ถัดไป ดู clip_durations)
+    clip ที่ i เริ่มที่ sum(durations[:i]) - transition_duration * i
+    """
+    if not clips: raise ValueError("No animated clips to process.")
+
+    video_stream = clips[0]
+    if len(clips) > 1:
+        for i in range(1, len(clips)):
+            offset = sum(durations[:i]) - transition_duration * i
+            video_stream = ffmpeg.filter([video_stream, clips[i]], 'xfade', transition=transition_style, duration=transition_duration, offset=offset)
+
+    video_stream = burn_subtitles(video_stream, srt_path)
+    return video_stream
+
+def build_visual_stream(
+    image_paths: List[str], durations: List[float], video_width: int, video_height: int,
+    transition_style: str, srt_path: Optional[Path] = None, effects: Optional[List[Dict[str, str]]] = None
+):
+    """สร้าง video chain ทั้งหมดใน graph เดียว: zoompan -> xfade -> subtitles (image_paths ต้อง normalize แล้ว)"""
+    effects = effects or pick_zoom_pan_effects(len(image_paths))
+    animated_clips = [
+        build_animated_clip(image_path, durations[i], video_width, video_height, effects[i])
+        for i, image_path in enumerate(image_paths)
+    ]
+    return join_clips_with_transitions(animated_clips, durations, transition_style, srt_path=srt_path)
+
+def prepare_audio_track(voice_track: Dict, music_filename: str, music_volume: float, output_path: str) -> str:
+    """
+    เสียงพากย์ที่ผสมเพลงประกอบแล้ว (ผสมด้วย numpy จากเพลงที่ decode ไว้ล่วงหน้าใน music_service)
+    ffmpeg รอบ render จึงไม่ต้อง decode เพลงหรือรัน atrim/amix อีก ถ้าไม่ใช้เพลงคืนไฟล์เสียงพากย์เดิม
+    """
+    if music_service.resolve_track(music_filename) is None:
+        return voice_track["path"]
+    print(f"  - Mixing voice with music '{music_filename}' at volume {music_volume}...")
+    return music_service.mix_with_voice(voice_track["path"], music_filename, music_volume, output_path)
+
+def build_audio_stream(audio_path: str):
+    """audio chain ของการ render: ไฟล์เสียงที่ผสมเสร็จแล้วจาก prepare_audio_track"""
+    return ffmpeg.input(str(audio_path)).audio
+
+def _render_three_stage(
+    video_stream, audio_stream, temp_dir: Path, output_path: Path, total_seconds: float = None, on_progress=None,
+    profile: Optional[Dict] = None
+) -> int:
+    """แบบเดิม: encode ภาพ -> encode เสียง -> remux คืนค่าจำนวน byte ของไฟล์ชั่วคราวที่เขียนลง disk"""
+    profile = profile or ENCODER_PROFILES["draft"]
+    silent_video_path = str(temp_dir / "silent_video.mp4")
+    _run_ffmpeg(
+        ffmpeg.output(video_stream, silent_video_path, **_video_encode_args(profile)),
+        total_seconds, on_progress
+    )
+    print(f"  - Silent video with visuals created at '{silent_video_path}'")
+
+    final_audio_path = str(temp_dir / "final_audio.aac")
+    _run_ffmpeg(ffmpeg.output(audio_stream, final_audio_path, **_audio_encode_args(profile)))
+    print(f"  - Final audio track created at '{final_audio_path}'")
+
+    final_video_input = ffmpeg.input(silent_video_path)
+    final_audio_input = ffmpeg.input(final_audio_path)
+    _run_ffmpeg(ffmpeg.output(
+        final_video_input.video, final_audio_input.audio, str(output_path),
+        vcodec='copy', acodec='copy', shortest=None
+    ))
+    return os.path.getsize(silent_video_path) + os.path.getsize(final_audio_path)
+
+def _render_single_pass(
+    video_stream, audio_stream, output_path: Path, total_seconds: float = None, on_progress=None,
+    profile: Optional[Dict] = None
+) -> int:
+    """ffmpeg ครั้งเดียว: video chain + audio chain -> MP4 ปลายทาง ไม่มีไฟล์ชั่วคราว"""
+    profile = profile or ENCODER_PROFILES["draft"]
+    _run_ffmpeg(ffmpeg.output(
+        video_stream, audio_stream, str(output_path),
+        **_video_encode_args(profile), **_audio_encode_args(profile), shortest=None
+    ), total_seconds, on_progress)
+    return 0
+
+def _encode_segment(image_path: str, duration: float, video_width: int, video_height: int, effect: Dict[str, str], segment_path: str, threads: int) -> str:
+    """encode ฉากเดียวเป็นไฟล์ segment (รันใน pool พร้อมกันหลายฉาก)"""
+    clip = build_animated_clip(image_path, duration, video_width, video_height, effect)
+    _run_ffmpeg(ffmpeg.output(
+        clip, segment_path, vcodec='libx264', pix_fmt='yuv420p', preset='ultrafast',
+        crf=config.SEGMENT_CRF, threads=threads
+    ))
+    return segment_path
+
+def _render_segmented(
+    image_paths: List[str], durations: List[float], video_width: int, video_height: int,
+    transition_style: str, srt_path: Optional[Path], audio_stream, temp_dir: Path, output_path: Path,
+    effects: List[Dict[str, str]], on_progress=None, profile: Optional[Dict] = None
+) -> int:
+    """
+    แยก encode แต่ละฉาก (zoompan ซึ่งเป็นส่วนที่หนักที่สุด) พร้อมกันใน pool
+    แต่ละ segment ยาวเท่ากับเวลาของฉากนั้น ซึ่งรวมช่วงที่ซ้อนกับฉากถัดไปสำหรับ xfade อยู่แล้ว
+    จากนั้นค่อยต่อ segment ด้วย xfade + ฝังซับ + ใส่เสียง ใน ffmpeg รอบสุดท้ายรอบเดียว
+    """
+    workers = max(1, min(len(image_paths), config.RENDER_SEGMENT_WORKERS))
+    threads_per_segment = max(1, (os.cpu_count() or 1) // workers)
+    segment_paths = [str(temp_dir / f"segment_{i:03d}.mp4") for i in range(len(image_paths))]
+
+    # งานจริงอยู่ใน process ของ ffmpeg แต่ละตัว thread ในนี้แค่รอ process ลูก
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                _encode_segment, image_path, durations[i], video_width, video_height,
+                effects[i], segment_paths[i], threads_per_segment
+            )
+            for i, image_path in enumerate(image_paths)
+        ]
+        for future in futures: future.result()
+    print(f"  - Encoded {len(segment_paths)} segments in parallel ({workers} workers).")
+
+    segment_clips = [ffmpeg.input(path).video for path in segment_paths]
+    video_stream = join_clips_with_transitions(segment_clips, durations, transition_style, srt_path=srt_path)
+    _render_single_pass(video_stream, audio_stream, output_path, get_video_length(durations), on_progress, profile)
+    return sum(os.path.getsize(path) for path in segment_paths)
+
+def _render_numpy(
+    frame_paths: List[str], durations: List[float], video_width: int, video_height: int,
+    transition_style: str, srt_path: Optional[Path], audio_stream, output_path: Path,
+    effects: List[Dict[str, str]], on_progress=None, profile: Optional[Dict] = None
+) -> int:
+    """
+    เฟรมทั้งหมดมาจาก motion_service (numpy) ส่งเป็น rawvideo ทาง stdin ให้ ffmpeg ตัวเดียว
+    ffmpeg เหลือแค่ฝังซับ + encode + ใส่เสียง ไม่มี zoompan/xfade ใน graph
+    """
+    frame_input = ffmpeg.input(
+        'pipe:', format='rawvideo', pix_fmt='rgb24', s=f'{video_width}x{video_height}', framerate=config.VIDEO_FPS
+    )
+    video_stream = frame_input.video
+    video_stream = burn_subtitles(video_stream, srt_path)
+    process = (
+        ffmpeg.output(
+            video_stream, audio_stream, str(output_path),
+            **_video_encode_args(profile or ENCODER_PROFILES["draft"]),
+            **_audio_encode_args(profile or ENCODER_PROFILES["draft"]), shortest=None
+        )
+        .overwrite_output()
+        .run_async(pipe_stdin=True, pipe_stderr=True)
+    )
+    stderr_chunks = []
+    stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+    stderr_reader.start()
+
+    total_frames = max(1, int(round(get_video_length(durations) * config.VIDEO_FPS)))
+    last_percent = -1
+    try:
+        frames = motion_service.video_frames(
+            frame_paths, durations, motion_service.effect_names(effects), video_width, video_height,
+            transition_style, TRANSITION_DURATION
+        )
+        for written, frame in enumerate(frames, start=1):
+            process.stdin.write(frame.tobytes())
+            percent = min(99, written * 100 // total_frames)
+            if on_progress and percent > last_percent:
+                last_percent = percent
+                on_progress(percent)
+    except BrokenPipeError:
+        pass  # ffmpeg ปิดไปก่อน (เช่น error หรือ shortest ตัดจบ) ดู returncode ด้านล่าง
+    except BaseException:
+        # สร้างเฟรมไม่สำเร็จ: ถ้าแค่ปิด stdin ffmpeg จะถือว่าจบแล้วเขียน MP4 ที่สั้นกว่าจริงไว้ที่ output_path
+        process.kill()
+        process.wait()
+        stderr_reader.join()
+        output_path.unlink(missing_ok=True)
+        raise
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+    process.wait()
+    stderr_reader.join()
+    if process.returncode != 0:
+        raise ffmpeg.Error('ffmpeg', b'', b"".join(stderr_chunks))
+    if on_progress: on_progress(100)
+    return 0
+
+# --- ขั้นตอนเตรียม input ของการ render (แยกกันเพื่อให้ pipeline รันพร้อมกับการสร้างภาพได้) ---
+def synthesize_voice_track(script: List[Dict[str, str]], voice_name: str, output_path: str) -> Dict:
+    """
+    สร้างเสียงพากย์ของทั้งเรื่อง (ขึ้นกับ script อย่างเดียว ไม่ต้องรอภาพ)
+    คืน dict: path, duration, line_durations (None ถ้าไม่ได้ใช้โหมด per_line)
+    """
+    print(f"  - Synthesizing voice track (TTS mode: {config.TTS_MODE})...")
+    line_durations = None
+    if config.TTS_MODE == "per_line":
+        tts_result = tts_service.convert_script_lines_to_speech(script, output_path, voice_name)
+        voice_audio_path, line_durations = tts_result if tts_result else (None, None)
+    else:
+        voice_audio_path = tts_service.convert_script_to_speech(script, output_path, voice_name)
+    if not voice_audio_path: raise Exception("Failed to create voice audio file.")
+    voice_duration = get_audio_duration(voice_audio_path)
+    if voice_duration <= 0: raise ValueError("Invalid voice audio duration.")
+    return {"path": voice_audio_path, "duration": voice_duration, "line_durations": line_durations}
+
+def write_subtitles(script: List[Dict[str, str]], voice_track: Dict, output_path: str) -> Optional[str]:
+    """สร้างไฟล์ซับไตเติลจาก script และเวลาของเสียงพากย์ คืน None ถ้าไม่มีข้อความ"""
+    create_srt_file_by_word_groups(
+        script, voice_track["duration"], output_path, line_durations=voice_track.get("line_durations")
+    )
+    return output_path if os.path.isfile(output_path) else None
+
+def render_prepared_video(
+    image_paths: List[str],
+    voice_track: Dict,
+    srt_path: Optional[str],
+    audio_path: str,
+    aspect_ratio: str,
+    transition_style: str,
+    output_filename: str,
+    temp_dir: Path,
+    seed: Optional[int] = None,
+    render_mode: Optional[str] = None,
+    on_progress: Optional[Callable[[int], None]] = None,
+    frame_paths: Optional[List[str]] = None,
+    encoder_profile: Optional[str] = None
+) -> str:
+    """
+    render วิดีโอจาก input ที่เตรียมไว้แล้ว (เสียงพากย์, ซับไตเติล, เสียงที่ผสมเพลงแล้ว) ไฟล์ชั่วคราวเขียนลง temp_dir
+    frame_paths คือภาพที่ normalize แล้ว (ถ้าไม่ส่งมาจะ normalize image_paths ให้ก่อน)
+    encoder_profile คือชื่อใน ENCODER_PROFILES ("adaptive" ที่ไม่ได้แปลงมาก่อนจะถือว่าคิวว่าง)
+    """
+    render_mode = render_mode or config.VIDEO_RENDER_MODE
+    if render_mode not in RENDER_MODES: raise ValueError(f"Unknown render mode: {render_mode}")
+    output_path = config.CONTENT_DIR / output_filename
+    # render ลงชื่อชั่วคราวแล้วค่อย os.replace เข้าที่: output_path อาจเป็น hardlink ของไฟล์ใน RENDER_CACHE
+    # (cache hit ครั้งก่อน) ถ้า ffmpeg เขียนทับชื่อนั้นตรงๆ จะไปแก้ไฟล์ใน cache ด้วย
+    render_path = output_path.with_name(f".{output_path.stem}.{uuid.uuid4().hex[:8]}{output_path.suffix}")
+    try:
+        print(f"  - Preparing Ken Burns & Transitions...")
+        video_width, video_height = get_video_size(aspect_ratio)
+        voice_duration = voice_track["duration"]
+        image_durations = clip_durations(
+            durations_per_image(voice_duration, len(image_paths), voice_track.get("line_durations"))
+        )
+        effects = pick_zoom_pan_effects(len(image_paths), seed)
+        srt_path = Path(srt_path) if srt_path else None
+        image_paths = frame_paths or normalize_images(image_paths, aspect_ratio)
+        profile_name = choose_encoder_profile(encoder_profile)
+        profile = ENCODER_PROFILES[profile_name]
+
+        print("  - Building audio graph...")
+        audio_stream = build_audio_stream(audio_path)
+
+        print(f"  - Rendering ({render_mode}, encoder profile: {profile_name})...")
+        render_started = time.monotonic()
+        if render_mode == RENDER_MODE_NUMPY:
+            with metrics.in_progress("story_ffmpeg_processes"):
+                intermediate_bytes = _render_numpy(
+                    image_paths, image_durations, video_width, video_height, transition_style,
+                    srt_path, audio_stream, render_path, effects, on_progress=on_progress, profile=profile
+                )
+        elif render_mode == RENDER_MODE_SEGMENTED:
+            intermediate_bytes = _render_segmented(
+                image_paths, image_durations, video_width, video_height, transition_style,
+                srt_path, audio_stream, temp_dir, render_path, effects, on_progress=on_progress, profile=profile
+            )
+        else:
+            video_stream = build_visual_stream(
+                image_paths, image_durations, video_width, video_height, transition_style,
+                srt_path=srt_path, effects=effects
+            )
+            video_length = get_video_length(image_durations)
+            if render_mode == RENDER_MODE_THREE_STAGE:
+                intermediate_bytes = _render_three_stage(video_stream, audio_stream, temp_dir, render_path, video_length, on_progress, profile)
+            else:
+                intermediate_bytes = _render_single_pass(video_stream, audio_stream, render_path, video_length, on_progress, profile)
+        render_seconds = time.monotonic() - render_started
+        os.replace(render_path, output_path)
+        metrics.observe("story_render_duration_seconds", render_seconds, mode=render_mode, profile=profile_name)
+        metrics.inc("story_bytes_written_total", os.path.getsize(output_path), kind="video")
+        metrics.inc("story_bytes_written_total", intermediate_bytes, kind="intermediate")
+        print(
+            f"  - Render stats [{render_mode}]: wall={render_seconds:.2f}s, "
+            f"intermediate_bytes={intermediate_bytes}, output_bytes={os.path.getsize(output_path)}"
+        )
+        print(f"Video Service: Video created successfully at -> {output_path}")
+        return str(output_path)
+
+    except ffmpeg.Error as e:
+        stderr = e.stderr.decode('utf-8') if e.stderr else "No stderr output."
+        print(f"--- FFmpeg Error ---\n{stderr}")
+        raise e
+    finally:
+        render_path.unlink(missing_ok=True)
+
 def create_video_with_music(
     script: List[Dict[str, str]],
     image_paths: List[str],
     voice_name: str,
-    music_filename: str, # <--- เปลี่ยนจาก music_style
+    music_filename: str,
     aspect_ratio: str,
     music_volume: float,
     transition_style: str,
-    output_filename: str
+    output_filename: str,
+    render_mode: Optional[str] = None,
+    on_progress: Optional[Callable[[int], None]] = None,
+    seed: Optional[int] = None,
+    encoder_profile: Optional[str] = None
 ) -> Optional[str]:
-# -----------------------------------------------
-    print("Video Service: Creating final video...")
+    """
+    ทำทุกขั้นตอนต่อกันตามลำดับ: เสียงพากย์ -> ซับไตเติล + ผสมเพลง -> render
+    seed กำหนด effect ของแต่ละภาพ ถ้าไม่ส่งมาจะคำนวณจาก input ทั้งหมด (input เดิม -> วิดีโอเดิมทุกครั้ง)
+    """
+    print(f"Video Service: Creating final video (render mode: {render_mode or config.VIDEO_RENDER_MODE})...")
     if not image_paths or not script: return None
 
     temp_dir = config.CONTENT_DIR / f"temp_{os.path.splitext(output_filename)[0]}"
     temp_dir.mkdir(exist_ok=True, parents=True)
 
     try:
-        print("  - Step 1: Synthesizing voice track...")
-        voice_audio_path = tts_service.convert_script_to_speech(script, str(temp_dir / "voice.mp3"), voice_name)
-        if not voice_audio_path: raise Exception("Failed to create voice audio file.")
-        voice_duration = get_audio_duration(voice_audio_path)
-        if voice_duration <= 0: raise ValueError("Invalid voice audio duration.")
-
-        print(f"  - Step 2: Preparing silent video with Ken Burns & Transitions...")
-        if aspect_ratio == "9:16": VIDEO_WIDTH, VIDEO_HEIGHT = 720, 1280
-        elif aspect_ratio == "1:1": VIDEO_WIDTH, VIDEO_HEIGHT = 1080, 1080
-        else: VIDEO_WIDTH, VIDEO_HEIGHT = 1280, 720
-        duration_per_image = voice_duration / len(image_paths) if len(image_paths) > 0 else 0
-        transition_duration = 1.0
-
-        zoom_pan_effects = [
-            {'z': 'min(zoom+0.0015,1.2)', 'x': 'iw/2-(iw/zoom/2)', 'y': 'ih/2-(ih/zoom/2)'},
-            {'z': '1.2-0.0015*on', 'x': 'iw/2-(iw/zoom/2)', 'y': 'ih/2-(ih/zoom/2)'},
-            {'z': '1.2', 'x': '0', 'y': '0'},
-            {'z': '1.2', 'x': 'iw-iw/zoom', 'y': 'ih-ih/zoom'},
-        ]
-        
-        animated_clips = []
-        for i, image_path in enumerate(image_paths):
-            clip = ffmpeg.input(image_path, loop=1, t=duration_per_image, framerate=config.VIDEO_FPS)
-            
-            initial_scale = 1.2
-            target_w, target_h = int(VIDEO_WIDTH * initial_scale), int(VIDEO_HEIGHT * initial_scale)
-
-            scaled_clip = clip.filter(
-                'scale', 
-                w=f"if(gte(iw/ih,{target_w}/{target_h}),-1,{target_w})", 
-                h=f"if(gte(iw/ih,{target_w}/{target_h}),{target_h},-1)"
-            ).filter(
-                'crop', w=target_w, h=target_h
-            )
-            
-            selected_effect = random.choice(zoom_pan_effects)
-            zoomed_clip = scaled_clip.filter(
-                'zoompan', z=selected_effect['z'], x=selected_effect['x'], y=selected_effect['y'],
-                d=int(duration_per_image * config.VIDEO_FPS), s=f'{VIDEO_WIDTH}x{VIDEO_HEIGHT}', fps=config.VIDEO_FPS
-            )
-            animated_clips.append(zoomed_clip)
-
-        if not animated_clips: raise ValueError("No animated clips to process.")
-
-        video_stream = animated_clips[0]
-        if len(animated_clips) > 1:
-            for i in range(1, len(animated_clips)):
-                offset = (duration_per_image - transition_duration) * i
-                video_stream = ffmpeg.filter([video_stream, animated_clips[i]], 'xfade', transition=transition_style, duration=transition_duration, offset=offset)
-        
-        srt_path = temp_dir / "subtitles.srt"
-        create_srt_file_by_word_groups(script, voice_duration, str(srt_path))
-        if srt_path.is_file():
-             video_stream = video_stream.filter('subtitles', filename=str(srt_path).replace('\\', '/'), force_style='FontName=Arial,FontSize=24,PrimaryColour=&HFFFFFF,BorderStyle=1,OutlineColour=&H000000,Outline=1,Shadow=0.5,Alignment=2')
-
-        silent_video_path = str(temp_dir / "silent_video.mp4")
-        ffmpeg.output(video_stream, silent_video_path, vcodec='libx264', pix_fmt='yuv420p', preset='ultrafast', crf=23).overwrite_output().run(capture_stdout=True, capture_stderr=True)
-        print(f"  - Silent video with visuals created at '{silent_video_path}'")
-
-        print("  - Step 3: Preparing final audio track...")
-        voice_stream = ffmpeg.input(voice_audio_path)
-        final_audio_stream = voice_stream
-        
-        # --- [การแก้ไขจุดที่ 2: เปลี่ยน Logic การหาไฟล์เพลง] ---
-        # ตอนนี้เราใช้ music_filename โดยตรง ไม่ต้องเติม .mp3 แล้ว
-        music_path = config.MUSIC_DIR / music_filename 
-        if music_filename != "none" and music_path.is_file():
-            print(f"  - Music file found: {music_filename}. Mixing with controlled weights...")
-            music_stream = ffmpeg.input(str(music_path)).filter('atrim', duration=voice_duration).filter('asetpts', 'PTS-STARTPTS')
-            final_audio_stream = ffmpeg.filter([voice_stream, music_stream], 'amix', duration='first', weights=f"1 {music_volume}")
-        # ----------------------------------------------------
-        
-        final_audio_path = str(temp_dir / "final_audio.aac")
-        ffmpeg.output(final_audio_stream, final_audio_path, acodec='aac').overwrite_output().run(capture_stdout=True, capture_stderr=True)
-        print(f"  - Final audio track created at '{final_audio_path}'")
-
-        print("  - Step 4: Combining video and audio...")
-        final_video_input = ffmpeg.input(silent_video_path)
-        final_audio_input = ffmpeg.input(final_audio_path)
-        output_path = config.CONTENT_DIR / output_filename
-        (
-            ffmpeg.output(
-                final_video_input.video, final_audio_input.audio, str(output_path),
-                vcodec='copy', acodec='copy', shortest=None
-            ).overwrite_output().run(capture_stdout=True, capture_stderr=True)
+        # ชื่อ stage เดียวกับ task ใน pipeline ของ agent_service (story_stage_duration_seconds)
+        with metrics.timed("story_stage_duration_seconds", stage="voice"):
+            voice_track = synthesize_voice_track(script, voice_name, str(temp_dir / "voice.mp3"))
+        with metrics.timed("story_stage_duration_seconds", stage="subtitles"):
+            srt_path = write_subtitles(script, voice_track, str(temp_dir / "subtitles.srt"))
+        with metrics.timed("story_stage_duration_seconds", stage="audio"):
+            audio_path = prepare_audio_track(voice_track, music_filename, music_volume, str(temp_dir / "audio.wav"))
+        if seed is None:
+            seed = seed_from_key(render_cache_key(
+                script, image_paths, voice_name, music_filename, music_volume, aspect_ratio, transition_style
+            ))
+        return render_prepared_video(
+            image_paths, voice_track, srt_path, audio_path, aspect_ratio, transition_style,
+            output_filename, temp_dir, seed=seed, render_mode=render_mode, on_progress=on_progress,
+            encoder_profile=encoder_profile
         )
-        
-        print(f"Video Service: Video created successfully at -> {output_path}")
-        return str(output_path)
 
-    except ffmpeg.Error as e:
-        stderr = e.stderr.decode('utf-8') if e.stderr else "No stderr output."
-        print(f"--- FFmpeg Error ---\n{stderr}")
-        raise e
     except Exception as e:
         print(f"An unexpected error occurred in video service: {e}")
         raise e
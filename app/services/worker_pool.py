@@ -0,0 +1,94 @@
+# --- START OF FILE: app/services/worker_pool.py ---
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Optional
+
+from app import config
+
+# ระบบ Worker ของแอป แยกออกจาก event loop ของ FastAPI
+# - job pool: รัน workflow ทั้งงาน (จำกัดจำนวน job ที่รับไว้ได้ -> เต็มแล้วโยน QueueFullError ให้ endpoint ตอบ 429)
+# - cpu pool: งานหนักของ ffmpeg (จำกัดจำนวน render พร้อมกันไม่ให้แย่ง core กัน)
+# - io pool: การเรียก model ภายนอก (Gemini / Imagen / TTS / Drive) ซึ่งส่วนใหญ่เป็นการรอ network
+# run_cpu / run_io รันงานใน context ของผู้เรียก (contextvars เช่น priority ของ rate_limiter ตามไปด้วย)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+_lock = threading.Lock()
+_executors = {}
+_in_flight_jobs = 0
+
+
+def _executor(name: str, max_workers: int) -> ThreadPoolExecutor:
+    # สร้าง pool เมื่อใช้ครั้งแรก เพื่อให้ import module นี้ได้โดยไม่มี thread ค้าง
+    with _lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+            _executors[name] = executor
+        return executor
+
+
+def job_capacity() -> int:
+    return config.JOB_WORKERS + config.MAX_QUEUED_JOBS
+
+
+def queue_depth() -> int:
+    """จำนวน job ที่รับไว้แล้ว (กำลังรันหรือรอคิว)"""
+    return _in_flight_jobs
+
+
+def _job_finished(_future: Future):
+    global _in_flight_jobs
+    with _lock:
+        _in_flight_jobs -= 1
+
+
+def submit_job(fn: Callable, *args, **kwargs) -> Future:
+    """ส่ง workflow เข้า job pool ถ้าคิวเต็มจะโยน QueueFullError"""
+    global _in_flight_jobs
+    with _lock:
+        if _in_flight_jobs >= job_capacity():
+            raise QueueFullError(f"Job queue is full ({_in_flight_jobs} jobs in flight). Please retry later.")
+        _in_flight_jobs += 1
+    try:
+        future = _executor("job", config.JOB_WORKERS).submit(fn, *args, **kwargs)
+    except Exception:
+        _job_finished(None)
+        raise
+    future.add_done_callback(_job_finished)
+    return future
+
+
+def run_cpu(fn: Callable, *args, **kwargs):
+    """รันงาน CPU หนัก (ffmpeg) ใน cpu pool แล้วรอผล"""
+    return _executor("cpu", config.CPU_WORKERS).submit(contextvars.copy_context().run, fn, *args, **kwargs).result()
+
+
+def run_io(fn: Callable, *args, **kwargs):
+    """รันการเรียก model/network ใน io pool แล้วรอผล"""
+    return _executor("io", config.IO_WORKERS).submit(contextvars.copy_context().run, fn, *args, **kwargs).result()
+
+
+async def run_io_async(fn: Callable, *args, **kwargs):
+    """เวอร์ชันสำหรับ async handler: รอผลจาก io pool โดยไม่ block event loop"""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+    return await loop.run_in_executor(_executor("io", config.IO_WORKERS), call)
+
+
+def shutdown(wait: bool = False):
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait, cancel_futures=True)
+    logging.info("Worker Pool: All executors shut down.")
+
+# --- END OF FILE ---
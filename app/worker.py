@@ -0,0 +1,111 @@
+# --- START OF FILE: app/worker.py ---
+# Worker สำหรับดึงงานจากคิวถาวร (app/services/job_queue.py) ไปทำ
+# รันแยกจาก API ได้หลาย process/หลาย container:  python -m app.worker --concurrency 4
+# หรือรันแบบฝังใน API process (ดู RUN_EMBEDDED_WORKER ใน config.py)
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import uuid
+
+from app import config
+from app.services import job_queue, worker_pool, agent_service, metrics
+
+
+class Worker:
+    def __init__(self, concurrency: int = None, worker_id: str = None):
+        self.concurrency = concurrency or config.JOB_WORKERS
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _heartbeat_loop(self, job_id: str, done: threading.Event):
+        interval = config.JOB_LEASE_SECONDS / 3
+        while not done.wait(interval):
+            if not job_queue.heartbeat(job_id, self.worker_id):
+                logging.warning(f"[{job_id}] Worker {self.worker_id}: Lease lost, another worker may pick this job up.")
+                return
+
+    def _execute(self, job: dict):
+        job_id = job["job_id"]
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat_loop, args=(job_id, done), daemon=True)
+        heartbeat.start()
+        try:
+            agent_service.run_queued_job(job["kind"], job_id, job["payload"], attempt=job["attempts"])
+            job_queue.complete(job_id, self.worker_id)
+        except Exception as e:
+            logging.exception(f"[{job_id}] Worker {self.worker_id}: Job crashed.")
+            job_queue.fail(job_id, self.worker_id, str(e))
+            agent_service.update_job_status(job_id, "failed", error=str(e))
+        finally:
+            done.set()
+
+    def run(self):
+        """วน lease งานจากคิว จนกว่าจะถูกสั่งหยุด"""
+        logging.info(f"Worker {self.worker_id}: Started with concurrency {self.concurrency}.")
+        job_queue.reclaim_expired_leases()
+        agent_service.purge_expired_failures()
+        polls = 0
+        while not self._stop_event.is_set():
+            polls += 1
+            if polls % config.WORKER_RECLAIM_EVERY_POLLS == 0:
+                job_queue.reclaim_expired_leases()
+                agent_service.purge_expired_failures()
+            if worker_pool.queue_depth() >= self.concurrency:
+                self._stop_event.wait(config.WORKER_POLL_SECONDS)
+                continue
+            job = job_queue.lease_next(self.worker_id)
+            if job is None:
+                self._stop_event.wait(config.WORKER_POLL_SECONDS)
+                continue
+            logging.info(f"[{job['job_id']}] Worker {self.worker_id}: Leased {job['kind']} job (attempt {job['attempts']}).")
+            worker_pool.submit_job(self._execute, job)
+        logging.info(f"Worker {self.worker_id}: Stopped leasing new jobs.")
+
+    def start(self) -> "Worker":
+        self._thread = threading.Thread(target=self.run, name="queue-worker", daemon=True)
+        self._thread.start()
+        return self
+
+    def request_stop(self):
+        self._stop_event.set()
+
+    def stop(self):
+        self.request_stop()
+        if self._thread: self._thread.join(timeout=config.WORKER_POLL_SECONDS * 2)
+
+
+def start_embedded_worker() -> Worker:
+    return Worker().start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Story Factory queue worker")
+    parser.add_argument("--concurrency", type=int, default=config.JOB_WORKERS)
+    parser.add_argument("--metrics-port", type=int, default=None, help="เปิด /metrics ของ worker นี้ที่ port นี้")
+    args = parser.parse_args()
+    config.JOB_WORKERS = args.concurrency
+
+    from app import bootstrap
+    bootstrap.configure_logging()
+    bootstrap.init_google_services()
+    bootstrap.preload_assets()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+        logging.info(f"Worker: Serving metrics on port {args.metrics_port}.")
+
+    worker = Worker(concurrency=args.concurrency)
+    signal.signal(signal.SIGTERM, lambda *_: worker.request_stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.request_stop())
+    worker.run()
+    # รองานที่ lease ไปแล้วให้เสร็จก่อนออก (ถ้าถูก kill ระหว่างนี้ lease จะหมดอายุแล้วถูก reclaim)
+    worker_pool.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE ---
@@ -1,12 +1,10 @@
 // File: frontend/src/lib/musicOptions.js
+// ต้องตรงกับไฟล์ใน assets/music (backend จับคู่ชื่อแบบไม่สนตัวพิมพ์เล็ก/ใหญ่ และตอบ 400 ถ้าไม่มีเพลงนั้น)
 
 export const musicOptions = [
     { label: '🎵 None', value: 'none' },
-    { label: '🚀 Adventure', value: 'adventure' }, // ตรงกับ adventure.mp3
-    { label: '😌 Calm', value: 'calm' },         // ตรงกับ calm.mp3
     { label: '웅 Epic', value: 'epic' },         // ตรงกับ Epic.mp3
-    { label: '😂 Funny', value: 'funny' },       // ตรงกับ Funny.mp3
     { label: '🔮 Mysterious', value: 'mysterious' }, // ตรงกับ mysterious.mp3
     { label: '🎹 Relaxing', value: 'relaxing' },   // ตรงกับ Relaxing.mp3
     { label: '⚡ Upbeat', value: 'upbeat' },     // ตรงกับ Upbeat.mp3
-];
\ No newline at end of file
+];
@@ -0,0 +1,198 @@
+# --- START OF FILE: tests/test_google_drive_upload.py ---
+# upload_video_to_drive กับเซิร์ฟเวอร์ Drive ปลอมบนเครื่อง (HTTP จริงผ่าน googleapiclient / httplib2 จริง)
+# เซิร์ฟเวอร์ทำตาม protocol resumable upload ของ Drive v2: POST เปิด session -> PUT ทีละ chunk (308 = รับแล้วถึง byte ไหน)
+# -> PUT "bytes */total" เพื่อถามสถานะหลัง error -> 200 พร้อม file resource เมื่อครบ
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("googleapiclient")
+pytest.importorskip("pydrive2")
+
+import httplib2  # noqa: E402
+from googleapiclient.discovery import build_from_document  # noqa: E402
+from googleapiclient.discovery_cache import get_static_doc  # noqa: E402
+
+from app import config  # noqa: E402
+from app.services import google_drive_service  # noqa: E402
+
+CHUNK = 256 * 1024
+FILE_ID = "file-123"
+
+
+class FakeDrive:
+    def __init__(self):
+        self.received = bytearray()
+        self.total = None
+        self.chunk_requests = []  # (start, end) ของทุก PUT ที่มีข้อมูล
+        self.status_queries = 0
+        self.permissions = []
+        # จำนวนครั้งที่จะตอบ 503 เมื่อ chunk ที่เริ่มที่ byte นี้มาถึง และจำนวน byte ที่เก็บไว้ก่อนตอบ error
+        self.fail_at = {}
+        self.keep_on_failure = 0
+        self.lock = threading.Lock()
+
+
+def _handler(drive: FakeDrive):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, body=None, headers=None):
+            data = json.dumps(body).encode() if body is not None else b""
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _range_header(self):
+            return {"Range": f"bytes=0-{len(drive.received) - 1}"} if drive.received else {}
+
+        def _body(self):
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def do_POST(self):
+            body = self._body()
+            if self.path.startswith("/upload/drive/v2/files") and "uploadType=resumable" in self.path:
+                assert json.loads(body)["parents"] == [{"id": "folder-1"}]
+                port = self.server.server_address[1]
+                return self._reply(200, headers={"Location": f"http://127.0.0.1:{port}/upload/session/1"})
+            if self.path.startswith(f"/drive/v2/files/{FILE_ID}/permissions"):
+                drive.permissions.append(json.loads(body))
+                return self._reply(200, {"id": "anyoneWithLink", "role": "reader", "type": "anyone"})
+            self._reply(404, {"error": {"code": 404, "message": self.path}})
+
+        def do_PUT(self):
+            assert self.path == "/upload/session/1"
+            body = self._body()
+            content_range = self.headers["Content-Range"]
+            with drive.lock:
+                query = re.fullmatch(r"bytes \*/(\d+)", content_range)
+                if query:
+                    drive.status_queries += 1
+                    return self._reply(308, headers=self._range_header())
+                start, end, total = map(int, re.fullmatch(r"bytes (\d+)-(\d+)/(\d+)", content_range).groups())
+                drive.total = total
+                drive.chunk_requests.append((start, end))
+                # ต้องต่อจาก byte ที่รับไว้แล้วพอดี ไม่ส่งซ้ำและไม่ข้าม
+                assert start == len(drive.received), (start, len(drive.received))
+                if drive.fail_at.get(start, 0) > 0:
+                    drive.fail_at[start] -= 1
+                    drive.received += body[:drive.keep_on_failure]
+                    return self._reply(503, {"error": {"code": 503, "message": "Backend Error"}})
+                drive.received += body
+                if len(drive.received) < total:
+                    return self._reply(308, headers=self._range_header())
+            self._reply(200, {"id": FILE_ID, "alternateLink": f"https://drive.example/{FILE_ID}"})
+
+    return Handler
+
+
+class _StubAuth:
+    """แทน GoogleAuth ที่ authenticate แล้ว: service ชี้ไปที่เซิร์ฟเวอร์ปลอม"""
+
+    access_token_expired = False
+    auth_method = None
+
+    def __init__(self, root_url: str):
+        document = json.loads(get_static_doc("drive", "v2"))
+        document["rootUrl"] = root_url
+        self.service = build_from_document(document, http=self.Get_Http_Object())
+
+    def Get_Http_Object(self):
+        http = httplib2.Http(timeout=10)
+        # Drive ใช้ 308 เป็น "Resume Incomplete" ไม่ใช่ redirect (เหมือน GoogleAuth._build_http)
+        http.redirect_codes = http.redirect_codes - {308}
+        return http
+
+
+@pytest.fixture
+def drive(monkeypatch):
+    fake = FakeDrive()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(fake))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(config, "DRIVE_UPLOAD_CHUNK_BYTES", CHUNK)
+    monkeypatch.setattr(google_drive_service, "_GAUTH", _StubAuth(f"http://127.0.0.1:{server.server_address[1]}/"))
+    monkeypatch.setattr(google_drive_service, "_DRIVE", object())
+    monkeypatch.setattr(google_drive_service.time, "sleep", lambda seconds: None)
+    yield fake
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def video(tmp_path):
+    data = bytes(range(256)) * (CHUNK * 3 // 256 + 100)  # 3 chunk เต็ม + เศษ
+    path = tmp_path / "story.mp4"
+    path.write_bytes(data)
+    return path, data
+
+
+def test_resumable_upload_sends_file_in_chunks(drive, video):
+    path, data = video
+    progress = []
+
+    link = google_drive_service.upload_video_to_drive(str(path), "folder-1", on_progress=lambda sent, total: progress.append(sent))
+
+    assert link == f"https://drive.example/{FILE_ID}"
+    assert bytes(drive.received) == data
+    assert drive.chunk_requests == [(0, CHUNK - 1), (CHUNK, 2 * CHUNK - 1), (2 * CHUNK, 3 * CHUNK - 1), (3 * CHUNK, len(data) - 1)]
+    assert drive.status_queries == 0
+    assert drive.permissions == [{"type": "anyone", "role": "reader", "withLink": True}]
+    assert progress == [0, CHUNK, 2 * CHUNK, 3 * CHUNK, len(data)]
+
+
+def test_failed_chunk_resumes_from_server_offset(drive, video):
+    path, data = video
+    # chunk ที่ 2 ล้ม 2 ครั้ง ครั้งละหลังจากเซิร์ฟเวอร์เก็บไว้ได้บางส่วน (เช่นการเชื่อมต่อหลุดกลาง chunk)
+    drive.fail_at = {CHUNK: 1, CHUNK + 1000: 1}
+    drive.keep_on_failure = 1000
+
+    link = google_drive_service.upload_video_to_drive(str(path), "folder-1")
+
+    assert link == f"https://drive.example/{FILE_ID}"
+    assert bytes(drive.received) == data
+    # หลังแต่ละ error ถามสถานะก่อน แล้วต่อจาก byte ที่เซิร์ฟเวอร์ตอบ ไม่เริ่มใหม่จาก 0
+    assert drive.status_queries == 2
+    starts = [start for start, _ in drive.chunk_requests]
+    assert starts[:4] == [0, CHUNK, CHUNK + 1000, CHUNK + 2000]
+    assert 0 not in starts[1:]
+
+
+def test_gives_up_after_max_retries(drive, video, monkeypatch):
+    path, _ = video
+    monkeypatch.setattr(google_drive_service, "UPLOAD_MAX_RETRIES", 2)
+    drive.fail_at = {CHUNK: 10}
+
+    with pytest.raises(Exception) as error:
+        google_drive_service.upload_video_to_drive(str(path), "folder-1")
+
+    assert getattr(error.value, "resp", None) is not None and error.value.resp.status == 503
+    assert drive.chunk_requests.count((CHUNK, 2 * CHUNK - 1)) == 3
+    assert drive.permissions == []
+
+
+def test_authenticate_without_saved_credentials_fails_fast(monkeypatch, tmp_path):
+    monkeypatch.setattr(google_drive_service, "_GAUTH", None)
+    monkeypatch.setattr(google_drive_service, "SETTINGS_YAML_PATH", tmp_path / "missing-settings.yaml")
+    monkeypatch.setattr(config, "DRIVE_CREDENTIALS_FILE", str(tmp_path / "credentials.json"))
+
+    def no_browser(*args, **kwargs):
+        raise AssertionError("must not start the browser flow")
+
+    from pydrive2.auth import GoogleAuth
+    monkeypatch.setattr(GoogleAuth, "LocalWebserverAuth", no_browser)
+    monkeypatch.setattr(GoogleAuth, "CommandLineAuth", no_browser)
+
+    with pytest.raises(google_drive_service.DriveAuthError):
+        google_drive_service.authenticate_gdrive()
+    assert google_drive_service._GAUTH is None
+
+# --- END OF FILE ---
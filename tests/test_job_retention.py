@@ -0,0 +1,83 @@
+# --- START OF FILE: tests/test_job_retention.py ---
+# การเก็บกวาดงานที่ล้มเหลวแล้วไม่มีใคร retry (agent_service.purge_expired_failures) บนฐานข้อมูลชั่วคราว
+import threading
+
+import pytest
+
+from app import config
+from app.services import agent_service, job_checkpoints, job_queue, job_repository
+
+RETENTION = 60.0
+
+
+@pytest.fixture(autouse=True)
+def isolated_db(monkeypatch, tmp_path):
+    monkeypatch.setattr(job_repository, "DB_PATH", str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(job_repository, "_local", threading.local())
+    for module in (job_repository, job_queue, job_checkpoints):
+        monkeypatch.setattr(module, "_schema_ready_pid", None)
+    monkeypatch.setattr(config, "UPLOADS_DIR", tmp_path / "uploads")
+    monkeypatch.setattr(config, "FAILED_JOB_RETENTION_SECONDS", RETENTION)
+
+
+def _finish_job(job_id: str, status: str, crashed: bool = False):
+    """จำลอง worker: lease งาน -> workflow จบด้วย status -> worker complete (หรือ fail ถ้า workflow โยน exception ออกมา)"""
+    agent_service.update_job_status(job_id, "pending", "0/5: Job queued...")
+    job_queue.enqueue(job_id, agent_service.JOB_KIND_MAGIC, dict(prompt="idea"))
+    assert job_queue.lease_next("worker-1")["job_id"] == job_id
+    job_checkpoints.save(job_id, job_checkpoints.STAGE_PLAN, {"story_script": []})
+    (config.UPLOADS_DIR / job_id).mkdir(parents=True)
+    (config.UPLOADS_DIR / job_id / "image_0.png").write_bytes(b"png")
+    agent_service.update_job_status(job_id, status, error="boom" if status == "failed" else "")
+    if crashed:
+        job_queue.fail(job_id, "worker-1", "boom")
+    else:
+        job_queue.complete(job_id, "worker-1")
+
+
+def _age(job_id: str, seconds: float):
+    conn = job_repository.get_connection()
+    conn.execute("UPDATE jobs SET updated_at = updated_at - ? WHERE job_id = ?", (seconds, job_id))
+    conn.execute("UPDATE job_queue SET updated_at = updated_at - ? WHERE job_id = ?", (seconds, job_id))
+
+
+def test_failed_workflows_are_purged_after_retention():
+    # workflow จับ exception เองและ mark failed แต่ worker ยัง complete งาน -> state ในคิวเป็น done
+    _finish_job("handled", "failed")
+    _finish_job("crashed", "failed", crashed=True)
+    assert job_queue.get_state("handled") == job_queue.STATE_DONE
+    for job_id in ("handled", "crashed"):
+        _age(job_id, RETENTION * 2)
+
+    assert agent_service.purge_expired_failures() == 2
+
+    for job_id in ("handled", "crashed"):
+        assert job_checkpoints.load(job_id) == {}
+        assert not (config.UPLOADS_DIR / job_id).exists()
+        assert job_queue.get_state(job_id) is None
+        assert job_repository.get_job(job_id)["status"] == "failed"
+        assert agent_service.retry_job(job_id) is False
+
+
+def test_recent_failures_and_completed_jobs_are_kept():
+    _finish_job("recent", "failed")
+    _finish_job("completed", "completed")
+    _age("completed", RETENTION * 2)
+
+    assert agent_service.purge_expired_failures() == 0
+
+    assert job_checkpoints.load("recent")
+    assert (config.UPLOADS_DIR / "recent").is_dir()
+    assert job_queue.get_state("completed") == job_queue.STATE_DONE
+    assert agent_service.retry_job("recent") is True
+
+
+def test_retention_zero_keeps_everything(monkeypatch):
+    monkeypatch.setattr(config, "FAILED_JOB_RETENTION_SECONDS", 0)
+    _finish_job("old", "failed")
+    _age("old", 10 ** 6)
+
+    assert agent_service.purge_expired_failures() == 0
+    assert job_checkpoints.load("old")
+
+# --- END OF FILE ---
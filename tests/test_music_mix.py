@@ -0,0 +1,51 @@
+# --- START OF FILE: tests/test_music_mix.py ---
+# music_service.mix_with_voice ต้องให้ผลเหมือน amix=duration=first:weights="1 v":normalize=1
+# amix normalize ด้วยน้ำหนักรวมของ input ที่ยังเล่นอยู่ ช่วงหลังเพลงจบเสียงพากย์จึงไม่ถูกหาร
+import wave
+
+import numpy as np
+import pytest
+
+from app.services import music_service
+
+VOICE = 3000.0
+MUSIC = 2000.0
+VOLUME = 0.25
+
+
+def _read_wav(path) -> np.ndarray:
+    with wave.open(str(path), "rb") as f:
+        return np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16).reshape(-1, music_service.CHANNELS)
+
+
+@pytest.fixture
+def tracks(monkeypatch):
+    voice = np.full((music_service.SAMPLE_RATE * 2, music_service.CHANNELS), VOICE, dtype=np.int16)
+    music = np.full((music_service.SAMPLE_RATE // 2, music_service.CHANNELS), MUSIC, dtype=np.int16)
+    monkeypatch.setattr(music_service, "_decode_to_pcm", lambda path: voice)
+    monkeypatch.setattr(music_service, "load_track", lambda name: music if name == "short" else None)
+    return voice, music
+
+
+def test_voice_is_normalized_only_while_music_plays(tracks, tmp_path):
+    voice, music = tracks
+    output = tmp_path / "mixed.wav"
+
+    music_service.mix_with_voice("voice.mp3", "short", VOLUME, str(output))
+
+    mixed = _read_wav(output)
+    assert len(mixed) == len(voice)
+    overlap = int((VOICE + VOLUME * MUSIC) / (1 + VOLUME))
+    assert np.all(np.abs(mixed[:len(music)].astype(int) - overlap) <= 1)
+    assert np.all(mixed[len(music):] == VOICE)
+
+
+def test_without_music_voice_is_unchanged(tracks, tmp_path):
+    voice, _ = tracks
+    output = tmp_path / "mixed.wav"
+
+    music_service.mix_with_voice("voice.mp3", music_service.NO_MUSIC, VOLUME, str(output))
+
+    assert np.array_equal(_read_wav(output), voice)
+
+# --- END OF FILE ---
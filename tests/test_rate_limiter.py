@@ -0,0 +1,109 @@
+# --- START OF FILE: tests/test_rate_limiter.py ---
+# rate limiter ของ model_loop กับโควต้าปลอม (SimulatedQuota ใน app/bench/fakes.py) บน loop กลางจริง
+# แต่ละ test ใช้ชื่อ backend ของตัวเอง bucket / semaphore จึงไม่ปนกับ test อื่น
+import asyncio
+import time
+import uuid
+
+import pytest
+
+from app import config
+from app.bench import fakes
+from app.services import model_loop, rate_limiter
+
+CEILING_PER_MINUTE = 600  # 10 ครั้งต่อวินาที, burst 50
+COOLDOWN = 0.2
+LATENCY = 0.05  # เวลาที่การเรียกแต่ละครั้งค้างอยู่ที่ server (การเรียกในคลื่นเดียวกันจึงค้างอยู่พร้อมกันจริง)
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    name = f"test-{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(config, "MODEL_RATE_PER_MINUTE", dict(config.MODEL_RATE_PER_MINUTE, **{name: CEILING_PER_MINUTE}))
+    monkeypatch.setattr(config, "MODEL_MAX_IN_FLIGHT", dict(config.MODEL_MAX_IN_FLIGHT, **{name: 32}))
+    monkeypatch.setattr(config, "QUOTA_COOLDOWN_SECONDS", COOLDOWN)
+    monkeypatch.setattr(config, "QUOTA_COOLDOWN_MAX_SECONDS", 1.0)
+    return name
+
+
+async def _call(backend: str, quota: fakes.SimulatedQuota, level: int = rate_limiter.DEFAULT, order: list = None, label=None) -> bool:
+    """การเรียก 1 ครั้งผ่าน slot ของ backend คืน False ถ้าโควต้าปลอมตอบ 429"""
+    with rate_limiter.priority(level):
+        try:
+            async with model_loop.slot(backend):
+                if order is not None: order.append(label)
+                await asyncio.sleep(LATENCY)
+                quota.check()
+            return True
+        except fakes.QuotaExceeded:
+            return False
+
+
+async def _wave(backend: str, quota: fakes.SimulatedQuota, count: int, level: int = rate_limiter.DEFAULT):
+    return await asyncio.gather(*(_call(backend, quota, level) for _ in range(count)))
+
+
+def test_quota_errors_lower_the_rate_once_per_wave_then_recover(backend):
+    quota = fakes.SimulatedQuota(limit=3, window=1.0)
+
+    results = model_loop.run(_wave(backend, quota, 10))
+    limiter = rate_limiter.bucket(backend)
+
+    assert results.count(True) == 3 and quota.rejected == 7
+    # ทั้ง 7 ครั้งได้ token ก่อนการปรับครั้งแรก จึงลด rate แค่ครั้งเดียว และหยุดจ่าย token ช่วง cooldown
+    assert limiter.quota_errors == 7
+    assert limiter.rate == pytest.approx(limiter.max_rate * rate_limiter.DECREASE_FACTOR)
+    assert 0 < model_loop.run(_snapshot(backend))["paused_seconds"] <= COOLDOWN
+
+    # โควต้าของ server กลับมาแล้ว: การเรียกแรกต้องรอให้หมด cooldown ก่อน แล้ว rate ค่อยๆ เพิ่มกลับถึงเพดาน
+    quota.limit = 1000
+    started = time.monotonic()
+    assert model_loop.run(_call(backend, quota))
+    assert time.monotonic() - started >= COOLDOWN * 0.9
+    successes = 1
+    while limiter.rate < limiter.max_rate and successes < 3 / rate_limiter.RECOVERY_STEP:
+        assert model_loop.run(_call(backend, quota))
+        successes += 1
+    assert limiter.rate == pytest.approx(limiter.max_rate)
+    # จาก 50% กลับถึง 100% ด้วยขั้นละ RECOVERY_STEP ของเพดาน
+    assert successes == pytest.approx((1 - rate_limiter.DECREASE_FACTOR) / rate_limiter.RECOVERY_STEP, abs=1)
+
+
+def test_repeated_quota_errors_back_off_further(backend):
+    quota = fakes.SimulatedQuota(limit=1, window=30.0)
+
+    model_loop.run(_wave(backend, quota, 4))
+    limiter = rate_limiter.bucket(backend)
+    first_rate = limiter.rate
+    # การเรียกหลัง cooldown ยังเจอ 429 (โควต้ายังไม่คืน) -> ลดลงอีก และ cooldown ยาวขึ้นเป็นเท่าตัว
+    assert not model_loop.run(_call(backend, quota))
+    assert limiter.rate == pytest.approx(first_rate * rate_limiter.DECREASE_FACTOR)
+    assert model_loop.run(_snapshot(backend))["paused_seconds"] > COOLDOWN
+
+
+def test_interactive_calls_go_ahead_of_batch_calls(backend):
+    quota = fakes.SimulatedQuota(limit=2, window=1.0)
+    # คลื่นแรกของงาน batch เกินโควต้า -> limiter หยุดจ่าย token ช่วง cooldown ทุกการเรียกหลังจากนี้ต้องเข้าคิว
+    model_loop.run(_wave(backend, quota, 6, rate_limiter.BATCH))
+    quota.limit = 1000
+    order = []
+
+    async def scenario():
+        batch = [asyncio.ensure_future(_call(backend, quota, rate_limiter.BATCH, order, "batch")) for _ in range(4)]
+        await asyncio.sleep(0.02)  # งาน interactive มาถึงทีหลังงาน batch ที่รออยู่แล้ว
+        interactive = [asyncio.ensure_future(_call(backend, quota, rate_limiter.INTERACTIVE, order, "interactive")) for _ in range(2)]
+        await asyncio.sleep(0.02)
+        waiting = rate_limiter.bucket(backend).snapshot()["waiting"]
+        return waiting, await asyncio.gather(*batch, *interactive)
+
+    waiting, results = model_loop.run(scenario())
+
+    assert waiting == 6
+    assert all(results)
+    assert order == ["interactive"] * 2 + ["batch"] * 4
+
+
+async def _snapshot(backend: str):
+    return rate_limiter.bucket(backend).snapshot()
+
+# --- END OF FILE ---
@@ -0,0 +1,68 @@
+# --- START OF FILE: tests/test_render_cache.py ---
+# cache hit ของ RENDER_CACHE hardlink ไฟล์ใน cache ไปเป็น CONTENT_DIR/<job_id>.mp4
+# render ครั้งต่อไปที่ใช้ชื่อเดียวกันต้องไม่เขียนทับ inode ที่ใช้ร่วมกับ cache
+import pytest
+
+from app import config
+from app.services import video_service
+from app.services.cache_service import DiskCache
+
+JOB_VIDEO = "job-1.mp4"
+
+
+@pytest.fixture
+def render_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "CONTENT_DIR", tmp_path / "content")
+    monkeypatch.setattr(config, "CACHE_DIR", tmp_path / "cache")
+    config.CONTENT_DIR.mkdir()
+    monkeypatch.setattr(video_service, "build_audio_stream", lambda audio_path: None)
+    monkeypatch.setattr(video_service, "build_visual_stream", lambda *args, **kwargs: None)
+    cache = DiskCache("renders-test", max_bytes=10 ** 6, suffix=".mp4")
+    source = tmp_path / "previous.mp4"
+    source.write_bytes(b"cached render")
+    cache.put_file("key", str(source))
+    assert cache.get_copy("key", str(config.CONTENT_DIR / JOB_VIDEO))
+    return cache
+
+
+def _render(tmp_path):
+    return video_service.render_prepared_video(
+        image_paths=["a.png", "b.png"], voice_track={"path": "voice.mp3", "duration": 6.0}, srt_path=None,
+        audio_path="audio.m4a", aspect_ratio="9:16", transition_style="fade", output_filename=JOB_VIDEO,
+        temp_dir=tmp_path, seed=1, render_mode=video_service.RENDER_MODE_SINGLE_PASS, frame_paths=["a.png", "b.png"]
+    )
+
+
+def _fake_render(data: bytes, error: Exception = None):
+    def render(video_stream, audio_stream, output_path, *args):
+        # เหมือน ffmpeg -y: เปิดชื่อไฟล์ปลายทางแบบ truncate แล้วเขียนทับ
+        with open(output_path, "wb") as f:
+            f.write(data)
+        if error:
+            raise error
+        return 0
+    return render
+
+
+def test_render_after_cache_hit_leaves_cached_file_intact(render_cache, monkeypatch, tmp_path):
+    monkeypatch.setattr(video_service, "_render_single_pass", _fake_render(b"new render"))
+
+    output_path = _render(tmp_path)
+
+    assert output_path == str(config.CONTENT_DIR / JOB_VIDEO)
+    assert (config.CONTENT_DIR / JOB_VIDEO).read_bytes() == b"new render"
+    assert render_cache.path_for("key").read_bytes() == b"cached render"
+    assert sorted(path.name for path in config.CONTENT_DIR.iterdir()) == [JOB_VIDEO]
+
+
+def test_failed_render_keeps_previous_output_and_cache(render_cache, monkeypatch, tmp_path):
+    monkeypatch.setattr(video_service, "_render_single_pass", _fake_render(b"trunc", RuntimeError("encoder died")))
+
+    with pytest.raises(RuntimeError):
+        _render(tmp_path)
+
+    assert (config.CONTENT_DIR / JOB_VIDEO).read_bytes() == b"cached render"
+    assert render_cache.path_for("key").read_bytes() == b"cached render"
+    assert sorted(path.name for path in config.CONTENT_DIR.iterdir()) == [JOB_VIDEO]
+
+# --- END OF FILE ---